@@ -0,0 +1,160 @@
+
+import numpy as np
+import time
+from similarityEngine import buildRatingMatrices
+from syntheticRatings import syntheticRatingsFrame
+
+
+#Approximate nearest neighbor search over game vectors, so a nearest games query doesn't have to scan every game
+#like knearest does.  The vectors can be any game embedding: random projections of the mean-centered rating
+#columns (ratingEmbeddings), the game factors of a FactorModel (factorEmbeddings) or the rows of
+#buildGameFeaturesDf.  The factors find knearest's neighbors best: random projections of the sparse rating
+#columns are noisy.
+#The index is random-projection LSH for cosine similarity: every table hashes a game to the signs of its vector's
+#dot products with numBits random hyperplanes, so games pointing in similar directions tend to share a bucket.
+#A query collects the games in its bucket in each table, plus (multi-probe) the buckets one bit flip away along
+#the query's probes least certain hyperplanes, and ranks those candidates exactly.  More tables and more probes
+#find more of the true neighbors for more candidates to rank; those two are the recall/latency knob.
+#Buckets are kept as each table's games sorted by hash, looked up with searchsorted.
+
+#Returns a numGames x dims array of random projections of the user-mean-centered rating columns of df (rows in
+#gameNames index order), whose cosine similarities approximate those of the full columns
+def ratingEmbeddings(df, gameNames, dims=64, seed=0):
+    X,B,rowCounts=buildRatingMatrices(df,gameNames)
+    projection=np.random.RandomState(seed).normal(0.,1.,(X.shape[0],dims))/np.sqrt(dims)
+    return np.asarray(X.T.tocsr()*projection)
+
+#Returns the game factors of a FactorModel with rows in gameNames index order
+def factorEmbeddings(model, gameNames):
+    vectors=np.empty((len(gameNames),model.numFactors))
+    for name,i in gameNames.items():
+        vectors[i]=model.Q[model.rindex.gameCodes[name]]
+    return vectors
+
+class LSHIndex:
+    def __init__(self, vectors, names, numTables=8, numBits=12, seed=0):
+        norms=np.sqrt((vectors*vectors).sum(axis=1))
+        self.vectors=vectors/np.where(norms>0,norms,1.)[:,None]
+        self.names=list(names)
+        self.nameIndex=dict((name,i) for i,name in enumerate(self.names))
+        self.numBits=numBits
+        rand=np.random.RandomState(seed)
+        self.planes=rand.normal(0.,1.,(numTables,vectors.shape[1],numBits))
+        self.bitValues=np.int64(1)<<np.arange(numBits,dtype=np.int64)
+        self.order=[]
+        self.sortedCodes=[]
+        for planes in self.planes:
+            codes=(self.vectors.dot(planes)>0).dot(self.bitValues)
+            order=np.argsort(codes,kind='mergesort')
+            self.order.append(order)
+            self.sortedCodes.append(codes[order])
+
+    #indices of the games sharing a probed bucket with the vector v, in the first numTables tables
+    def candidates(self, v, numTables=None, probes=0):
+        found=[]
+        for t in range(numTables or len(self.planes)):
+            projections=v.dot(self.planes[t])
+            code=(projections>0).dot(self.bitValues)
+            codes=[code]
+            #the buckets across the hyperplanes the query is closest to
+            for bit in np.argsort(np.abs(projections))[:probes]:
+                codes.append(code^self.bitValues[bit])
+            codes=np.array(codes)
+            starts=np.searchsorted(self.sortedCodes[t],codes,side='left')
+            ends=np.searchsorted(self.sortedCodes[t],codes,side='right')
+            for start,end in zip(starts,ends):
+                found.append(self.order[t][start:end])
+        return np.unique(np.concatenate(found)) if found else np.array([],dtype=np.int64)
+
+    #The approximate k nearest games to gameName by cosine similarity, as [(gameName, cosine similarity), ...].
+    #With dbase (a Database of the same games) the candidates are ranked like knearest instead, by shrunk
+    #similarity, and returned in knearest's (gameName, shrunk sim, support) format
+    def knearest(self, gameName, k=7, numTables=None, probes=0, dbase=None, reg=200.):
+        i=self.nameIndex[gameName]
+        found=self.candidates(self.vectors[i],numTables,probes)
+        found=found[found!=i]
+        if dbase is not None:
+            sims=[dbase.get(gameName,self.names[j]) for j in found]
+            shrunk=np.array([(sup*sim)/(sup+reg) for sim,sup in sims])
+            top=np.argsort(-shrunk,kind='mergesort')[:k]
+            return [(self.names[found[j]],shrunk[j],sims[j][1]) for j in top]
+        scores=self.vectors[found].dot(self.vectors[i])
+        top=np.argsort(-scores,kind='mergesort')[:k]
+        return [(self.names[found[j]],scores[j]) for j in top]
+
+    #the exact k nearest games by cosine similarity, scanning every game
+    def exactKnearest(self, gameName, k=7):
+        i=self.nameIndex[gameName]
+        scores=self.vectors.dot(self.vectors[i])
+        scores[i]=-np.inf
+        top=np.argsort(-scores,kind='mergesort')[:k]
+        return [(self.names[j],scores[j]) for j in top]
+
+
+#the share of the exact top K games that the approximate top K found, averaged over the queries.  Both are lists
+#of knearest style results, one per query
+def recallAtK(exact, approximate):
+    return np.mean([len(set(item[0] for item in e)&set(item[0] for item in a))/float(len(e))
+                    for e,a in zip(exact,approximate) if len(e)])
+
+#Recall@K of the index against the exact knearest over a Database of the same games, with the candidates ranked
+#by shrunk similarity like knearest, for each (numTables, probes) setting
+def recallAgainstKnearest(index, dbase, queries, k=7, reg=200., settings=((2,0),(4,1),(8,2))):
+    from buildPandasDF import knearest
+    allGames=np.array(index.names,dtype=object)
+    exact=[knearest(game,allGames,dbase,k,reg) for game in queries]
+    results=[]
+    for numTables,probes in settings:
+        start=time.time()
+        approx=[index.knearest(game,k,numTables,probes,dbase,reg) for game in queries]
+        elapsed=(time.time()-start)/len(queries)
+        recall=recallAtK(exact,approx)
+        print '%2s tables %s probes | recall@%s %.3f | %7.3f ms/query' % (numTables,probes,k,recall,elapsed*1000)
+        results.append((numTables,probes,recall,elapsed))
+    return results
+
+#Builds an index over numGames synthetic clustered game vectors and reports build time, recall@K against the
+#exact scan and query latency for a sweep of (numTables, probes) settings
+def benchmarkAnnIndex(numGames=50000, dims=32, numClusters=500, k=10, numQueries=200, numBits=14,
+                      settings=((1,0),(2,0),(4,0),(4,2),(8,2),(8,4),(16,4))):
+    rand=np.random.RandomState(0)
+    centers=rand.normal(0.,1.,(numClusters,dims))
+    vectors=centers[rand.randint(0,numClusters,numGames)]+rand.normal(0.,0.5,(numGames,dims))
+    names=['Game %s' % i for i in range(numGames)]
+    start=time.time()
+    index=LSHIndex(vectors,names,numTables=max(t for t,p in settings),numBits=numBits)
+    print '%s games, %s dims: index built in %.2fs' % (numGames,dims,time.time()-start)
+    queries=[names[i] for i in rand.randint(0,numGames,numQueries)]
+    start=time.time()
+    exact=[index.exactKnearest(game,k) for game in queries]
+    exactTime=(time.time()-start)/numQueries
+    print 'exact scan                | %7.3f ms/query' % (exactTime*1000)
+    results=[]
+    for numTables,probes in settings:
+        start=time.time()
+        approx=[index.knearest(game,k,numTables,probes) for game in queries]
+        elapsed=(time.time()-start)/numQueries
+        recall=recallAtK(exact,approx)
+        print '%2s tables %s probes | recall@%s %.3f | %7.3f ms/query' % (numTables,probes,k,recall,elapsed*1000)
+        results.append((numTables,probes,recall,elapsed))
+    return results
+
+#Recall@K against the exact knearest on a synthetic ratings frame with taste structure, with the index built
+#over FactorModel game factors and the candidates ranked like knearest
+def benchmarkKnearestRecall(numUsers=20000, numGames=1000, numFactors=16, numBits=8, k=7, numQueries=100,
+                            settings=((2,0),(4,1),(8,2),(16,3))):
+    from buildPandasDF import Database
+    from matrixFactorization import FactorModel
+    df=syntheticRatingsFrame(numUsers=numUsers,numGames=numGames,ratingsPerUser=40,numTastes=8)
+    db=Database(df)
+    db.populate_by_vectorizing(blockSize=500)
+    model=FactorModel(df,numFactors=numFactors,numIters=5)
+    names=[None]*len(db.gameNames)
+    for name,i in db.gameNames.items():
+        names[i]=name
+    index=LSHIndex(factorEmbeddings(model,db.gameNames),names,numTables=max(t for t,p in settings),numBits=numBits)
+    return recallAgainstKnearest(index,db,names[:numQueries],k,settings=settings)
+
+if __name__ == '__main__':
+    benchmarkAnnIndex()
+    benchmarkKnearestRecall()
@@ -0,0 +1,153 @@
+
+import numpy as np
+import time
+from ratingsIndex import RatingsIndex
+from syntheticRatings import syntheticRatingsFrame
+
+
+#Predicts ratings for many (user, game) pairs at once, with the same results as calling ratingPredictor (with a
+#RatingsIndex) on every pair.  The pairs are taken chunkSize at a time and grouped by user; for each user the
+#similarities of all the user's target games to all the games the user rated are gathered from the database in
+#one go (a targets x rated games array, or targets x K for a neighbor index), the k nearest are picked with the
+#same sort knearest uses, and the baseline terms are gathered from the index's means.  Memory stays bounded by
+#the chunk, whatever the number of pairs.
+#The neighbor sums are accumulated one neighbor position at a time, in knearest's order, so they are added up
+#in the same order as ratingPredictor's sum() and the predictions come out bit for bit the same.
+
+#the user's distinct rated games as database indices, in the order knearest_amongst_userrated gets them (first
+#appearance in df), and the user's first rating of each.  toDbase maps the index's game codes to the database's
+def _userRatedGames(rindex, toDbase, user):
+    rows=rindex.userRows(user)
+    unique,first=np.unique(rindex.rowGameCodes[rows],return_index=True)
+    first=np.sort(first)
+    return toDbase[rindex.rowGameCodes[rows[first]]],rindex.ratings[rows[first]]
+
+#per target, the positions (into the user's rated games) of the k nearest rated games, -1 padded, using the
+#dense arrays like knearest: quicksort on the shrunk similarities, reversed, skipping the target itself
+def denseNeighborPositions(dbase, targets, codes, k, reg):
+    sim=dbase.database_sim[np.ix_(targets,codes)]
+    sup=dbase.database_sup[np.ix_(targets,codes)]
+    shrunk=(sup*sim)/(sup+reg)
+    order=np.argsort(shrunk,axis=1)[:,::-1]
+    isSelf=codes[order]==targets[:,None]
+    #the target drops out and the rest move up one place, which is what knearest's pop and append do
+    keep=~isSelf
+    ranks=np.cumsum(keep,axis=1)-1
+    picked=-np.ones((len(targets),k),dtype=np.int64)
+    rows,cols=np.nonzero(keep&(ranks<k))
+    picked[rows,ranks[rows,cols]]=order[rows,cols]
+    return picked
+
+#the same with a neighbor index: the target's stored neighbors that the user rated, stably sorted by shrunk
+#similarity like NeighborIndex.knearest.  Also returns the picked neighbors' stored similarities
+def indexNeighborPositions(index, targets, codes, k, reg):
+    picked=-np.ones((len(targets),k),dtype=np.int64)
+    pickedSims=np.zeros((len(targets),k))
+    if len(codes)==0 or len(targets)==0:
+        return picked,pickedSims
+    starts,lengths=index.rowBounds(targets)
+    width=lengths.max()
+    valid=np.arange(width)[None,:]<lengths[:,None]
+    positions=np.where(valid,starts[:,None]+np.arange(width)[None,:],0)
+    neighbors=index.neighbors[positions]
+    sims=index.sims[positions]
+    sups=index.sups[positions]
+    #where each stored neighbor sits among the user's rated games, -1 if the user didn't rate it
+    sortedCodes=np.argsort(codes,kind='mergesort')
+    at=sortedCodes[np.clip(np.searchsorted(codes[sortedCodes],neighbors),0,len(codes)-1)]
+    rated=valid&(codes[at]==neighbors)
+    shrunk=(sups*sims)/(sups+reg)
+    order=np.argsort(np.where(rated,-shrunk,np.inf),axis=1,kind='mergesort')[:,:k]
+    rows=np.arange(len(targets))[:,None]
+    width=order.shape[1]
+    picked[:,:width]=np.where(rated[rows,order],at[rows,order],-1)
+    pickedSims[:,:width]=sims[rows,order]
+    return picked,pickedSims
+
+#Returns an array of predicted ratings for the pairs (users[i], gameNames[i]), like
+#ratingPredictor(df,dbase,gameNames[i],users[i],k,reg,rindex) for each i.  dbase is a Database (dense arrays or
+#a neighbor index) or an IncrementalSimilarity, and rindex a RatingsIndex of the ratings frame
+def predictBatch(users, gameNames, dbase, rindex, k=7, reg=200., chunkSize=10000):
+    users=np.asarray(users,dtype=object)
+    gameNames=np.asarray(gameNames,dtype=object)
+    predictions=np.empty(len(users))
+    index=getattr(dbase,'neighborIndex',None)
+    dense=getattr(dbase,'database_sim',None)
+    #the index's games as database indices, and every database game's mean rating
+    toDbase=np.array([dbase.gameNames[name] for name in rindex.gameNameList()],dtype=np.int64)
+    gameMeans=np.empty(len(dbase.gameNames))
+    for name,i in dbase.gameNames.items():
+        gameMeans[i]=rindex.gameMean(name)
+    for start in range(0,len(users),chunkSize):
+        chunk=np.arange(start,min(start+chunkSize,len(users)))
+        chunkTargets=np.array([dbase.gameNames[name] for name in gameNames[chunk]],dtype=np.int64)
+        byUser={}
+        for i,user in enumerate(users[chunk]):
+            byUser.setdefault(user,[]).append(i)
+        for user,local in byUser.items():
+            pairs=chunk[local]
+            targets=chunkTargets[local]
+            codes,ratings=_userRatedGames(rindex,toDbase,user)
+            userMean=rindex.userMean(user)
+            base=rindex.globalMean+(userMean-rindex.globalMean)+(gameMeans[targets]-rindex.globalMean)
+            if index is not None:
+                picked,pickedSims=indexNeighborPositions(index,targets,codes,k,reg)
+            else:
+                picked=denseNeighborPositions(dbase,targets,codes,k,reg)
+            neighborBase=rindex.globalMean+(userMean-rindex.globalMean)+(gameMeans[codes]-rindex.globalMean)
+            simSum=np.zeros(len(pairs))
+            weighted=np.zeros(len(pairs))
+            for j in range(picked.shape[1]):
+                has=picked[:,j]>=0
+                if not has.any():
+                    break
+                rated=np.where(has,picked[:,j],0)
+                #ratingPredictor takes the similarities from dbase.get, which uses the dense arrays when there are any
+                if dense is not None:
+                    s=dense[targets,codes[rated]]
+                else:
+                    s=pickedSims[:,j]
+                s=np.where(has,s,0.)
+                weighted+=np.where(has,(ratings[rated]-neighborBase[rated])*s,0.)
+                simSum+=s
+            noSims=(simSum==0)|np.isnan(simSum)
+            predictions[pairs]=np.where(noSims,base,base+weighted/np.where(noSims,1.,simSum))
+    return predictions
+
+
+#Times predictBatch against looping ratingPredictor (with a RatingsIndex) on a synthetic frame, for the dense
+#arrays and a top-K neighbor index, and checks the predictions are equal.  The pairs are gamesPerUser random games
+#for each of numPairs/gamesPerUser random users, like scoring a list of games for a newsletter audience
+def benchmarkBatchPredictor(numUsers=5000, numGames=300, numPairs=2000, gamesPerUser=20, K=50, k=7, reg=200., chunkSize=1000):
+    from buildPandasDF import Database, ratingPredictor
+    import sys, StringIO
+    df=syntheticRatingsFrame(numUsers=numUsers,numGames=numGames,ratingsPerUser=25)
+    rindex=RatingsIndex(df)
+    rand=np.random.RandomState(0)
+    users=np.repeat(df.user.values[rand.randint(0,len(df),numPairs//gamesPerUser)],gamesPerUser)
+    games=df.gameName.values[rand.randint(0,len(df),len(users))]
+    numPairs=len(users)
+    dbDense=Database(df)
+    dbDense.populate_by_vectorizing()
+    dbIndex=Database(df,dense=False)
+    dbIndex.build_neighbor_index(K=K,reg=reg)
+    results=[]
+    for label,db in (('dense',dbDense),('neighbor index',dbIndex)):
+        #ratingPredictor prints when a pair has no similarities
+        stdout,sys.stdout=sys.stdout,StringIO.StringIO()
+        try:
+            start=time.time()
+            looped=np.array([ratingPredictor(df,db,game,user,k,reg,rindex) for user,game in zip(users,games)])
+            loopTime=time.time()-start
+        finally:
+            sys.stdout=stdout
+        start=time.time()
+        batch=predictBatch(users,games,db,rindex,k,reg,chunkSize)
+        batchTime=time.time()-start
+        equal=np.array_equal(looped,batch)
+        print '%-15s | looped %9.0f pairs/sec | batch %9.0f pairs/sec | equal: %s' % (label,numPairs/loopTime,numPairs/batchTime,equal)
+        results.append((label,numPairs/loopTime,numPairs/batchTime,equal))
+    return results
+
+if __name__ == '__main__':
+    benchmarkBatchPredictor()
@@ -4,6 +4,14 @@ import pandas as pd
 import numpy as np
 import os
 import pickle
+from columnBuilder import ColumnBuilder
+from ratingsStore import RatingsStore, importScrapedCsvs
+from similarityEngine import populateSimilarityArrays, parallelSimilarityArrays
+from neighborIndex import buildNeighborIndex
+from ratingsIndex import RatingsIndex
+import time
+#the optional tools (the mrjob export, the http service, snapshots, evaluation, factor models...) are imported
+#where they are used, so importing this module doesn't need their dependencies
 
 
 # takes a dataframe ldf, makes a copy of it, and returns the copy
@@ -31,10 +39,13 @@ def recompute_frame(ldf):
 #  Given a subframe of game1 reviews and a subframe of game2 reviews,
 #  where the reviewers are those who have reviewed both games, return 
 #  the pearson correlation coefficient between the user average subtracted ratings.
+#  pearsonr pairs values by position, so both subframes are put in user order first
 def pearson_sim(game1_reviews, game2_reviews, n_common):
     if n_common==0:
         rho=0.
     else:
+        game1_reviews=game1_reviews.sort(['user'])
+        game2_reviews=game2_reviews.sort(['user'])
         diff1=game1_reviews['rating']-game1_reviews['user_avg']
         diff2=game2_reviews['rating']-game2_reviews['user_avg']
         rho=pearsonr(diff1, diff2)[0]
@@ -43,8 +54,8 @@ def pearson_sim(game1_reviews, game2_reviews, n_common):
 #alternative similarity metric for 2 games
 #compute cosine similarity of v1 to v2: (v1 dot v1)/{||v1||*||v2||)
 def cosine_similarity(game1_reviews, game2_reviews, n_common):
-    v1=game1_reviews['rating'].values
-    v2=game2_reviews['rating'].values
+    v1=game1_reviews.sort(['user'])['rating'].values
+    v2=game2_reviews.sort(['user'])['rating'].values
     sumxx, sumxy, sumyy = 0, 0, 0
     for i in range(len(v1)):
         x = v1[i]; y = v2[i]
@@ -80,6 +91,22 @@ def get_game_reviews(game, df, set_of_users):
     reviews = reviews[reviews.user.duplicated()==False]
     return reviews
 
+#compares the shrunk similarities in a populated database against calculate_similarity on a random sample
+#of game pairs, and times both.  Returns the largest absolute difference
+def check_against_pairwise(db, similarity_func=pearson_sim, numPairs=200, reg=1000., seed=0):
+    rand=np.random.RandomState(seed)
+    names=db.gameNames.keys()
+    pairs=[(names[i],names[j]) for i,j in rand.randint(0,len(names),(numPairs,2))]
+    start=time.time()
+    expected=[shrunk_sim(*calculate_similarity(g1, g2, db.df, similarity_func)+(reg,)) for g1,g2 in pairs]
+    pairwiseTime=time.time()-start
+    got=[shrunk_sim(*db.get(g1, g2)+(reg,)) for g1,g2 in pairs]
+    maxDiff=np.max(np.abs(np.array(expected)-np.array(got)))
+    print 'max shrunk similarity difference over %s pairs: %g' % (numPairs, maxDiff)
+    print 'calculate_similarity: %.4fs per pair, about %.0fs for all %s pairs' % (
+        pairwiseTime/numPairs, pairwiseTime/numPairs*len(names)*(len(names)-1)/2, len(names)*(len(names)-1)/2)
+    return maxDiff
+
 #takes a similarity and shrinks it down by using the regularizer
 #this down-weights comparisons with low common support
 def shrunk_sim(sim, n_common, reg=1000.):
@@ -89,19 +116,37 @@ def shrunk_sim(sim, n_common, reg=1000.):
 class Database:
     # A class representing a database of similaries and common supports
     
-    def __init__(self, df):
+    def __init__(self, df, numWorkers=1, dense=True):
         # "the constructor, takes a reviews dataframe like smalldf as its argument"
+        # numWorkers>1 makes populate_by_vectorizing compute tiles on that many processes
+        # dense=False skips the G x G arrays, for databases that only use a neighbor index.  With numWorkers>1
+        # they aren't allocated here either: populate_by_vectorizing makes them in shared memory
+        # df=None makes an empty database for loadSnapshot to fill in (see modelSnapshot.py)
         database={}
         self.df=df
-        self.gameNames={v:k for (k,v) in enumerate(df.gameName.unique())}
-        keys=self.gameNames.keys()
-        l_keys=len(keys)
+        self.numWorkers=numWorkers
+        self.neighborIndex=None
+        if df is None:
+            self.gameNames={}
+        else:
+            self.gameNames={v:k for (k,v) in enumerate(df.gameName.unique())}
+        self.database_sim=None
+        self.database_sup=None
+        if dense and df is not None and numWorkers<=1:
+            self.allocate_dense()
+
+    # the G x G similarity and support arrays, zeroed.  The populators allocate them for a database made with
+    # dense=False
+    def allocate_dense(self):
+        l_keys=len(self.gameNames)
         self.database_sim=np.zeros([l_keys,l_keys])
         self.database_sup=np.zeros([l_keys, l_keys], dtype=np.int)
         
     def populate_by_calculating(self, similarity_func):
         # a populator for every pair of games in df. takes similarity_func like
         # pearson_sim as argument
+        if self.database_sim is None:
+            self.allocate_dense()
         counter=0
         items=self.gameNames.items()    
         totalComparisons=len(items)**2
@@ -121,16 +166,41 @@ class Database:
                     nsup=self.df[self.df.gameName==g1].user.count()
                     self.database_sim[i1][i1]=1.
                     self.database_sup[i1][i1]=nsup
+
+    # a populator giving the same pearson_sim results as populate_by_calculating(pearson_sim), computed for all
+    # pairs at once with sparse matrix products (see similarityEngine.py).  blockSize bounds how many games'
+    # columns are computed at a time.  With numWorkers>1 the arrays are computed in blockSize x blockSize tiles
+    # by a process pool, with the same results bit for bit
+    def populate_by_vectorizing(self, blockSize=None):
+        if self.numWorkers>1:
+            #drop any arrays from before so only the shared ones are held
+            self.database_sim=self.database_sup=None
+            self.database_sim, self.database_sup=parallelSimilarityArrays(self.df, self.gameNames, self.numWorkers, blockSize or 500)
+        else:
+            if self.database_sim is None:
+                self.allocate_dense()
+            populateSimilarityArrays(self.df, self.gameNames, self.database_sim, self.database_sup, blockSize)
                     
 
+    # builds a top-K neighbor index (see neighborIndex.py) without the dense arrays.  knearest answers
+    # from it once it's built, and so does get when there are no dense arrays
+    def build_neighbor_index(self, K=50, reg=1000., blockSize=1000):
+        self.neighborIndex=buildNeighborIndex(self.df, self.gameNames, K, reg, blockSize)
+        self.neighborIndex.reportMemory()
+
     def get(self, g1, g2):
        # "returns a tuple of similarity,common_support given two business ids"
+        if self.database_sim is None:
+            return self.neighborIndex.get(g1, g2)
         sim=self.database_sim[self.gameNames[g1]][self.gameNames[g2]]
         nsup=self.database_sup[self.gameNames[g1]][self.gameNames[g2]]
         return (sim, nsup)
 
 
 def knearest(gameName,set_of_games,dbase,k=7,reg=1000):
+    #a database with a neighbor index answers from the game's stored top neighbors
+    if getattr(dbase,'neighborIndex',None) is not None:
+        return dbase.neighborIndex.knearest(gameName,set_of_games,k,reg)
     sims=[dbase.get(gameName, iterGame) for iterGame in set_of_games]
     shrunkSims=[(shrunk_sim(sim[0], sim[1], reg), sim[1]) for sim in sims]
     getFirstItem=operator.itemgetter(0)
@@ -157,20 +227,30 @@ def knearest(gameName,set_of_games,dbase,k=7,reg=1000):
     return kNearest
 
 #"get the sorted top 5 games for a user by the rating the user gave them"
-def get_user_top_choices(user, df, numchoices=5):
-    udf=df[df.user==user][['gameName','rating']].sort(['rating'], ascending=False).head(numchoices)
+def get_user_top_choices(user, df, numchoices=5, rindex=None):
+    userDf=df[df.user==user] if rindex is None else rindex.userFrame(user)
+    udf=userDf[['gameName','rating']].sort(['rating'], ascending=False).head(numchoices)
     return udf
 
 
-def get_top_recos_for_user(user, df, dbase, n=5, k=8, reg=200):
+#with a RatingsIndex for df (rindex) the user's games and the game averages come from the index instead of scans of df
+def get_top_recos_for_user(user, df, dbase, n=5, k=8, reg=200, rindex=None):
     #a set just containing the gameNames strings
     neighborGames=set()
     #lists the games already rated by the user
-    userAlreadyRatedGames=set(df[df.user==user].gameName.values)
-    games=get_user_top_choices(user, df,numchoices=n)['gameName'].values
+    if rindex is None:
+        userAlreadyRatedGames=set(df[df.user==user].gameName.values)
+        allGames=df.gameName.unique()
+    else:
+        userAlreadyRatedGames=set(rindex.userGames(user))
+        allGames=rindex.gameNameList()
+    #a neighbor index only looks its stored neighbors up in the games, so it gets them as a set, made once
+    if getattr(dbase,'neighborIndex',None) is not None:
+        allGames=set(allGames)
+    games=get_user_top_choices(user, df,numchoices=n,rindex=rindex)['gameName'].values
     #for each of the user top choices, get the k nearest neighbor games
     for userTopGame in games:
-        kNearestGames=knearest(userTopGame,df.gameName.unique(),dbase, k, reg)
+        kNearestGames=knearest(userTopGame,allGames,dbase, k, reg)
         for nearGame in kNearestGames:
             #checks if the games we might recommend has already been reviewed by user
             if nearGame[0] not in userAlreadyRatedGames:
@@ -178,9 +258,12 @@ def get_top_recos_for_user(user, df, dbase, n=5, k=8, reg=200):
                 neighborGames.add(nearGame[0])
            
     #find the average rating for all games in the passed df        
-    gameRatings=df.groupby('gameName')['rating'].aggregate(np.mean)
-    #recs is a list of tuples pairing each of the neighbor games with their average rating
-    recs=[(neighborGameName,gameRatings[neighborGameName]) for neighborGameName in neighborGames]
+    if rindex is None:
+        gameRatings=df.groupby('gameName')['rating'].aggregate(np.mean)
+        #recs is a list of tuples pairing each of the neighbor games with their average rating
+        recs=[(neighborGameName,gameRatings[neighborGameName]) for neighborGameName in neighborGames]
+    else:
+        recs=[(neighborGameName,rindex.gameMean(neighborGameName)) for neighborGameName in neighborGames]
     #sort the recommendations b rating
     getSecondItem=operator.itemgetter(1)
     sortedInds=np.argsort(map(getSecondItem,recs))[::-1]
@@ -189,19 +272,30 @@ def get_top_recos_for_user(user, df, dbase, n=5, k=8, reg=200):
 
 
 
-def knearest_amongst_userrated(gameName,user,df,dbase,k=7,reg=200.):
-    userRatedGames=df[df.user==user].gameName.unique()
+def knearest_amongst_userrated(gameName,user,df,dbase,k=7,reg=200.,rindex=None):
+    if rindex is None:
+        userRatedGames=df[df.user==user].gameName.unique()
+    else:
+        userRatedGames=rindex.userGames(user)
     nearestAmongstRated=knearest(gameName,userRatedGames,dbase,k,reg)
     return nearestAmongstRated
 
-def calcBase(df,user,gameName):
+def calcBase(df,user,gameName,rindex=None):
+    if rindex is not None:
+        return rindex.base(user,gameName)
     ybar=np.mean(df.rating)
     yubar=np.mean(df[df.user==user].rating)
     ymbar=np.mean(df[df.gameName==gameName].rating)
     base=ybar+(yubar-ybar)+(ymbar-ybar)
     return base
 
-def getRating(df,gameName):
+#df is a user's reviews; with a RatingsIndex pass the user instead
+def getRating(df,gameName,rindex=None,user=None):
+    if rindex is not None:
+        rating=rindex.userRating(user,gameName)
+        if rating is None:
+            print 'no rating found'
+        return rating
     try:
         ratings=df[df.gameName==gameName].rating.values[0]
         return ratings
@@ -209,14 +303,16 @@ def getRating(df,gameName):
         print 'no rating found'
         return None
     
-def ratingPredictor(df,dbase,gameName,user,k=7, reg=200.):
-    userReviews=df[df.user==user]
-    yum_base=calcBase(df,user,gameName)
+#with a RatingsIndex for df (rindex) a prediction takes time proportional to the user's number of ratings
+#instead of a dozen scans of df
+def ratingPredictor(df,dbase,gameName,user,k=7, reg=200.,rindex=None):
+    userReviews=df[df.user==user] if rindex is None else None
+    yum_base=calcBase(df,user,gameName,rindex)
     
-    kNearestUserRated=knearest_amongst_userrated(gameName,user,df,dbase,k,reg)
+    kNearestUserRated=knearest_amongst_userrated(gameName,user,df,dbase,k,reg,rindex)
     s=np.array([dbase.get(gameName, neighbor[0])[0] for neighbor in kNearestUserRated])  
-    yu=np.array([getRating(userReviews,neighbor[0]) for neighbor in kNearestUserRated])
-    yuj_base=[calcBase(df, user,neighbor[0]) for neighbor in kNearestUserRated]
+    yu=np.array([getRating(userReviews,neighbor[0],rindex,user) for neighbor in kNearestUserRated])
+    yuj_base=[calcBase(df, user,neighbor[0],rindex) for neighbor in kNearestUserRated]
  
     if sum(s)==0 or np.isnan(sum(s)):
         print 'no similarities'
@@ -235,59 +331,134 @@ def get_other_ratings(gameName, user, df):
     return users_score, average_score
 
 #"get the sorted top 5 games for a user by the rating the user gave them"
-def get_user_top_choices(user, df, numchoices=5):
-    udf=df[df.user==user][['gameName','rating']].sort(['rating'], ascending=False)
+def get_user_top_choices(user, df, numchoices=5, rindex=None):
+    userDf=df[df.user==user] if rindex is None else rindex.userFrame(user)
+    udf=userDf[['gameName','rating']].sort(['rating'], ascending=False)
     return udf.head(numchoices)
 
+#Times ratingPredictor on numPredictions random (user, game) pairs of df, scanning df and with a RatingsIndex,
+#and checks both give the same predictions.  Returns (predictions/sec scanning, predictions/sec with the index)
+def benchmarkPredictions(df, dbase, numPredictions=200, k=7, reg=200., seed=0):
+    rand=np.random.RandomState(seed)
+    users=df.user.values[rand.randint(0,len(df),numPredictions)]
+    games=df.gameName.values[rand.randint(0,len(df),numPredictions)]
+    start=time.time()
+    scanned=[ratingPredictor(df,dbase,game,user,k,reg) for user,game in zip(users,games)]
+    scanTime=time.time()-start
+    start=time.time()
+    rindex=RatingsIndex(df)
+    buildTime=time.time()-start
+    start=time.time()
+    indexed=[ratingPredictor(df,dbase,game,user,k,reg,rindex) for user,game in zip(users,games)]
+    indexTime=time.time()-start
+    print 'scanning df:     %8.1f predictions/sec' % (numPredictions/scanTime)
+    print 'RatingsIndex:    %8.1f predictions/sec (index built in %.2fs)' % (numPredictions/indexTime,buildTime)
+    print 'max prediction difference: %g' % np.max(np.abs(np.array(scanned)-np.array(indexed)))
+    return numPredictions/scanTime,numPredictions/indexTime
+
 
 
 #Build a pandas database fullDf from all of the individual game ratings csvs saved
+#the csvs are collected column by column in a ColumnBuilder and the frame is built once
 def buildDfFromScrapedCsvs():
     dataDir='google_drive/gameRatings/'
     gameRatingsFiles=os.listdir(dataDir)
 
-    fullDf=pd.DataFrame()
+    builder=ColumnBuilder([('gameID',np.int64),('gameName',None),('rating',np.float64),('user',None)])
 
     for file in gameRatingsFiles:
         if file.endswith('.csv'):
             filePath=dataDir+file
             df=pd.read_csv(filePath)
             df.columns = ['gameID','gameName','rating','user']
-            fullDf=pd.concat([fullDf,df],ignore_index=True)
+            builder.appendFrame(df)
+    fullDf=builder.toFrame()
     print 'Built fullDf:\n',fullDf.head(),'\n', fullDf
 
     #Some rare users rate games more than once.  This keeps their first rating
     fullDf=fullDf.drop_duplicates(cols=['user','gameName'], take_last=False, inplace=False)
     fullDf=recompute_frame(fullDf)
     return fullDf
-fullDf=buildDfFromScrapedCsvs()
-#deal with the fact that some idiot put a comma in their username and some idiot database allowed it
-fullDf['user']=fullDf['user'].map(lambda x: x.replace(',',' '))
 
-##Save the dataframe or load from csv
-fullDf.to_csv('google_drive/fullGamesDf.csv',index=False)
-#fullDf=pd.read_csv('google_drive/fullGamesDf.csv')
+#Build fullDf from the columnar ratings store (see ratingsStore.py) instead of re-reading every csv
+def buildDfFromRatingsStore(store):
+    fullDf=store.loadFrame(columns=['gameID','gameName','rating','user'])
+    #Some rare users rate games more than once.  This keeps their first rating
+    fullDf=fullDf.drop_duplicates(cols=['user','gameName'], take_last=False, inplace=False)
+    fullDf=recompute_frame(fullDf)
+    return fullDf
 
-#Exports a csv containing only the columns I want to pass to computeSimMrjob
-subsetoffull=fullDf[['user','gameID', 'rating','game_avg','user_avg']]
-subsetoffull.to_csv("subset-full.csv", index=False, header=False)
+#the script part only runs when run directly (or with %run), so the functions above can be imported
+if __name__ == '__main__':
+    #fullDf=buildDfFromScrapedCsvs()
+    store=RatingsStore()
+    importScrapedCsvs(store)
+    fullDf=buildDfFromRatingsStore(store)
+    #deal with the fact that some idiot put a comma in their username and some idiot database allowed it
+    fullDf['user']=fullDf['user'].map(lambda x: x.replace(',',' '))
 
-#create a smaller dataframe containing only the ratings by users with 13 or more ratings 
-#(number chosen arbitrarily)
-smallDf=fullDf[fullDf.user_review_count>=25]
-smallDf=recompute_frame(smallDf)
+    ##The ratings store replaces saving the dataframe to csv
+    #fullDf.to_csv('google_drive/fullGamesDf.csv',index=False)
+    #fullDf=pd.read_csv('google_drive/fullGamesDf.csv')
 
+    #Exports a csv containing only the columns I want to pass to computeSimMrjob
+    subsetoffull=fullDf[['user','gameID', 'rating','game_avg','user_avg']]
+    subsetoffull.to_csv("subset-full.csv", index=False, header=False)
+    #and the same ratings integer encoded, one line per user, for the single-stage GameSimilaritiesPacked job
+    from computeSimMrjob import write_encoded_input
+    write_encoded_input(fullDf, "encoded-full.txt")
+
+    #create a smaller dataframe containing only the ratings by users with 13 or more ratings 
+    #(number chosen arbitrarily)
+    smallDf=fullDf[fullDf.user_review_count>=25]
+    smallDf=recompute_frame(smallDf)
 
 
-# db=Database(smallDf)
-# db.populate_by_calculating(pearson_sim)
-# fout=open('google_drive/gameDbPickle','w')
-# pickle.dump(db,fout)
-# fout.close()
 
-# #fin=open('google_drive/gameDbPickle','r')
-# #db=pickle.load(fin)
-# #fin.close()
+# db=Database(smallDf)
+# db.populate_by_vectorizing(blockSize=1000)
+# check_against_pairwise(db)
+#or, for catalogs too big for the dense arrays, keep just the top 50 neighbors of every game
+# db=Database(smallDf, dense=False)
+# db.build_neighbor_index(K=50, reg=200.)
+#or keep the similarities up to date as ratings come in, without rebuilding
+# from incrementalSimilarity import IncrementalSimilarity
+# db=IncrementalSimilarity(smallDf)
+# db.applyFrame(newGameDf)
+# db.checkAgainstRebuild()
+#save the similarities, game names and baseline means as a memory-mapped snapshot instead of pickling db
+# from modelSnapshot import saveSnapshot, loadSnapshot
+# saveSnapshot(db, 'google_drive/gameDbSnapshot')
+
+# #db,baseline=loadSnapshot('google_drive/gameDbSnapshot')
+
+#index smallDf's users and games once so predictions don't scan the frame
+# rindex=RatingsIndex(smallDf)
+# benchmarkPredictions(smallDf, db)
+#predict many (user, game) pairs at once, e.g. for a holdout frame, with the same results as ratingPredictor
+# from batchPredictor import predictBatch
+# predictions=predictBatch(holdoutDf.user.values, holdoutDf.gameName.values, db, rindex, k=7, reg=200.)
+#write every user's top recommendations for the newsletter, and read some back
+# from bulkRecommendations import writeAllRecommendations, loadAllRecommendations
+# writeAllRecommendations('google_drive/allRecos.bin', db, rindex, n=5, k=8, reg=200, numRecos=10)
+# recos=loadAllRecommendations('google_drive/allRecos.bin', users=[testuser])
+#or answer recommendation, prediction and knearest queries over http from the warm model (see recoService.py)
+# from recoService import RecoService, loadTest
+# service=RecoService(smallDf, db)
+# baseUrl=service.start(port=8000)
+# loadTest(baseUrl, smallDf.user.unique(), smallDf.gameName.unique())
+#measure rmse, precision@N and coverage over k and reg with 5-fold cross-validation (see evaluation.py)
+# from evaluation import evaluateRecommender
+# evaluateRecommender(smallDf, ks=(5,7,10), regs=(50.,200.,1000.), method='kfold', numFolds=5)
+#or skip the similarity build and use latent factors (see matrixFactorization.py)
+# from matrixFactorization import FactorModel
+# model=FactorModel(smallDf, numFactors=20, reg=0.1, numIters=10)
+# print model.predict('Terra Mystica', testuser), model.topRecos(testuser, n=10)
+#approximate nearest games from an LSH index over the game factors (see annIndex.py)
+# from annIndex import LSHIndex, factorEmbeddings
+# annNames=sorted(db.gameNames, key=db.gameNames.get)
+# ann=LSHIndex(factorEmbeddings(model, db.gameNames), annNames, numTables=16, numBits=8)
+# print ann.knearest('Terra Mystica', k=7, probes=3, dbase=db)
 
 # #define some variables for function testing
 # testGame1='Mage Wars'
@@ -310,7 +481,7 @@ smallDf=recompute_frame(smallDf)
 # for game in gameRecs:
 #     print "----------------------------------"
 #     print game
-#     print "Predicted Rating:",ratingPredictor(smallDf, db, game, testuser, k=7, reg=1000.) 
+#     print "Predicted Rating:",ratingPredictor(smallDf, db, game, testuser, k=7, reg=1000., rindex=rindex) 
 #     u,a=get_other_ratings(game, testuser, smallDf)
 #     print "Actual User Rating:",u,"Avg Rating",a
 
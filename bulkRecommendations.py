@@ -0,0 +1,148 @@
+
+import numpy as np
+import codecs
+import os
+import multiprocessing
+import time
+from ratingsIndex import RatingsIndex
+from batchPredictor import denseNeighborPositions, indexNeighborPositions
+from syntheticRatings import syntheticRatingsFrame
+
+
+#Top recommendations for every user at once, for the newsletter.  get_top_recos_for_user takes the user's n top
+#rated games, the k nearest games to each (out of all games), drops the ones the user already rated and ranks the
+#rest by average rating.  The k nearest games to a game don't depend on the user, so here they are computed once
+#for every game (in vectorized chunks, the same way knearest picks them) and the game averages come from a
+#RatingsIndex.  Each user then only costs a sort of the user's own ratings and a few array operations.
+#Users are split into chunks that a pool of forked processes work through; the results come back in user order
+#and are streamed to disk as they arrive.
+#The output file holds fixed size (int32 user code, int32 game code, float32 average rating) records, each user's
+#in ranked order, with the users and games dictionaries in path+'.users' and path+'.games' (one name per line,
+#line number = code).  Ties in average rating are broken by game code, where get_top_recos_for_user's order
+#depends on set iteration.
+
+RECO_DTYPE=np.dtype([('user','<i4'),('game','<i4'),('rating','<f4')])
+
+#Returns a numGames x k array of every game's k nearest games (as the RatingsIndex's game codes, -1 padded),
+#like knearest(game, df.gameName.unique(), dbase, k, reg) for every game
+def gameNeighborLists(dbase, rindex, k=8, reg=200., chunkSize=1000):
+    toDbase=np.array([dbase.gameNames[name] for name in rindex.gameNameList()],dtype=np.int64)
+    index=getattr(dbase,'neighborIndex',None)
+    numGames=len(toDbase)
+    neighbors=-np.ones((numGames,k),dtype=np.int64)
+    for start in range(0,numGames,chunkSize):
+        games=np.arange(start,min(start+chunkSize,numGames))
+        if index is not None:
+            picked,sims=indexNeighborPositions(index,toDbase[games],toDbase,k,reg)
+        else:
+            picked=denseNeighborPositions(dbase,toDbase[games],toDbase,k,reg)
+        neighbors[games,:picked.shape[1]]=picked
+    return neighbors
+
+#the ranked (game codes, average ratings) recommended to the user with code u, given gameNeighborLists
+def userRecommendations(rindex, neighbors, u, n=5, numRecos=0):
+    rows=rindex.userOrder[rindex.userIndptr[u]:rindex.userIndptr[u+1]]
+    games=rindex.rowGameCodes[rows]
+    #get_user_top_choices' sort: quicksort on the ratings, reversed
+    top=games[np.argsort(rindex.ratings[rows])[::-1][:n]]
+    candidates=neighbors[top].ravel()
+    candidates=np.unique(candidates[candidates>=0])
+    candidates=candidates[~np.in1d(candidates,games)]
+    scores=rindex.gameMeans[candidates]
+    order=np.argsort(-scores,kind='mergesort')
+    if numRecos:
+        order=order[:numRecos]
+    return candidates[order],scores[order]
+
+#set in the parent right before the pool forks, and inherited by the workers
+_bulkState={}
+
+def _recoChunk(users):
+    rindex=_bulkState['rindex']
+    parts=[]
+    for u in range(*users):
+        games,scores=userRecommendations(rindex,_bulkState['neighbors'],u,_bulkState['n'],_bulkState['numRecos'])
+        part=np.empty(len(games),dtype=RECO_DTYPE)
+        part['user']=u
+        part['game']=games
+        part['rating']=scores
+        parts.append(part)
+    return np.concatenate(parts).tostring() if parts else ''
+
+#Writes the top recommendations of every user in rindex (a RatingsIndex of a frame like smallDf) to path, with the
+#same n (top rated games per user), k (neighbors per top game) and reg as get_top_recos_for_user, keeping at most
+#numRecos per user (0 keeps them all).  Returns the number of users written
+def writeAllRecommendations(path, dbase, rindex, n=5, k=8, reg=200, numRecos=10, numWorkers=None, usersPerChunk=2000):
+    neighbors=gameNeighborLists(dbase,rindex,k,reg)
+    with codecs.open(path+'.users','w','utf-8') as fout:
+        fout.writelines(unicode(user).replace('\n',' ')+u'\n' for user in rindex.users)
+    with codecs.open(path+'.games','w','utf-8') as fout:
+        fout.writelines(unicode(game).replace('\n',' ')+u'\n' for game in rindex.games)
+    numUsers=len(rindex.users)
+    chunks=[(start,min(start+usersPerChunk,numUsers)) for start in range(0,numUsers,usersPerChunk)]
+    _bulkState.update(rindex=rindex,neighbors=neighbors,n=n,numRecos=numRecos)
+    try:
+        with open(path,'wb') as fout:
+            if numWorkers==1:
+                for chunk in chunks:
+                    fout.write(_recoChunk(chunk))
+            else:
+                pool=multiprocessing.Pool(numWorkers)
+                try:
+                    for packed in pool.imap(_recoChunk,chunks):
+                        fout.write(packed)
+                finally:
+                    pool.close()
+                    pool.join()
+    finally:
+        _bulkState.clear()
+    return numUsers
+
+#Reads a file written by writeAllRecommendations into a dictionary user -> [(gameName, average rating), ...] in
+#the format get_top_recos_for_user returns.  users limits it to those users
+def loadAllRecommendations(path, users=None):
+    with codecs.open(path+'.users','r','utf-8') as fin:
+        userNames=[line.rstrip('\n') for line in fin]
+    with codecs.open(path+'.games','r','utf-8') as fin:
+        gameNames=[line.rstrip('\n') for line in fin]
+    #an empty file (no users, or no user with a recommendation) can't be memory mapped
+    records=np.memmap(path,dtype=RECO_DTYPE,mode='r') if os.path.getsize(path) else np.array([],dtype=RECO_DTYPE)
+    if users is not None:
+        userCodes=dict((user,u) for u,user in enumerate(userNames))
+        codes=np.array([userCodes[user] for user in users if user in userCodes])
+        records=records[np.in1d(records['user'],codes)]
+    recos={}
+    for u,g,rating in records:
+        recos.setdefault(userNames[u],[]).append((gameNames[g],float(rating)))
+    return recos
+
+
+#Writes the recommendations of a synthetic numUsers-user frame and reports users/sec, for each worker count.
+#checkUsers users are checked against get_top_recos_for_user
+def benchmarkAllRecommendations(path='allRecos.bin', numUsers=100000, numGames=1000, ratingsPerUser=25,
+                                workerCounts=(1,2,4), checkUsers=20):
+    from buildPandasDF import Database, get_top_recos_for_user
+    start=time.time()
+    df=syntheticRatingsFrame(numUsers=numUsers,numGames=numGames,ratingsPerUser=ratingsPerUser)
+    db=Database(df)
+    db.populate_by_vectorizing(blockSize=500)
+    rindex=RatingsIndex(df)
+    print 'built %s ratings, similarities and index in %.1fs' % (len(df),time.time()-start)
+    for numWorkers in workerCounts:
+        start=time.time()
+        writeAllRecommendations(path,db,rindex,numRecos=0,numWorkers=numWorkers)
+        elapsed=time.time()-start
+        print '%3s workers | %7.1fs | %9.0f users/sec' % (numWorkers,elapsed,numUsers/elapsed)
+    users=list(rindex.users[np.random.RandomState(0).randint(0,numUsers,checkUsers)])
+    written=loadAllRecommendations(path,users)
+    same=0
+    for user in users:
+        expected=get_top_recos_for_user(user,df,db)
+        got=written.get(user,[])
+        if set(name for name,rating in expected)==set(name for name,rating in got) and \
+                np.allclose(sorted(rating for name,rating in expected),sorted(rating for name,rating in got),atol=1e-5):
+            same+=1
+    print '%s of %s checked users match get_top_recos_for_user' % (same,len(users))
+
+if __name__ == '__main__':
+    benchmarkAllRecommendations()
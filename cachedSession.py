@@ -0,0 +1,114 @@
+
+import requests
+import hashlib
+import json
+import os
+import threading
+import urllib
+
+
+#What CachedSession.get returns: the parts of a requests response the scraper uses, whether it came
+#off the network or out of the on-disk cache
+class CachedResponse:
+    def __init__(self, url, status_code, content, encoding, headers, fromCache=False):
+        self.url=url
+        self.status_code=status_code
+        self.content=content
+        self.encoding=encoding
+        self.headers=headers
+        self.fromCache=fromCache
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8','replace')
+
+    def raise_for_status(self):
+        if self.status_code>=400:
+            raise requests.HTTPError('%s error for url: %s' % (self.status_code,self.url))
+
+
+#A shared requests.Session with a connection pool (so requests to the same host reuse keep-alive
+#connections) and an on-disk response cache keyed by url+params.
+#Responses that carry an ETag or Last-Modified header are saved to cacheDir; the next request for the
+#same url+params is sent as a conditional GET, and a 304 Not Modified is answered from the cache, so a
+#re-run only downloads pages that changed.  hits counts 304s served from the cache, misses counts full downloads.
+#With cacheDir=None it is just a pooled session.
+class CachedSession:
+    def __init__(self, cacheDir=None, poolSize=10):
+        self.session=requests.Session()
+        adapter=requests.adapters.HTTPAdapter(pool_connections=poolSize,pool_maxsize=poolSize)
+        self.session.mount('http://',adapter)
+        self.session.mount('https://',adapter)
+        self.cacheDir=cacheDir
+        self.hits=0
+        self.misses=0
+        self.lock=threading.Lock()
+
+    def cacheKey(self, url, params=None):
+        query=urllib.urlencode(sorted((params or {}).items()))
+        return hashlib.sha1(url+'?'+query).hexdigest()
+
+    def _cachePaths(self, key):
+        return os.path.join(self.cacheDir,key+'.json'), os.path.join(self.cacheDir,key+'.body')
+
+    def _loadEntry(self, key):
+        metaPath,bodyPath=self._cachePaths(key)
+        try:
+            with open(metaPath,'r') as fin:
+                meta=json.load(fin)
+            with open(bodyPath,'rb') as fin:
+                body=fin.read()
+            return meta,body
+        except (IOError,ValueError):
+            return None,None
+
+    #writes to temporary files and renames them into place, so concurrent fetches never see half an entry
+    def _storeEntry(self, key, meta, body):
+        if not os.path.isdir(self.cacheDir):
+            try:
+                os.makedirs(self.cacheDir)
+            except OSError:
+                pass
+        metaPath,bodyPath=self._cachePaths(key)
+        suffix='.tmp%s' % threading.current_thread().ident
+        with open(bodyPath+suffix,'wb') as fout:
+            fout.write(body)
+        with open(metaPath+suffix,'w') as fout:
+            json.dump(meta,fout)
+        os.rename(bodyPath+suffix,bodyPath)
+        os.rename(metaPath+suffix,metaPath)
+
+    def get(self, url, params=None, headers=None):
+        headers=dict(headers or {})
+        key=meta=body=None
+        if self.cacheDir:
+            key=self.cacheKey(url,params)
+            meta,body=self._loadEntry(key)
+            if meta:
+                if meta.get('etag'):
+                    headers['If-None-Match']=meta['etag']
+                if meta.get('lastModified'):
+                    headers['If-Modified-Since']=meta['lastModified']
+        response=self.session.get(url,params=params,headers=headers)
+        if meta and response.status_code==304:
+            with self.lock:
+                self.hits+=1
+            return CachedResponse(response.url,meta['status'],body,meta['encoding'],response.headers,fromCache=True)
+        with self.lock:
+            self.misses+=1
+        encoding=response.encoding or response.apparent_encoding
+        etag=response.headers.get('ETag')
+        lastModified=response.headers.get('Last-Modified')
+        if key and response.status_code==200 and (etag or lastModified):
+            meta={'url':url,'status':response.status_code,'encoding':encoding,'etag':etag,'lastModified':lastModified}
+            self._storeEntry(key,meta,response.content)
+        return CachedResponse(response.url,response.status_code,response.content,encoding,response.headers)
+
+    def stats(self):
+        total=self.hits+self.misses
+        return {'hits':self.hits,'misses':self.misses,'hitRate':self.hits/float(total) if total else 0.}
+
+    def resetStats(self):
+        with self.lock:
+            self.hits=0
+            self.misses=0
@@ -0,0 +1,233 @@
+
+import numpy as np
+import time
+from ratingsIndex import RatingsIndex
+from similarityEngine import pearsonFromSums
+from syntheticRatings import syntheticRatingsFrame, syntheticTastes
+
+
+#Scores new releases that have few or no ratings yet, for the README goal of predicting how new games will be
+#received from their features and early votes.  ratingPredictor can't score a game the Database has no
+#support for, so the HybridScorer works like it (a baseline plus the user's deviations on the most similar
+#games the user rated) with a similarity that blends the two sources the way shrunk_sim shrinks:
+#    sim = (n*collab + reg*content) / (n + reg)
+#where collab is the pearson similarity over the n users who rated both games and content is the cosine
+#similarity of the games' feature rows (see featureMatrix.py).  With no common raters it is the content
+#similarity, and it moves toward the collaborative one as support grows; shrunk_sim is the same with content=0.
+#The new game's baseline offset is blended the same way, from the mean of its early votes and, weighted by
+#baseReg, from the mean offsets of the known games most similar to it by features.
+#The collaborative similarities of a new game only need the rows of the users who rated it: with each rater's
+#mean updated for the new rating (like recompute_frame would), the pearson sums against every game the raters
+#rated come from their rows alone (newGameSimilarities).  So adding a game to a neighbor index (see
+#NeighborIndex.addGame) takes time proportional to the number of ratings of its raters, without a rebuild.
+
+#Returns (positions, sims, sups): the pearson similarity and common support of a new game against every game
+#its raters rated, as the games' positions through toPosition (an array from the RatingsIndex's game codes to
+#positions, -1 for games to leave out).  users and ratings are the new game's raters and their ratings, one
+#per user; raters the RatingsIndex doesn't know share no games with it
+def newGameSimilarities(rindex, toPosition, users, ratings):
+    games=[]
+    newDiffs=[]
+    diffs=[]
+    for user,rating in zip(users,ratings):
+        u=rindex.userCodes.get(user)
+        if u is None:
+            continue
+        rows=rindex.userOrder[rindex.userIndptr[u]:rindex.userIndptr[u+1]]
+        mean=(rindex.userMeans[u]*len(rows)+rating)/(len(rows)+1.)
+        #repeat ratings of a game keep the first, like buildRatingMatrices
+        codes,first=np.unique(rindex.rowGameCodes[rows],return_index=True)
+        positions=toPosition[codes]
+        keep=positions>=0
+        games.append(positions[keep])
+        diffs.append(rindex.ratings[rows[first[keep]]]-mean)
+        newDiffs.append(np.repeat(rating-mean,keep.sum()))
+    if not games:
+        return np.zeros(0,dtype=np.int64),np.zeros(0),np.zeros(0,dtype=np.int64)
+    games=np.concatenate(games)
+    x=np.concatenate(newDiffs)
+    y=np.concatenate(diffs)
+    positions,inverse=np.unique(games,return_inverse=True)
+    sums=lambda weights: np.bincount(inverse,weights=weights,minlength=len(positions))
+    n=np.bincount(inverse,minlength=len(positions)).astype(np.float64)
+    sims=pearsonFromSums(n,sums(x*y),sums(x),sums(y),sums(x*x),sums(y*y))
+    return positions,sims,n.astype(np.int64)
+
+
+class HybridScorer:
+    #df is the ratings frame (like smallDf, with a gameID column) and dbase its Database.  featureMatrix is the
+    #games x features matrix and gameRows maps str(gameID) to its row.  mode 'collab' or 'content' uses only
+    #that half of the blend, for comparison
+    def __init__(self, df, dbase, featureMatrix, gameRows, reg=200., baseReg=20., k=7, rindex=None, mode='hybrid'):
+        self.rindex=rindex if rindex is not None else RatingsIndex(df)
+        self.dbase=dbase
+        self.reg=reg
+        self.baseReg=baseReg
+        self.k=k
+        self.mode=mode
+        featureMatrix=featureMatrix.tocsr().astype(np.float64)
+        norms=np.sqrt(np.asarray(featureMatrix.multiply(featureMatrix).sum(axis=1)).ravel())
+        self.features=featureMatrix.multiply(1./np.where(norms>0,norms,1.)[:,None]).tocsr()
+        gameIDs=df.drop_duplicates('gameName').set_index('gameName').gameID
+        #feature row and database position of every game in the RatingsIndex's code order, -1 if none
+        self.knownRows=np.array([gameRows.get(str(gameIDs[name]),-1) for name in self.rindex.games],dtype=np.int64)
+        self.toDbase=np.array([dbase.gameNames.get(name,-1) for name in self.rindex.games],dtype=np.int64)
+        self.fromDbase=-np.ones(max(len(dbase.gameNames),1),dtype=np.int64)
+        self.fromDbase[self.toDbase[self.toDbase>=0]]=np.flatnonzero(self.toDbase>=0)
+        self.newGames={}
+
+    #the cosine similarity of a feature row to every known game, in the RatingsIndex's code order
+    def contentSimilarities(self, featureRow):
+        scores=np.asarray((self.features*self.features[featureRow].T).todense()).ravel()
+        return np.where(self.knownRows>=0,scores[np.maximum(self.knownRows,0)],0.)
+
+    #Adds (or updates) a new game with its row in the feature matrix and its early votes (a frame with user
+    #and rating columns, or None).  With addToIndex and a Database with a neighbor index, the game is also added
+    #to the index (once; later votes don't update its row there)
+    def addGame(self, gameName, featureRow, votes=None, addToIndex=True):
+        users=[] if votes is None else list(votes.user.values)
+        ratings=np.array([] if votes is None else votes.rating.values,dtype=np.float64)
+        seen=set()
+        first=[i for i,user in enumerate(users) if not (user in seen or seen.add(user))]
+        users=[users[i] for i in first]
+        ratings=ratings[first]
+        positions,sims,sups=newGameSimilarities(self.rindex,self.toDbase,users,ratings)
+        index=getattr(self.dbase,'neighborIndex',None)
+        if addToIndex and index is not None and gameName not in index.nameIndex:
+            i=index.addGame(gameName,positions,sims,sups,len(users))
+            if getattr(self.dbase,'database_sim',None) is None:
+                self.dbase.gameNames[gameName]=i
+        content=self.contentSimilarities(featureRow)
+        collab=np.zeros(len(self.rindex.games))
+        support=np.zeros(len(self.rindex.games))
+        known=self.fromDbase[positions]
+        collab[known]=sims
+        support[known]=sups
+        #the feature-predicted offset: the mean offset of the k known games most similar by features
+        neighbors=np.argsort(-content,kind='mergesort')[:self.k]
+        neighbors=neighbors[content[neighbors]>0]
+        offsets=self.rindex.gameMeans[neighbors]-self.rindex.globalMean
+        contentOffset=np.dot(content[neighbors],offsets)/content[neighbors].sum() if len(neighbors) else 0.
+        votedOffset=ratings.mean()-self.rindex.globalMean if len(ratings) else 0.
+        self.newGames[gameName]={'content':content,'collab':collab,'support':support,'numVotes':len(ratings),
+                                 'contentOffset':contentOffset,'votedOffset':votedOffset}
+
+    #the blended similarity of a new game to every known game, in the RatingsIndex's code order
+    def similarities(self, gameName):
+        game=self.newGames[gameName]
+        n=game['support']
+        if self.mode=='content':
+            return game['content']
+        if self.mode=='collab':
+            return (n*game['collab'])/(n+self.reg)
+        return (n*game['collab']+self.reg*game['content'])/(n+self.reg)
+
+    #the new game's baseline offset from the global mean
+    def gameOffset(self, gameName):
+        game=self.newGames[gameName]
+        if self.mode=='content':
+            return game['contentOffset']
+        if self.mode=='collab':
+            return game['votedOffset']
+        n=game['numVotes']
+        return (n*game['votedOffset']+self.baseReg*game['contentOffset'])/(n+self.baseReg)
+
+    #the predicted rating of an added game for a user, like ratingPredictor: the baseline plus the user's
+    #deviations from the baseline on the k rated games most similar to it, weighted by (positive) similarity
+    def predict(self, user, gameName, sims=None):
+        if sims is None:
+            sims=self.similarities(gameName)
+        rindex=self.rindex
+        userMean=rindex.userMean(user)
+        if np.isnan(userMean):
+            userMean=rindex.globalMean
+        base=userMean+self.gameOffset(gameName)
+        rows=rindex.userRows(user)
+        if len(rows)==0:
+            return base
+        codes,first=np.unique(rindex.rowGameCodes[rows],return_index=True)
+        userSims=sims[codes]
+        top=np.argsort(-userSims,kind='mergesort')[:self.k]
+        weights=np.maximum(userSims[top],0.)
+        if weights.sum()==0:
+            return base
+        deviations=rindex.ratings[rows[first[top]]]-(userMean+rindex.gameMeans[codes[top]]-rindex.globalMean)
+        return base+np.dot(weights,deviations)/weights.sum()
+
+    def predictMany(self, users, gameName):
+        sims=self.similarities(gameName)
+        return np.array([self.predict(user,gameName,sims) for user in users])
+
+
+#Game features made from the synthetic games' taste factors: a tag for every taste a game leans clearly one way
+#on, plus numNoise random tags per game out of noiseTags, as a gameFeaturesDict (see featureMatrix.py)
+def tasteFeatures(gameTastes, gameIDs, threshold=0.5, numNoise=3, noiseTags=200, seed=0):
+    rand=np.random.RandomState(seed)
+    gameFeaturesDict={}
+    for gameID,tastes in zip(gameIDs,gameTastes):
+        mechanics=set(('taste%s%s' % (d,'+' if t>0 else '-'),'taste %s %s' % (d,'+' if t>0 else '-'))
+                      for d,t in enumerate(tastes) if abs(t)>threshold)
+        categories=set(('noise%s' % tag,'noise %s' % tag) for tag in rand.choice(noiseTags,numNoise,replace=False))
+        gameFeaturesDict[gameID]={'boardgamemechanic':mechanics,'boardgamecategory':categories}
+    return gameFeaturesDict
+
+#Holds numNewGames games out of a synthetic frame with taste structure, then for each number of early votes
+#reveals that many of each new game's ratings and predicts the rest with the content, collaborative and hybrid
+#scorers (rmse).  Then adds games with growing numbers of ratings to a neighbor index, timing addGame against
+#rebuilding the index, and checks the added game's row against the rebuilt index's
+def benchmarkColdStart(numUsers=5000, numGames=300, ratingsPerUser=40, numTastes=8, numNewGames=20,
+                       earlyVotes=(0,5,20,100), maxTest=300, K=50, reg=200.):
+    from buildPandasDF import Database, recompute_frame
+    from featureMatrix import FeatureVocabulary, buildGameFeatureMatrix
+    from geekscraper import buildDictOfAllGameFeatures
+    df=syntheticRatingsFrame(numUsers=numUsers,numGames=numGames,ratingsPerUser=ratingsPerUser,numTastes=numTastes)
+    userTastes,gameTastes=syntheticTastes(numUsers,numGames,numTastes)
+    gameIDs=np.arange(1,numGames+1)*7+100
+    games=[(str(gameID),'Game %s' % i) for i,gameID in enumerate(gameIDs)]
+    gameFeaturesDict=tasteFeatures(gameTastes,games)
+    featureTypes=['boardgamemechanic','boardgamecategory']
+    vocabulary=FeatureVocabulary.fromFeatureDict(buildDictOfAllGameFeatures(games,gameFeaturesDict,featureTypes),featureTypes)
+    featureMatrix=buildGameFeatureMatrix(games,gameFeaturesDict,vocabulary)
+    gameRows=dict((gameID,row) for row,(gameID,name) in enumerate(games))
+    counts=df.gameName.value_counts()
+    candidates=[name for name in counts.index if counts[name]>=max(earlyVotes)+50]
+    rand=np.random.RandomState(0)
+    newGames=list(rand.choice(candidates,min(numNewGames,len(candidates)),replace=False))
+    isNew=df.gameName.isin(newGames).values
+    trainDf=recompute_frame(df[~isNew])
+    db=Database(trainDf,dense=False)
+    db.build_neighbor_index(K,reg)
+    rindex=RatingsIndex(trainDf)
+    scorers=dict((mode,HybridScorer(trainDf,db,featureMatrix,gameRows,reg=reg,rindex=rindex,mode=mode))
+                 for mode in ('content','collab','hybrid'))
+    print '%s new games held out of %s; rmse on their later ratings:' % (len(newGames),numGames)
+    print 'early votes | content | collab | hybrid'
+    for m in earlyVotes:
+        errors=dict((mode,[]) for mode in scorers)
+        for name in newGames:
+            gameDf=df[df.gameName==name]
+            votes,test=gameDf.iloc[:m],gameDf.iloc[m:m+maxTest]
+            row=gameRows[str(gameDf.gameID.values[0])]
+            for mode,scorer in scorers.items():
+                scorer.addGame(name,row,votes,addToIndex=False)
+                errors[mode].append(scorer.predictMany(test.user.values,name)-test.rating.values)
+        rmse=dict((mode,np.sqrt(np.mean(np.concatenate(errors[mode])**2))) for mode in errors)
+        print '%11s | %7.4f | %6.4f | %6.4f' % (m,rmse['content'],rmse['collab'],rmse['hybrid'])
+    start=time.time()
+    db.build_neighbor_index(K,reg)
+    rebuildTime=time.time()-start
+    scorer=HybridScorer(trainDf,db,featureMatrix,gameRows,reg=reg,rindex=rindex)
+    print 'neighbor index rebuild: %.3fs' % rebuildTime
+    for name in sorted(newGames,key=lambda name: counts[name]):
+        gameDf=df[df.gameName==name]
+        start=time.time()
+        scorer.addGame(name,gameRows[str(gameDf.gameID.values[0])],gameDf)
+        print 'added %s with %5s ratings in %.4fs' % (name,len(gameDf),time.time()-start)
+    #the last game's row against a rebuilt index that has it
+    rebuilt=Database(recompute_frame(df[~isNew|(df.gameName==name).values]),dense=False)
+    rebuilt.build_neighbor_index(K,reg)
+    added=db.neighborIndex.knearest(name,None,K,reg)
+    expected=rebuilt.neighborIndex.knearest(name,None,K,reg)
+    print 'added row matches the rebuild: %s' % (all(a[0]==e[0] and np.allclose(a[1:],e[1:]) for a,e in zip(added,expected))
+                                                and len(added)==len(expected))
+    return scorers
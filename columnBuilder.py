@@ -0,0 +1,110 @@
+
+import numpy as np
+import pandas as pd
+import multiprocessing
+import resource
+import time
+
+
+#Collects the columns of a frame in per-column buffers and builds the DataFrame once at the end.
+#Growing a frame with pd.concat([acc, new]) in a loop copies everything collected so far on every
+#append, which is quadratic in the number of pages and spikes memory to several times the final frame.
+#columns is a list of (name, dtype) pairs.  Columns with a numpy dtype are kept as a list of typed arrays
+#that get concatenated once, columns with dtype None hold python objects (strings) in a single list.
+class ColumnBuilder:
+    def __init__(self, columns):
+        self.names=[name for name,dtype in columns]
+        self.dtypes=dict(columns)
+        self.buffers=dict((name,[]) for name in self.names)
+        self.numRows=0
+
+    #appends a chunk of rows given as a dictionary of equal length sequences keyed by column name
+    def appendColumns(self, columns):
+        numRows=None
+        for name in self.names:
+            values=columns[name]
+            if numRows is None:
+                numRows=len(values)
+            elif len(values)!=numRows:
+                raise ValueError('column %s has %s rows, expected %s' % (name,len(values),numRows))
+            if self.dtypes[name] is None:
+                self.buffers[name].extend(values)
+            else:
+                self.buffers[name].append(np.asarray(values,dtype=self.dtypes[name]))
+        self.numRows+=numRows or 0
+
+    def appendFrame(self, df):
+        self.appendColumns(dict((name,df[name].values) for name in self.names))
+
+    def __len__(self):
+        return self.numRows
+
+    #materializes the collected rows as a DataFrame with a fresh 0..n-1 index
+    def toFrame(self):
+        data={}
+        for name in self.names:
+            dtype=self.dtypes[name]
+            if dtype is None:
+                column=np.empty(self.numRows,dtype=object)
+                column[:]=self.buffers[name]
+            elif self.buffers[name]:
+                column=np.concatenate(self.buffers[name])
+            else:
+                column=np.array([],dtype=dtype)
+            data[name]=column
+        return pd.DataFrame(data,columns=self.names)
+
+
+##########################################
+############## Benchmark ##############
+##########################################
+
+#the column dictionary for one synthetic 100-comment review page, in the shape getRatingColumnsFromReviewPage returns
+def _syntheticPage(pageNum, rowsPerPage=100, numUsers=50000):
+    users=['user%s' % ((pageNum*rowsPerPage+i)%numUsers) for i in range(rowsPerPage)]
+    ratings=[str((pageNum+i)%10+1) for i in range(rowsPerPage)]
+    return {'user':users,'rating':ratings,'gameName':['Some Game']*rowsPerPage,'gameID':['1234']*rowsPerPage}
+
+def _assembleWithConcat(numPages, rowsPerPage):
+    df=pd.DataFrame(_syntheticPage(0,rowsPerPage))
+    for pageNum in range(1,numPages):
+        df=pd.concat([df,pd.DataFrame(_syntheticPage(pageNum,rowsPerPage))],ignore_index=True)
+    return df
+
+def _assembleWithBuilder(numPages, rowsPerPage):
+    builder=ColumnBuilder([('gameID',None),('gameName',None),('rating',None),('user',None)])
+    for pageNum in range(numPages):
+        builder.appendColumns(_syntheticPage(pageNum,rowsPerPage))
+    return builder.toFrame()
+
+#runs one assembly in a fresh process so its peak RSS isn't polluted by earlier runs
+def _timedRun(method, numPages, rowsPerPage, results):
+    startRss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start=time.time()
+    df=method(numPages, rowsPerPage)
+    elapsed=time.time()-start
+    peakRss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((elapsed,(peakRss-startRss)/1024.,len(df)))
+
+#Compares time and peak RSS (MB above the process baseline) of the pd.concat loop and the ColumnBuilder
+#for frames of numPages synthetic review pages.  The concat loop is skipped above maxConcatPages pages
+#since it is quadratic and takes hours at 100k pages.
+def benchmarkFrameAssembly(pageCounts=(1000,10000,100000), rowsPerPage=100, maxConcatPages=10000):
+    methods=[('pd.concat loop',_assembleWithConcat),('ColumnBuilder',_assembleWithBuilder)]
+    results=[]
+    for numPages in pageCounts:
+        for label,method in methods:
+            if method is _assembleWithConcat and numPages>maxConcatPages:
+                print '%8s pages | %-15s | skipped' % (numPages,label)
+                continue
+            queue=multiprocessing.Queue()
+            proc=multiprocessing.Process(target=_timedRun,args=(method,numPages,rowsPerPage,queue))
+            proc.start()
+            elapsed,peakMb,numRows=queue.get()
+            proc.join()
+            print '%8s pages | %-15s | %8.2f s | peak RSS +%8.1f MB | %s rows' % (numPages,label,elapsed,peakMb,numRows)
+            results.append((numPages,label,elapsed,peakMb))
+    return results
+
+if __name__ == '__main__':
+    benchmarkFrameAssembly()
@@ -1,12 +1,35 @@
 ## Takes a CSV file containing user reviews and returns a tuple (rho,  n_common) for pairs of games
 
 import numpy as np
+import pandas as pd
 from mrjob.job import MRJob
 from itertools import combinations, permutations
 from scipy.stats.stats import pearsonr
 import math
+import json
+import random
+import time
+import struct
+import base64
 
 class GameSimilarities(MRJob):
+	def configure_options(self):
+		super(GameSimilarities, self).configure_options()
+		#Instead of every pair's raw rating tuples, the pair mapper emits the pair's pearson sufficient statistics
+		#(n, sum x, sum y, sum x^2, sum y^2, sum xy of the user-average-subtracted ratings), a combiner adds them up
+		#map-side and the reducer computes rho from the totals.  This shrinks the shuffle to one record per game pair
+		#per mapper
+		self.add_passthrough_option('--stats-combiner', action='store_true', default=False,
+			help='shuffle summed pearson statistics instead of raw rating pairs')
+		#A user who rated g games emits g*(g-1)/2 pairs, so a few power users dominate the shuffle.  With a cap, users
+		#with more rated games than that contribute pairs for a random sample (seeded by the username, so reruns agree)
+		#of cap of their games
+		self.add_passthrough_option('--max-games-per-user', type='int', default=0,
+			help='sample at most this many games per user for pairing (0 for no cap)')
+		#counts the records and JSON bytes leaving the pair mapper and the combiner, for benchmarkShuffle
+		self.add_passthrough_option('--count-shuffle', action='store_true', default=False,
+			help='count the records and bytes going into the shuffle')
+
 	def line_mapper(self,_,line):
 		#Takes passed df and yields a tuple of data keyed to the user id
 		user,gameID,rating,game_avg,user_avg=line.split(',')
@@ -26,12 +49,55 @@ class GameSimilarities(MRJob):
 		#by sorting the inputs, when we do use the combinations function we ensure that (a,b) and (b,a) are combined
 		#inputs.sort()
 		#sort by game ID
+		inputs=self.sample_heavy_user(user, inputs)
 		inputs=sorted(inputs, key=lambda game: game[0])
 		pair_keys=[key for key in combinations([val[0] for val in inputs],2)]
 		pair_values=[info for info in combinations([val[1:] for val in inputs],2)]
 		for i,key in enumerate(pair_keys):
+			self.count_shuffle('map', key, pair_values[i])
 			yield key, pair_values[i]
 
+	def sample_heavy_user(self, user, inputs):
+		#keeps a seeded random sample of max_games_per_user of a heavy user's games (see configure_options)
+		cap=self.options.max_games_per_user
+		if cap and len(inputs)>cap:
+			inputs=random.Random(user).sample(sorted(inputs), cap)
+		return inputs
+
+	def count_shuffle(self, stage, key, value):
+		if self.options.count_shuffle:
+			self.increment_counter('shuffle', stage+' records', 1)
+			self.increment_counter('shuffle', stage+' bytes', len(json.dumps(key))+len(json.dumps(value))+2)
+
+	def pair_stats_mapper(self, user, values):
+		# like pair_items_mapper, but yields each pair's sufficient statistics for this user:
+		# (1, x, y, x^2, y^2, xy) with x and y the user's ratings of the two games minus the user's average
+		inputs=self.sample_heavy_user(user, [val for val in values])
+		inputs=sorted(inputs, key=lambda game: game[0])
+		diffs=[(val[0], float(val[1])-float(val[3])) for val in inputs]
+		for (game1, x), (game2, y) in combinations(diffs, 2):
+			stats=(1, x, y, x*x, y*y, x*y)
+			self.count_shuffle('map', (game1, game2), stats)
+			yield (game1, game2), stats
+
+	def sum_stats_combiner(self, key, values):
+		# adds up the statistics a mapper produced for a pair
+		totals=[sum(column) for column in zip(*values)]
+		self.count_shuffle('combine', key, totals)
+		yield key, totals
+
+	def calc_sim_from_stats(self, key, values):
+		# the pearson correlation of the pair's diffs from the summed statistics, with the same conventions as
+		# calc_sim_collector: 0 for fewer than 2 common users or an undefined correlation
+		n, sx, sy, sxx, syy, sxy=[sum(column) for column in zip(*values)]
+		varx=n*sxx-sx*sx
+		vary=n*syy-sy*sy
+		if n>1 and varx>1e-9*abs(n*sxx) and vary>1e-9*abs(n*syy):
+			rho=max(-1., min(1., (n*sxy-sx*sy)/math.sqrt(varx*vary)))
+		else:
+			rho=0
+		yield key, (rho, int(n))
+
 		
 	def calc_sim_collector(self, key, values):
       # Pick up the information from the previous yield, now keyed to pairs of games- so this collects
@@ -79,11 +145,131 @@ class GameSimilarities(MRJob):
 
 	def steps(self):
 		# The steps in the map-reduce process- MrJob runs through these in order
+		if self.options.stats_combiner:
+			pairStep=self.mr(mapper=self.pair_stats_mapper, combiner=self.sum_stats_combiner, reducer=self.calc_sim_from_stats)
+		else:
+			pairStep=self.mr(mapper=self.pair_items_mapper, reducer=self.calc_sim_collector)
 		thesteps = [self.mr(mapper=self.line_mapper, reducer=self.users_items_collector),
-				self.mr(mapper=self.pair_items_mapper, reducer=self.calc_sim_collector)
+				pairStep
 
 		]
 		return thesteps
+
+#Shuffle protocol for GameSimilaritiesPacked: the key is a pair of integer game codes and the value is the six
+#pearson statistics, packed as binary (big-endian int32s and float64s) and base64 encoded so the records stay
+#one line each for Hadoop streaming.  About two thirds the size of the JSON the default protocol writes.
+class PackedStatsProtocol(object):
+	KEY=struct.Struct('>ii')
+	VALUE=struct.Struct('>6d')
+
+	def read(self, line):
+		key, value=line.split('\t', 1)
+		return self.KEY.unpack(base64.b64decode(key)), self.VALUE.unpack(base64.b64decode(value))
+
+	def write(self, key, value):
+		return base64.b64encode(self.KEY.pack(*key))+'\t'+base64.b64encode(self.VALUE.pack(*value))
+
+#Single-stage, integer-keyed version of the job.  Its input has one line per user (see write_encoded_input), so
+#the line_mapper/users_items_collector stage that only groups the csv rows by user isn't needed: the mapper
+#emits the statistics of every pair of the user's games straight away, keyed by integer game codes, and they go
+#through the stats combiner and reducer in the packed binary protocol.  Output keys are game codes; decode_output
+#turns them back into gameIDs to compare with the two-stage job.
+class GameSimilaritiesPacked(GameSimilarities):
+	INTERNAL_PROTOCOL=PackedStatsProtocol
+
+	def user_line_stats_mapper(self, _, line):
+		#line is userCode<TAB>gameCode:diff,gameCode:diff,... with diff the rating minus the user's average
+		user, ratings=line.split('\t')
+		inputs=[]
+		for rating in ratings.split(','):
+			game, diff=rating.split(':')
+			inputs.append((int(game), float(diff)))
+		inputs=sorted(self.sample_heavy_user(user, inputs))
+		for (game1, x), (game2, y) in combinations(inputs, 2):
+			stats=(1, x, y, x*x, y*y, x*y)
+			self.count_shuffle('map', (game1, game2), stats)
+			yield (game1, game2), stats
+
+	def count_shuffle(self, stage, key, value):
+		if self.options.count_shuffle:
+			self.increment_counter('shuffle', stage+' records', 1)
+			self.increment_counter('shuffle', stage+' bytes', len(PackedStatsProtocol().write(key, value))+1)
+
+	def steps(self):
+		return [self.mr(mapper=self.user_line_stats_mapper, combiner=self.sum_stats_combiner, reducer=self.calc_sim_from_stats)]
+
+#Writes the input for GameSimilaritiesPacked from a frame like fullDf: one line per user of integer game codes
+#and user-average-subtracted ratings, plus a file of gameIDs in game code order next to it (path+'.games')
+def write_encoded_input(df, path):
+	gameCodes, gameIDs=pd.factorize(df.gameID.values)
+	diffs=df.rating.values-df.user_avg.values
+	frame=pd.DataFrame({'user': df.user.values, 'game': gameCodes, 'diff': diffs})
+	with open(path, 'w') as fout:
+		for userCode, (user, group) in enumerate(frame.groupby('user')):
+			fout.write('%s\t%s\n' % (userCode, ','.join('%d:%r' % (game, diff) for game, diff in zip(group.game.values, group['diff'].values))))
+	with open(path+'.games', 'w') as fout:
+		fout.write('\n'.join(str(gameID) for gameID in gameIDs))
+
+#maps GameSimilaritiesPacked results keyed by game code pairs to gameID string pairs like the two-stage job
+#outputs, with each pair in the gameID-sorted order pair_items_mapper uses
+def decode_output(results, gamesPath):
+	with open(gamesPath, 'r') as fin:
+		gameIDs=fin.read().split('\n')
+	decoded={}
+	for (game1, game2), value in results.items():
+		key=tuple(sorted((gameIDs[game1], gameIDs[game2])))
+		decoded[key]=value
+	return decoded
+
+#Runs the job on inputPath with the inline runner and returns ({(game1, game2): (rho, n_common)}, shuffle counters, seconds)
+def run_job_inline(inputPath, extraArgs=(), jobClass=GameSimilarities):
+	job=jobClass(args=['-r', 'inline', '--no-conf']+list(extraArgs)+[inputPath])
+	start=time.time()
+	with job.make_runner() as runner:
+		runner.run()
+		elapsed=time.time()-start
+		results={}
+		for line in runner.stream_output():
+			key, value=job.parse_output_line(line)
+			results[tuple(key)]=tuple(value)
+		counters=runner.counters()
+	shuffle={}
+	for stepCounters in counters:
+		shuffle.update(stepCounters.get('shuffle', {}))
+	return results, shuffle, elapsed
+
+#Compares the plain job, the stats combiner and the combiner with a heavy-user cap on the same input (like
+#subset-full.csv): wall time, the records and bytes going into the pair shuffle, and how far the capped
+#similarities are from the exact ones
+def benchmarkShuffle(inputPath, maxGamesPerUser=200):
+	configs=[('raw pairs', []), ('stats combiner', ['--stats-combiner']),
+		('combiner + cap %s' % maxGamesPerUser, ['--stats-combiner', '--max-games-per-user', str(maxGamesPerUser)])]
+	exact=None
+	for label, args in configs:
+		results, shuffle, elapsed=run_job_inline(inputPath, ['--count-shuffle']+args)
+		stage='combine' if '--stats-combiner' in args else 'map'
+		print '%-22s | %7.1fs | shuffle %9s records %12s bytes | %s pairs' % (label, elapsed,
+			shuffle.get(stage+' records', 0), shuffle.get(stage+' bytes', 0), len(results))
+		if exact is None:
+			exact=results
+		else:
+			diffs=[abs(results[key][0]-exact[key][0]) for key in exact if key in results]
+			print '%22s   rho mean abs diff %.4g, max %.4g, %s pairs lost' % ('', np.mean(diffs) if diffs else 0.,
+				max(diffs) if diffs else 0., len(exact)-len(diffs))
+
+#Runs the two-stage job on csvPath (like subset-full.csv) and the packed single-stage job on encodedPath (written
+#by write_encoded_input from the same frame), and checks they give the same similarities and supports
+def compare_packed_job(csvPath, encodedPath):
+	exact, shuffle, elapsed=run_job_inline(csvPath, ['--count-shuffle'])
+	print 'two-stage JSON job    | %7.1fs | shuffle %12s bytes' % (elapsed, shuffle.get('map bytes', 0))
+	packed, shuffle, elapsed=run_job_inline(encodedPath, ['--count-shuffle'], GameSimilaritiesPacked)
+	print 'single-stage packed   | %7.1fs | shuffle %12s bytes' % (elapsed, shuffle.get('combine bytes', 0))
+	packed=decode_output(packed, encodedPath+'.games')
+	diffs=[abs(packed[key][0]-exact[key][0]) for key in exact if key in packed]
+	sameSupport=all(packed.get(key, (0, None))[1]==exact[key][1] for key in exact)
+	print 'same pairs: %s, same supports: %s, max rho diff: %.3g' % (set(packed)==set(exact), sameSupport, max(diffs) if diffs else 0.)
+	return set(packed)==set(exact) and sameSupport
+
 #Calls the Mrjob class initialization
 if __name__ == '__main__':
 	GameSimilarities.run()
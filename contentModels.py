@@ -0,0 +1,227 @@
+
+import numpy as np
+import pandas as pd
+import json
+import os
+import shutil
+import time
+import multiprocessing
+from sklearn import linear_model
+from ratingsIndex import RatingsIndex
+from syntheticRatings import syntheticRatingsFrame
+
+
+#Per-user content models: for every user with at least minRatings ratings of games that have features, a
+#Lasso regression of the user's ratings on the rated games' rows of the sparse feature matrix (see
+#featureMatrix.py), like the single testuser experiment in gamePredictions.py.  A content model can score any
+#game that has features, so it can back recommendations for new games nobody has rated yet.
+#Every user is fitted for a whole decreasing path of alphas with one lasso_path call, which warm-starts each
+#alpha from the previous one's coefficients, so the models for all the alphas cost about 1.4 times one cold fit
+#(for 4 alphas) and the alpha can be picked afterwards without refitting.  The fit only looks at the feature
+#columns the user's games have (the other coefficients are 0 anyway), centered, as a small dense block.
+#The users are fitted in chunks on a pool of processes that inherit the feature matrix and the ratings when the
+#pool forks, so nothing big is pickled to the workers.
+#The coefficients are sparse, so they are stored CSR-style like the neighbor index: the nonzero coefficients of
+#user u at the a-th alpha are at indptr[u*numAlphas+a]:indptr[u*numAlphas+a+1] of the flat features (column)
+#and coefs arrays, in a directory of npy files (with a json header and the users) that is opened memory-mapped.
+
+CONTENT_FORMAT='scrapethegeek-content'
+CONTENT_VERSION=1
+CONTENT_ARRAYS=('indptr','features','coefs','intercepts','numRatings')
+
+class ContentModels:
+    #alphas decreasing; intercepts is numUsers x numAlphas
+    def __init__(self, users, alphas, indptr, features, coefs, intercepts, numRatings, numFeatures):
+        self.users=list(users)
+        self.userCodes=dict((user,u) for u,user in enumerate(self.users))
+        self.alphas=list(alphas)
+        self.indptr=indptr
+        self.features=features
+        self.coefs=coefs
+        self.intercepts=intercepts
+        self.numRatings=numRatings
+        self.numFeatures=numFeatures
+
+    def __contains__(self, user):
+        return user in self.userCodes
+
+    #the user's dense coefficient vector and intercept at alpha (by default the smallest)
+    def coefficients(self, user, alpha=None):
+        a=len(self.alphas)-1 if alpha is None else self.alphas.index(alpha)
+        u=self.userCodes[user]
+        start,end=self.indptr[u*len(self.alphas)+a],self.indptr[u*len(self.alphas)+a+1]
+        coefs=np.zeros(self.numFeatures)
+        coefs[self.features[start:end]]=self.coefs[start:end]
+        return coefs,self.intercepts[u,a]
+
+    #the user's predicted rating for every row of a feature matrix (which can have columns the vocabulary grew
+    #after the models were fitted; those don't count)
+    def scores(self, user, featureMatrix, alpha=None):
+        coefs,intercept=self.coefficients(user,alpha)
+        if featureMatrix.shape[1]>len(coefs):
+            coefs=np.concatenate([coefs,np.zeros(featureMatrix.shape[1]-len(coefs))])
+        return intercept+featureMatrix*coefs
+
+    #[(gameID tuple, predicted rating), ...] for the n best of the listed games (the rows of featureMatrix),
+    #e.g. games too new to have ratings
+    def topGames(self, user, featureMatrix, games, n=10, alpha=None):
+        scores=self.scores(user,featureMatrix,alpha)
+        top=np.argsort(-scores,kind='mergesort')[:n]
+        return [(games[i],scores[i]) for i in top]
+
+    def save(self, path):
+        tmpPath=path.rstrip('/')+'.tmp'
+        if os.path.isdir(tmpPath):
+            shutil.rmtree(tmpPath)
+        os.makedirs(tmpPath)
+        for name in CONTENT_ARRAYS:
+            np.save(os.path.join(tmpPath,name+'.npy'),getattr(self,name))
+        with open(os.path.join(tmpPath,'users.json'),'w') as fout:
+            json.dump(self.users,fout)
+        header={'format':CONTENT_FORMAT,'version':CONTENT_VERSION,'created':time.time(),
+                'numFeatures':self.numFeatures,'alphas':self.alphas}
+        with open(os.path.join(tmpPath,'header.json'),'w') as fout:
+            json.dump(header,fout)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.rename(tmpPath,path)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path,'header.json'),'r') as fin:
+            header=json.load(fin)
+        if header.get('format')!=CONTENT_FORMAT:
+            raise ValueError('%s is not a content model store' % path)
+        with open(os.path.join(path,'users.json'),'r') as fin:
+            users=json.load(fin)
+        arrays=[np.load(os.path.join(path,name+'.npy'),mmap_mode='r') for name in CONTENT_ARRAYS]
+        return cls(users,header['alphas'],*arrays,numFeatures=header['numFeatures'])
+
+
+#Fits one user's ratings y on the feature rows x (csr) for every alpha (decreasing) with one warm-started
+#lasso_path.  Returns a (feature columns, coefficients, intercept) triple per alpha, like a Lasso with
+#fit_intercept=True fitted at that alpha
+def fitUserPath(x, y, alphas, maxIter=1000, tol=1e-4):
+    x=x.tocsr()
+    columns=np.unique(x.indices)
+    block=x[:,columns].toarray()
+    xMean=block.mean(axis=0)
+    yMean=y.mean()
+    if len(columns)==0:
+        return [(columns.astype(np.int32),np.zeros(0,dtype=np.float32),yMean) for alpha in alphas]
+    pathAlphas,coefs,gaps=linear_model.lasso_path(block-xMean,y-yMean,alphas=alphas,max_iter=maxIter,tol=tol)
+    fits=[]
+    for a in range(len(alphas)):
+        nonzero=np.flatnonzero(coefs[:,a])
+        fits.append((columns[nonzero].astype(np.int32),coefs[nonzero,a].astype(np.float32),
+                     yMean-xMean[nonzero].dot(coefs[nonzero,a])))
+    return fits
+
+#set in the parent right before the pool forks, and inherited by the workers
+_contentState={}
+
+#fits the users (codes into the RatingsIndex) of one chunk; returns their fitUserPath results
+def _fitChunk(users):
+    rindex=_contentState['rindex']
+    featureMatrix=_contentState['featureMatrix']
+    gameFeatureRows=_contentState['gameFeatureRows']
+    results=[]
+    for u in users:
+        rows=rindex.userOrder[rindex.userIndptr[u]:rindex.userIndptr[u+1]]
+        featureRows=gameFeatureRows[rindex.rowGameCodes[rows]]
+        known=featureRows>=0
+        results.append(fitUserPath(featureMatrix[featureRows[known]],rindex.ratings[rows][known],
+                                   _contentState['alphas'],_contentState['maxIter'],_contentState['tol']))
+    return results
+
+#Fits a content model for every user in df (a ratings frame like smallDf, with a gameID column) with at least
+#minRatings ratings of games that have features.  featureMatrix is the games x features matrix and gameRows maps
+#str(gameID) to its row.  Every user gets a model for each of the alphas.  Users are fitted usersPerChunk at a
+#time on numWorkers processes (numWorkers=1 fits them in this process).  With path the models are saved there.
+#Returns the ContentModels
+def fitUserContentModels(df, featureMatrix, gameRows, alphas=(0.1,0.05,0.03,0.015), minRatings=20, numWorkers=None,
+                         usersPerChunk=200, maxIter=1000, tol=1e-4, path=None):
+    start=time.time()
+    alphas=sorted(alphas,reverse=True)
+    rindex=RatingsIndex(df)
+    featureMatrix=featureMatrix.tocsr()
+    #the feature row of every game in rindex.games order, -1 for games without features
+    gameIDs=df.drop_duplicates('gameName').set_index('gameName').gameID
+    gameFeatureRows=np.array([gameRows.get(str(gameIDs[name]),-1) for name in rindex.games],dtype=np.int64)
+    #the same codes RatingsIndex numbers users with
+    userCodes=pd.factorize(df.user.values)[0]
+    ratedWithFeatures=np.bincount(userCodes,weights=gameFeatureRows[rindex.rowGameCodes]>=0,
+                                  minlength=len(rindex.users)).astype(np.int64)
+    users=np.flatnonzero(ratedWithFeatures>=minRatings)
+    chunks=[users[i:i+usersPerChunk] for i in range(0,len(users),usersPerChunk)]
+    _contentState.update(rindex=rindex,featureMatrix=featureMatrix,gameFeatureRows=gameFeatureRows,
+                         alphas=alphas,maxIter=maxIter,tol=tol)
+    try:
+        if numWorkers==1 or len(chunks)<2:
+            results=[_fitChunk(chunk) for chunk in chunks]
+        else:
+            pool=multiprocessing.Pool(numWorkers)
+            try:
+                results=pool.map(_fitChunk,chunks,chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        _contentState.clear()
+    fits=[fit for chunk in results for userFits in chunk for fit in userFits]
+    indptr=np.zeros(len(fits)+1,dtype=np.int64)
+    indptr[1:]=np.cumsum([len(features) for features,coefs,intercept in fits])
+    models=ContentModels([rindex.users[u] for u in users],alphas,indptr,
+                         np.concatenate([features for features,coefs,intercept in fits]+[np.zeros(0,dtype=np.int32)]),
+                         np.concatenate([coefs for features,coefs,intercept in fits]+[np.zeros(0,dtype=np.float32)]),
+                         np.array([intercept for features,coefs,intercept in fits],dtype=np.float32).reshape(len(users),len(alphas)),
+                         ratedWithFeatures[users].astype(np.int32),featureMatrix.shape[1])
+    if path:
+        models.save(path)
+    elapsed=time.time()-start
+    print 'fitted %s users at %s alphas in %.1fs (%.1f users/sec)' % (len(users),len(alphas),elapsed,
+        len(users)/elapsed if elapsed>0 else float('inf'))
+    return models
+
+
+#the Lasso objective sklearn minimizes, for checking that two fits are equally good (the solutions aren't unique
+#when a user's games can't tell some features apart)
+def _lassoObjective(x, y, coefs, intercept, alpha):
+    residuals=y-x*coefs-intercept
+    return (residuals**2).sum()/(2.*len(y))+alpha*np.abs(coefs).sum()
+
+#Fits content models for the users of a synthetic ratings frame against synthetic game features, first the way
+#gamePredictions.py fits its testuser (a Lasso per user and alpha) and then with fitUserContentModels, reports
+#users/sec for both and compares the fits' Lasso objectives
+def benchmarkContentModels(numUsers=2000, numGames=500, ratingsPerUser=40, numFeatures=2000, numWorkers=None,
+                           alphas=(0.1,0.05,0.03,0.015), numLoopUsers=200, path='contentModels'):
+    from featureMatrix import syntheticGameFeatures, FeatureVocabulary, buildGameFeatureMatrix
+    from geekscraper import buildDictOfAllGameFeatures
+    df=syntheticRatingsFrame(numUsers=numUsers,numGames=numGames,ratingsPerUser=ratingsPerUser)
+    games,gameFeaturesDict,featureTypes=syntheticGameFeatures(numGames,numFeatures)
+    vocabulary=FeatureVocabulary.fromFeatureDict(buildDictOfAllGameFeatures(games,gameFeaturesDict,featureTypes),featureTypes)
+    featureMatrix=buildGameFeatureMatrix(games,gameFeaturesDict,vocabulary)
+    gameRows=dict((str(gameID),row) for row,gameID in enumerate(sorted(df.gameID.unique())))
+    print '%s users, %s games, %s features, %s alphas' % (numUsers,numGames,len(vocabulary),len(alphas))
+    models=fitUserContentModels(df,featureMatrix,gameRows,alphas=alphas,numWorkers=numWorkers,path=path)
+    loaded=ContentModels.load(path)
+    rindex=RatingsIndex(df)
+    start=time.time()
+    gaps=[]
+    for user in loaded.users[:numLoopUsers]:
+        userDf=rindex.userFrame(user)
+        x=featureMatrix[[gameRows[str(gameID)] for gameID in userDf.gameID.values]]
+        y=userDf.rating.values
+        for alpha in alphas:
+            clf=linear_model.Lasso(alpha=alpha,fit_intercept=True)
+            clf.fit(x,y)
+            coefs,intercept=loaded.coefficients(user,alpha)
+            gaps.append(_lassoObjective(x,y,coefs,intercept,alpha)-_lassoObjective(x,y,clf.coef_,clf.intercept_,alpha))
+    loopTime=time.time()-start
+    print 'Lasso per user and alpha: %.1f users/sec' % (min(numLoopUsers,len(loaded.users))/loopTime)
+    print 'largest objective difference from the per-user Lassos: %.2g' % max(np.abs(gaps))
+    storeSize=sum(os.path.getsize(os.path.join(path,filen)) for filen in os.listdir(path))
+    user=loaded.users[0]
+    print 'store %.2f MB, top new games for %s:' % (storeSize/1e6,user), loaded.topGames(user,featureMatrix,games,n=3)
+    shutil.rmtree(path)
+    return models
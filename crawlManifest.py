@@ -0,0 +1,184 @@
+
+import sqlite3
+import os
+import time
+
+
+#A SQLite record of what the crawl has done, replacing the os.listdir + filename splitting that
+#getListOfGameRatingsAlreadyScraped and getListOfIdsGamePagesAlreadySaved used to rely on.
+#It keeps per-game state (BGG's comment count, page count, status), per-page completion with ETags and
+#timestamps, and the ratings of every finished page, so a crawl that dies mid-game resumes at the
+#first missing page instead of re-fetching the whole game.
+#Game status is 'in_progress' while pages are being fetched, 'complete' once the ratings csv is
+#written and 'not_a_game' for IDs the XML API has no comment count for (usually expansions).
+#The thumbnails table records the image saved for each game (see thumbnails.py): the url it came from, the
+#sha1 of its bytes and the file, so a game is only fetched again if its thumbnail url changes.
+
+SCHEMA="""
+create table if not exists games (
+    gameID text primary key,
+    name text,
+    gameName text,
+    totalItems integer,
+    numPages integer,
+    status text,
+    ratingsFile text,
+    updated real
+);
+create table if not exists pages (
+    gameID text,
+    pageNum integer,
+    etag text,
+    numRatings integer,
+    fetched real,
+    primary key (gameID, pageNum)
+);
+create table if not exists ratings (
+    gameID text,
+    pageNum integer,
+    seq integer,
+    user text,
+    rating text
+);
+create index if not exists ratings_by_game on ratings (gameID, pageNum, seq);
+create table if not exists gamePages (
+    gameID text primary key,
+    name text,
+    path text,
+    saved real
+);
+create table if not exists thumbnails (
+    gameID text primary key,
+    url text,
+    sha1 text,
+    path text,
+    saved real
+);
+create index if not exists thumbnails_by_hash on thumbnails (sha1);
+"""
+
+class CrawlManifest:
+    def __init__(self, path='google_drive/crawlManifest.sqlite'):
+        self.path=path
+        self.conn=sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def gameRecord(self, gameID):
+        row=self.conn.execute('select gameID,name,gameName,totalItems,numPages,status,ratingsFile,updated '
+                              'from games where gameID=?',(str(gameID),)).fetchone()
+        if row is None:
+            return None
+        keys=['gameID','name','gameName','totalItems','numPages','status','ratingsFile','updated']
+        return dict(zip(keys,row))
+
+    #a game needs (re)fetching unless it is complete and BGG still reports the same number of comments.
+    #Games imported from the old folders have no recorded count; their existing csv is kept and the
+    #count is recorded so later crawls can compare against it
+    def needsRefresh(self, gameID, totalItems):
+        record=self.gameRecord(gameID)
+        if record is None or record['status']=='in_progress':
+            return True
+        if record['status']=='not_a_game':
+            return totalItems is not None
+        if record['totalItems'] is None:
+            with self.conn:
+                self.conn.execute('update games set totalItems=?,updated=? where gameID=?',(totalItems,time.time(),str(gameID)))
+            return False
+        return record['totalItems']!=totalItems
+
+    #Registers a game crawl.  An unfinished crawl of the same game with the same comment count is resumed;
+    #otherwise (new game, or the comment count changed so the pages have shifted) its pages are cleared
+    #Returns the set of page numbers already done
+    def startGame(self, gameID, name, gameName, totalItems, numPages):
+        gameID=str(gameID)
+        record=self.gameRecord(gameID)
+        with self.conn:
+            if record is None or record['status']!='in_progress' or record['totalItems']!=totalItems:
+                self.conn.execute('delete from pages where gameID=?',(gameID,))
+                self.conn.execute('delete from ratings where gameID=?',(gameID,))
+            self.conn.execute('insert or replace into games values (?,?,?,?,?,?,?,?)',
+                              (gameID,name,gameName,totalItems,numPages,'in_progress',None,time.time()))
+        return self.pagesDone(gameID)
+
+    def pagesDone(self, gameID):
+        rows=self.conn.execute('select pageNum from pages where gameID=?',(str(gameID),))
+        return set(row[0] for row in rows)
+
+    #records a fetched page and its ratings in one transaction, so a page is either fully saved or not at all
+    def savePage(self, gameID, pageNum, users, ratings, etag=None):
+        gameID=str(gameID)
+        with self.conn:
+            self.conn.execute('delete from ratings where gameID=? and pageNum=?',(gameID,pageNum))
+            self.conn.executemany('insert into ratings values (?,?,?,?,?)',
+                                  [(gameID,pageNum,i,user,rating) for i,(user,rating) in enumerate(zip(users,ratings))])
+            self.conn.execute('insert or replace into pages values (?,?,?,?,?)',
+                              (gameID,pageNum,etag,len(users),time.time()))
+
+    def pageEtag(self, gameID, pageNum):
+        row=self.conn.execute('select etag from pages where gameID=? and pageNum=?',(str(gameID),pageNum)).fetchone()
+        return row[0] if row else None
+
+    #the saved users and ratings of a game, in page order
+    def gameRatings(self, gameID):
+        rows=self.conn.execute('select user,rating from ratings where gameID=? order by pageNum,seq',(str(gameID),)).fetchall()
+        return [row[0] for row in rows],[row[1] for row in rows]
+
+    #marks the game finished and drops its page ratings, which now live in the ratings csv
+    def completeGame(self, gameID, ratingsFile):
+        gameID=str(gameID)
+        with self.conn:
+            self.conn.execute('update games set status=?,ratingsFile=?,updated=? where gameID=?',
+                              ('complete',ratingsFile,time.time(),gameID))
+            self.conn.execute('delete from ratings where gameID=?',(gameID,))
+
+    def markNotAGame(self, gameID, name):
+        with self.conn:
+            self.conn.execute('insert or replace into games values (?,?,?,?,?,?,?,?)',
+                              (str(gameID),name,None,None,None,'not_a_game',None,time.time()))
+
+    #(gameID, name) tuples for the games whose ratings are complete, like getListOfGameRatingsAlreadyScraped
+    def gamesScraped(self):
+        rows=self.conn.execute("select gameID,name from games where status='complete' order by rowid")
+        return [(row[0],row[1]) for row in rows]
+
+    def markGamePageSaved(self, gameID, name, path):
+        with self.conn:
+            self.conn.execute('insert or replace into gamePages values (?,?,?,?)',(str(gameID),name,path,time.time()))
+
+    def gamePagesSaved(self):
+        return [row[0] for row in self.conn.execute('select gameID from gamePages order by rowid')]
+
+    def markThumbnailSaved(self, gameID, url, sha1, path):
+        with self.conn:
+            self.conn.execute('insert or replace into thumbnails values (?,?,?,?,?)',(str(gameID),url,sha1,path,time.time()))
+
+    #a dictionary keyed by gameID containing the url of the saved thumbnail
+    def thumbnailsSaved(self):
+        return dict(self.conn.execute('select gameID,url from thumbnails'))
+
+    #the file already holding an image with the given sha1, or None
+    def thumbnailPathForHash(self, sha1):
+        row=self.conn.execute('select path from thumbnails where sha1=? limit 1',(sha1,)).fetchone()
+        return row[0] if row else None
+
+    #One-time bootstrap from the existing output folders.  Names are everything between the ID and the
+    #extension, so names with underscores in them survive.  Comment counts are unknown for these games
+    #until a crawl looks at them (see needsRefresh).
+    def importExistingFiles(self, ratingsDir='google_drive/gameRatings/', pagesDir='google_drive/game_pages/'):
+        prefix='gamereviews_id_'
+        with self.conn:
+            for filen in sorted(os.listdir(ratingsDir)):
+                if filen.startswith(prefix) and filen.endswith('.csv'):
+                    gameID,name=filen[len(prefix):-len('.csv')].split('_',1)
+                    if self.gameRecord(gameID) is None:
+                        self.conn.execute('insert into games values (?,?,?,?,?,?,?,?)',
+                                          (gameID,name,None,None,None,'complete',os.path.join(ratingsDir,filen),time.time()))
+            for filen in sorted(os.listdir(pagesDir)):
+                if filen.endswith('.txt') and '_' in filen:
+                    gameID,name=filen[:-len('.txt')].split('_',1)
+                    self.conn.execute('insert or ignore into gamePages values (?,?,?,?)',
+                                      (gameID,name,os.path.join(pagesDir,filen),time.time()))
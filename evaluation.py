@@ -0,0 +1,140 @@
+
+import numpy as np
+import os
+import time
+import multiprocessing
+from ratingsIndex import RatingsIndex
+from batchPredictor import predictBatch
+from bulkRecommendations import gameNeighborLists, userRecommendations
+from modelSnapshot import saveSnapshot, loadSnapshot
+from syntheticRatings import syntheticRatingsFrame
+
+
+#Offline evaluation of the item-kNN recommender.  The ratings are split into train and test sets, either k-fold
+#(every rating lands in one of numFolds test sets at random) or a temporal holdout.  The ratings store keeps no
+#rating dates, so the temporal holdout takes the last testFraction of every user's ratings in store order (the
+#order the games were scraped in) as a stand-in.
+#For every fold the similarity model is built once from the train ratings and saved as a snapshot (see
+#modelSnapshot.py), and every (fold, k, reg) configuration is then scored by a pool of processes that open the
+#fold's snapshot memory-mapped.  For each configuration:
+#    rmse           of ratingPredictor's predictions (through predictBatch) of the test ratings
+#    baseline rmse  of the calcBase baseline alone, for comparison
+#    precision@N    the share of a user's top N recommendations (as get_top_recos_for_user ranks them) that the
+#                   user rated relevantRating or more in the test set, averaged over the test users
+#    coverage       the share of the train games that make it into at least one user's top N
+#Test ratings of users or games that aren't in the train set can't be predicted and are left out.
+
+#Returns a list of boolean test masks over the rows of df
+def holdoutMasks(df, method='kfold', numFolds=5, testFraction=0.2, seed=0):
+    if method=='kfold':
+        folds=np.random.RandomState(seed).randint(0,numFolds,len(df))
+        return [folds==fold for fold in range(numFolds)]
+    if method=='temporal':
+        rindex=RatingsIndex(df)
+        test=np.zeros(len(df),dtype=bool)
+        for u in range(len(rindex.users)):
+            rows=rindex.userOrder[rindex.userIndptr[u]:rindex.userIndptr[u+1]]
+            numTest=int(len(rows)*testFraction)
+            if numTest:
+                test[rows[-numTest:]]=True
+        return [test]
+    raise ValueError('unknown holdout method %s' % method)
+
+#set in the parent right before the pool forks, and inherited by the workers
+_evalState={}
+
+#the train frame, RatingsIndex and snapshot database of a fold, built once per process
+def _foldModel(fold):
+    models=_evalState.setdefault('models',{})
+    if fold not in models:
+        from buildPandasDF import recompute_frame
+        df=_evalState['df']
+        trainDf=recompute_frame(df[~_evalState['masks'][fold]])
+        dbase,baseline=loadSnapshot(_evalState['snapshots'][fold])
+        models[fold]=(trainDf,RatingsIndex(trainDf),dbase)
+    return models[fold]
+
+def _evaluateConfig(config):
+    fold,k,reg=config
+    start=time.time()
+    trainDf,rindex,dbase=_foldModel(fold)
+    df=_evalState['df']
+    test=df[_evalState['masks'][fold]]
+    known=np.array([user in rindex.userCodes for user in test.user.values])&np.array(
+        [game in dbase.gameNames for game in test.gameName.values])
+    test=test[known]
+    actual=test.rating.values.astype(np.float64)
+    predicted=predictBatch(test.user.values,test.gameName.values,dbase,rindex,k,reg)
+    baseline=np.array([rindex.base(user,game) for user,game in zip(test.user.values,test.gameName.values)])
+    numRecos=_evalState['numRecos']
+    neighbors=gameNeighborLists(dbase,rindex,k,reg)
+    relevant={}
+    for user,game,rating in zip(test.user.values,test.gameName.values,actual):
+        if rating>=_evalState['relevantRating']:
+            relevant.setdefault(user,set()).add(rindex.gameCodes[game])
+    users=sorted(relevant)
+    if len(users)>_evalState['maxUsers']:
+        users=[users[i] for i in np.random.RandomState(fold).choice(len(users),_evalState['maxUsers'],replace=False)]
+    precisions=[]
+    recommended=set()
+    for user in users:
+        games,scores=userRecommendations(rindex,neighbors,rindex.userCodes[user],_evalState['topChoices'],numRecos)
+        precisions.append(len(relevant[user].intersection(games))/float(numRecos))
+        recommended.update(games)
+    return {'fold':fold,'k':k,'reg':reg,'numTest':len(actual),
+            'rmse':np.sqrt(np.mean((predicted-actual)**2)) if len(actual) else np.nan,
+            'baselineRmse':np.sqrt(np.mean((baseline-actual)**2)) if len(actual) else np.nan,
+            'precision':np.mean(precisions) if precisions else np.nan,
+            'coverage':len(recommended)/float(len(rindex.games)),
+            'seconds':time.time()-start}
+
+#Evaluates ratingPredictor and the top-N recommendations on df (a frame like smallDf, e.g. from
+#buildDfFromRatingsStore) for every combination of ks and regs.  The fold models are cached as snapshots under
+#cacheDir.  Prints a line per (fold, k, reg) and the averages over folds, and returns the per-fold results
+def evaluateRecommender(df, ks=(5,7,10), regs=(50.,200.,1000.), method='kfold', numFolds=5, testFraction=0.2,
+                        numRecos=10, topChoices=5, relevantRating=7., maxUsers=2000, numWorkers=None,
+                        cacheDir='google_drive/evaluation/', seed=0):
+    from buildPandasDF import Database, recompute_frame
+    df=df.reset_index(drop=True)
+    masks=holdoutMasks(df,method,numFolds,testFraction,seed)
+    snapshots=[]
+    for fold,mask in enumerate(masks):
+        start=time.time()
+        trainDf=recompute_frame(df[~mask])
+        db=Database(trainDf)
+        db.populate_by_vectorizing()
+        path=os.path.join(cacheDir,'fold%s' % fold)
+        saveSnapshot(db,path)
+        snapshots.append(path)
+        print 'fold %s: trained on %s ratings in %.1fs' % (fold,len(trainDf),time.time()-start)
+    configs=[(fold,k,reg) for fold in range(len(masks)) for k in ks for reg in regs]
+    _evalState.update(df=df,masks=masks,snapshots=snapshots,numRecos=numRecos,topChoices=topChoices,
+                      relevantRating=relevantRating,maxUsers=maxUsers)
+    try:
+        if numWorkers==1:
+            results=[_evaluateConfig(config) for config in configs]
+        else:
+            pool=multiprocessing.Pool(numWorkers)
+            try:
+                results=pool.map(_evaluateConfig,configs,chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        _evalState.clear()
+    print 'fold |   k |    reg |     rmse | baseline rmse | precision@%-3s | coverage | seconds' % numRecos
+    for result in results:
+        print '%4s | %3s | %6g | %8.4f | %13.4f | %13.4f | %8.3f | %7.2f' % (result['fold'],result['k'],result['reg'],
+            result['rmse'],result['baselineRmse'],result['precision'],result['coverage'],result['seconds'])
+    print 'averages over folds:'
+    for k in ks:
+        for reg in regs:
+            runs=[result for result in results if result['k']==k and result['reg']==reg]
+            print ' all | %3s | %6g | %8.4f | %13.4f | %13.4f | %8.3f | %7.2f' % (k,reg,
+                np.mean([run['rmse'] for run in runs]),np.mean([run['baselineRmse'] for run in runs]),
+                np.mean([run['precision'] for run in runs]),np.mean([run['coverage'] for run in runs]),
+                np.mean([run['seconds'] for run in runs]))
+    return results
+
+if __name__ == '__main__':
+    evaluateRecommender(syntheticRatingsFrame(numUsers=5000,numGames=300),cacheDir='evaluation/')
@@ -0,0 +1,210 @@
+
+import sqlite3
+import hashlib
+import os
+import time
+import multiprocessing
+import pandas as pd
+from geekscraper import getFeaturesFromSavedGamePage, parseGamePage, GAME_FEATURE_TYPES
+
+
+#A SQLite cache of the features parsed out of the saved game pages, replacing the gameFeaturesDict pickle.
+#Parsed features are stored under the sha1 of the page's bytes, and every game points at the hash of its
+#page, so extractGameFeatures only reparses pages whose bytes changed since the last run (or that are new).
+#The features table is the compact feature table: one (featureType, featureID, featureName) row per feature,
+#the same tuples getFeaturesFromSavedGamePage puts in its sets.  The url of the page's thumbnail image is kept
+#with the parse, so the thumbnail downloads (see thumbnails.py) don't need to parse the pages again.
+#Caches made before the thumbnailUrl column existed get it added when opened, and their pages are reparsed
+#once on the next extractGameFeatures to fill it in.
+
+SCHEMA="""
+create table if not exists pages (
+    gameID text primary key,
+    name text,
+    sha1 text,
+    updated real
+);
+create table if not exists parsed (
+    sha1 text primary key,
+    parsed real,
+    thumbnailUrl text
+);
+create table if not exists features (
+    sha1 text,
+    featureType text,
+    featureID text,
+    featureName text
+);
+create index if not exists features_by_hash on features (sha1);
+"""
+
+class FeatureCache:
+    def __init__(self, path='google_drive/gameFeatures.sqlite'):
+        self.path=path
+        self.conn=sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        self.migrate()
+
+    #adds the columns later versions added to the tables of an older cache
+    def migrate(self):
+        columns=[row[1] for row in self.conn.execute('pragma table_info(parsed)')]
+        if 'thumbnailUrl' not in columns:
+            with self.conn:
+                self.conn.execute('alter table parsed add column thumbnailUrl text')
+                #forget the old parses so the pages get parsed again for their thumbnail urls
+                self.conn.execute('delete from parsed')
+
+    def close(self):
+        self.conn.close()
+
+    def isParsed(self, sha1):
+        return self.conn.execute('select 1 from parsed where sha1=?',(sha1,)).fetchone() is not None
+
+    #points a gameID tuple (IDnumber, name) at the hash of its page
+    def setPage(self, gameID, sha1):
+        with self.conn:
+            self.conn.execute('insert or replace into pages values (?,?,?,?)',(str(gameID[0]),gameID[1],sha1,time.time()))
+
+    def dropPage(self, gameID):
+        with self.conn:
+            self.conn.execute('delete from pages where gameID=?',(str(gameID[0]),))
+
+    #stores the features parsed out of the page with the hash sha1, a dictionary like getFeaturesFromSavedGamePage's,
+    #and the url of its thumbnail
+    def storeFeatures(self, sha1, featuresDict, thumbnailUrl=None):
+        rows=[(sha1,featureType,feature[0],feature[1]) for featureType in featuresDict for feature in featuresDict[featureType]]
+        with self.conn:
+            self.conn.execute('delete from features where sha1=?',(sha1,))
+            self.conn.executemany('insert into features values (?,?,?,?)',rows)
+            self.conn.execute('insert or replace into parsed values (?,?,?)',(sha1,time.time(),thumbnailUrl))
+
+    #drops the features of pages no game points at any more
+    def prune(self):
+        with self.conn:
+            self.conn.execute('delete from features where sha1 not in (select sha1 from pages)')
+            self.conn.execute('delete from parsed where sha1 not in (select sha1 from pages)')
+
+    #the feature table as a frame with gameID, name, featureType, featureID and featureName columns
+    def featureTable(self):
+        rows=self.conn.execute('select pages.gameID,pages.name,featureType,featureID,featureName '
+                               'from pages join features on pages.sha1=features.sha1 '
+                               'order by pages.gameID,featureType,featureID').fetchall()
+        return pd.DataFrame(rows,columns=['gameID','name','featureType','featureID','featureName'])
+
+    #the dictionary keyed by gameID tuple (IDnumber, name) containing the features dictionaries, like the old
+    #gameFeaturesDict pickle.  With games, only those games (the ones that have been extracted)
+    def gameFeaturesDict(self, games=None):
+        gameFeaturesDict={}
+        pages=self.conn.execute('select gameID,name from pages').fetchall()
+        for gameID,name in pages:
+            gameFeaturesDict[(gameID,name)]=dict((featureType,set()) for featureType in GAME_FEATURE_TYPES)
+        for gameID,name,featureType,featureID,featureName in self.featureTable().itertuples(index=False):
+            gameFeaturesDict[(gameID,name)].setdefault(featureType,set()).add((featureID,featureName))
+        if games is not None:
+            gameFeaturesDict=dict((game,gameFeaturesDict[game]) for game in games if game in gameFeaturesDict)
+        return gameFeaturesDict
+
+    #a dictionary keyed by gameID tuple (IDnumber, name) containing the thumbnail urls of the games whose pages
+    #have one.  With games, only those games
+    def thumbnailUrls(self, games=None):
+        rows=self.conn.execute('select pages.gameID,pages.name,thumbnailUrl from pages join parsed '
+                               'on pages.sha1=parsed.sha1 where thumbnailUrl is not null').fetchall()
+        thumbnailUrls=dict(((gameID,name),url) for gameID,name,url in rows)
+        if games is not None:
+            thumbnailUrls=dict((game,thumbnailUrls[game]) for game in games if game in thumbnailUrls)
+        return thumbnailUrls
+
+
+def _pagePath(pageDir, gameID):
+    return os.path.join(pageDir,'%s_%s.txt' % (gameID[0],gameID[1]))
+
+#parses one saved page in a pool worker.  Returns (gameID, sha1 of the bytes parsed, (features dictionary,
+#thumbnail url)), with the error message instead if the page couldn't be parsed
+def _parsePage(args):
+    gameID,path=args
+    with open(path,'rb') as fin:
+        source=fin.read()
+    sha1=hashlib.sha1(source).hexdigest()
+    try:
+        return gameID,sha1,parseGamePage(source,gameID,verbose=False)
+    except Exception as e:
+        return gameID,sha1,'%s: %s' % (type(e).__name__,e)
+
+#Extracts the features of the saved pages of the listed gameID tuples (IDnumber, name) into the cache.
+#Every page is hashed, and the ones the cache hasn't parsed are parsed on a pool of numWorkers processes
+#(numWorkers=1 parses in this process).  Games without a saved page, and pages that fail to parse, are
+#printed and left out (a game whose page no longer parses loses its old features).  Returns the games'
+#features dictionary (see FeatureCache.gameFeaturesDict) and a dictionary of statistics
+def extractGameFeatures(games, cache, numWorkers=None, pageDir='google_drive/game_pages/', chunksize=8):
+    start=time.time()
+    todo=[]
+    missing=[]
+    cached=0
+    for gameID in games:
+        path=_pagePath(pageDir,gameID)
+        if not os.path.exists(path):
+            missing.append(gameID)
+            continue
+        with open(path,'rb') as fin:
+            sha1=hashlib.sha1(fin.read()).hexdigest()
+        if cache.isParsed(sha1):
+            cache.setPage(gameID,sha1)
+            cached+=1
+        else:
+            todo.append((gameID,path))
+    parseStart=time.time()
+    failed=[]
+    pool=multiprocessing.Pool(numWorkers) if numWorkers!=1 and len(todo)>1 else None
+    try:
+        results=pool.imap_unordered(_parsePage,todo,chunksize) if pool else (_parsePage(args) for args in todo)
+        for gameID,sha1,parsed in results:
+            if isinstance(parsed,tuple):
+                features,thumbnailUrl=parsed
+                cache.storeFeatures(sha1,features,thumbnailUrl)
+                cache.setPage(gameID,sha1)
+            else:
+                cache.dropPage(gameID)
+                failed.append((gameID,parsed))
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    cache.prune()
+    end=time.time()
+    stats={'pages':len(games)-len(missing),'parsed':len(todo)-len(failed),'cached':cached,'missing':len(missing),
+           'failed':len(failed),'seconds':end-start,'parseSeconds':end-parseStart}
+    stats['pagesPerSec']=stats['pages']/stats['seconds'] if stats['seconds']>0 else float('inf')
+    stats['parsedPerSec']=len(todo)/stats['parseSeconds'] if stats['parseSeconds']>0 else float('inf')
+    for gameID in missing:
+        print 'no saved page for', gameID
+    for gameID,error in failed:
+        print 'unable to parse the page for', gameID, error
+    print ('%(pages)s pages in %(seconds).1fs (%(pagesPerSec).1f pages/sec): %(parsed)s parsed at '
+           '%(parsedPerSec).1f pages/sec, %(cached)s unchanged' % stats)
+    return cache.gameFeaturesDict(games),stats
+
+#Times the old serial loop over getFeaturesFromSavedGamePage against extractGameFeatures into an empty cache
+#and again into the warm one, and checks all three return the same features
+def benchmarkFeatureExtraction(games, path='featureCacheBenchmark.sqlite', numWorkers=None,
+                               pageDir='google_drive/game_pages/'):
+    games=[gameID for gameID in games if os.path.exists(_pagePath(pageDir,gameID))]
+    start=time.time()
+    serial={}
+    for gameID in games:
+        serial[gameID]=getFeaturesFromSavedGamePage(gameID,verbose=False)
+    serialTime=time.time()-start
+    if os.path.exists(path):
+        os.remove(path)
+    cache=FeatureCache(path)
+    try:
+        cold,coldStats=extractGameFeatures(games,cache,numWorkers,pageDir)
+        warm,warmStats=extractGameFeatures(games,cache,numWorkers,pageDir)
+    finally:
+        cache.close()
+        os.remove(path)
+    print 'serial loop: %.1f pages/sec' % (len(games)/serialTime if serialTime>0 else float('inf'))
+    print 'empty cache: %.1f pages/sec' % coldStats['pagesPerSec']
+    print 'warm cache:  %.1f pages/sec' % warmStats['pagesPerSec']
+    print 'same features:', serial==cold==warm
+    return serialTime,coldStats,warmStats
@@ -0,0 +1,154 @@
+
+import numpy as np
+import scipy.sparse as sp
+import codecs
+import time
+import random
+from geekscraper import buildDictOfAllGameFeatures, buildGameFeaturesDf
+
+
+#A sparse replacement for buildGameFeaturesDf.  Most games have a few dozen of the thousands of publisher,
+#designer, mechanic and category tags, so the dense games x features frame is almost all zeros, and filling it
+#a cell at a time is slow.  Here the feature columns are numbered by a FeatureVocabulary and the games x
+#features matrix is built in one go as a scipy CSR matrix of 0s and 1s.
+#The vocabulary only ever grows: features seen for the first time are appended at the end, so a column keeps
+#its number when games are added and a matrix built against an older vocabulary only needs to be widened
+#(see resizeToVocabulary and appendGames).  A vocabulary can be saved to a tab-separated file to keep the
+#column numbering between runs.
+
+class FeatureVocabulary:
+    def __init__(self):
+        #(featureType, featureID, featureName) of every column
+        self.features=[]
+        self.columns={}
+
+    #a vocabulary over the feature types in featuresIncluded of the dictionary buildDictOfAllGameFeatures returns
+    @classmethod
+    def fromFeatureDict(cls, allFeaturesDict, featuresIncluded):
+        vocabulary=cls()
+        vocabulary.extend(allFeaturesDict,featuresIncluded)
+        return vocabulary
+
+    def __len__(self):
+        return len(self.features)
+
+    def column(self, featureType, feature):
+        return self.columns.get((featureType,feature[0]))
+
+    #appends the features that aren't in the vocabulary yet, sorted within each feature type so the numbering
+    #doesn't depend on set order.  Returns the number of columns added
+    def extend(self, allFeaturesDict, featuresIncluded):
+        numFeatures=len(self.features)
+        for featureType in featuresIncluded:
+            for feature in sorted(allFeaturesDict.get(featureType,())):
+                if (featureType,feature[0]) not in self.columns:
+                    self.columns[(featureType,feature[0])]=len(self.features)
+                    self.features.append((featureType,feature[0],feature[1]))
+        return len(self.features)-numFeatures
+
+    #the feature types the vocabulary has columns for, in order of their first column
+    def featureTypes(self):
+        featureTypes=[]
+        for featureType,featureID,featureName in self.features:
+            if featureType not in featureTypes:
+                featureTypes.append(featureType)
+        return featureTypes
+
+    #the (featureID, featureName) tuple of every column, like the featureVector buildGameFeaturesDf takes
+    def featureTuples(self):
+        return [(featureID,featureName) for featureType,featureID,featureName in self.features]
+
+    def save(self, path):
+        with codecs.open(path,'w','utf-8') as fout:
+            for feature in self.features:
+                fout.write(u'\t'.join(unicode(value) for value in feature)+u'\n')
+
+    @classmethod
+    def load(cls, path):
+        vocabulary=cls()
+        with codecs.open(path,'r','utf-8') as fin:
+            for line in fin:
+                featureType,featureID,featureName=line.rstrip('\n').split('\t')
+                vocabulary.columns[(featureType,featureID)]=len(vocabulary.features)
+                vocabulary.features.append((featureType,featureID,featureName))
+        return vocabulary
+
+
+#Builds the games x features CSR matrix for the listed gameID tuples (IDnumber, name): a row per game in games
+#order with a 1 in the column of each of its features.  Only the feature types in featuresIncluded (by default
+#the vocabulary's) are used, and with grow=True features the vocabulary hasn't seen are added to it first;
+#otherwise they are left out
+def buildGameFeatureMatrix(games, gameFeaturesDict, vocabulary, featuresIncluded=None, grow=False, dtype=np.float64):
+    if featuresIncluded is None:
+        featuresIncluded=vocabulary.featureTypes()
+    if grow:
+        vocabulary.extend(buildDictOfAllGameFeatures(games,gameFeaturesDict,featuresIncluded),featuresIncluded)
+    indptr=np.zeros(len(games)+1,dtype=np.int64)
+    indices=[]
+    for row,gameID in enumerate(games):
+        gameFeatures=gameFeaturesDict[gameID]
+        columns=set()
+        for featureType in featuresIncluded:
+            for feature in gameFeatures[featureType]:
+                column=vocabulary.column(featureType,feature)
+                if column is not None:
+                    columns.add(column)
+        indices.extend(sorted(columns))
+        indptr[row+1]=len(indices)
+    indices=np.array(indices,dtype=np.int32)
+    return sp.csr_matrix((np.ones(len(indices),dtype=dtype),indices,indptr),shape=(len(games),len(vocabulary)))
+
+#widens a matrix built against an earlier state of the vocabulary to all of its columns; the new columns are empty
+def resizeToVocabulary(matrix, vocabulary):
+    matrix=matrix.tocsr()
+    return sp.csr_matrix((matrix.data,matrix.indices,matrix.indptr),shape=(matrix.shape[0],len(vocabulary)))
+
+#Adds rows for newGames to a feature matrix, growing the vocabulary with their features.  Returns the matrix
+#of the old games followed by the new ones
+def appendGames(matrix, newGames, gameFeaturesDict, vocabulary, featuresIncluded=None):
+    newRows=buildGameFeatureMatrix(newGames,gameFeaturesDict,vocabulary,featuresIncluded,grow=True,dtype=matrix.dtype)
+    return sp.vstack([resizeToVocabulary(matrix,vocabulary),newRows],format='csr')
+
+
+#Synthetic games with featuresPerGame features each out of numFeatures, spread over the feature types the
+#analysis uses, with popular features more common like publishers and mechanics are
+def syntheticGameFeatures(numGames=1000, numFeatures=5000, featuresPerGame=15, seed=0):
+    featureTypes=['boardgamecategory','boardgamesubdomain','boardgamepublisher','boardgamemechanic','playTime','bestNumPlayers']
+    rand=random.Random(seed)
+    weights=1./np.arange(1,numFeatures+1)
+    weights=np.cumsum(weights/weights.sum())
+    games=[(str(1000+i),'game-%s' % i) for i in range(numGames)]
+    gameFeaturesDict={}
+    for gameID in games:
+        features=dict((featureType,set()) for featureType in featureTypes)
+        for i in range(featuresPerGame):
+            f=int(np.searchsorted(weights,rand.random()))
+            features[featureTypes[f%len(featureTypes)]].add((str(f),'feature-%s' % f))
+        gameFeaturesDict[gameID]=features
+    return games,gameFeaturesDict,featureTypes
+
+#Compares buildGameFeaturesDf with buildGameFeatureMatrix on synthetic games: build time, memory and that the
+#two agree.  Then adds newGames more games to the sparse matrix with appendGames
+def benchmarkFeatureMatrix(numGames=300, numFeatures=3000, featuresPerGame=15, newGames=100):
+    games,gameFeaturesDict,featureTypes=syntheticGameFeatures(numGames+newGames,numFeatures,featuresPerGame)
+    games,laterGames=games[:numGames],games[numGames:]
+    allFeaturesDict=buildDictOfAllGameFeatures(games,gameFeaturesDict,featureTypes)
+    start=time.time()
+    vocabulary=FeatureVocabulary.fromFeatureDict(allFeaturesDict,featureTypes)
+    matrix=buildGameFeatureMatrix(games,gameFeaturesDict,vocabulary)
+    sparseTime=time.time()-start
+    start=time.time()
+    fDf=buildGameFeaturesDf(vocabulary.featureTuples(),games,gameFeaturesDict,featureTypes)
+    denseTime=time.time()-start
+    sparseBytes=matrix.data.nbytes+matrix.indices.nbytes+matrix.indptr.nbytes
+    print '%s games, %s features, %.1f features per game' % (numGames,len(vocabulary),matrix.nnz/float(numGames))
+    print 'dense frame:   %7.3fs | %8.2f MB' % (denseTime,fDf.values.nbytes/1e6)
+    print 'sparse matrix: %7.3fs | %8.2f MB' % (sparseTime,sparseBytes/1e6)
+    print 'same 0s and 1s:', (fDf.values==matrix.toarray()).all()
+    numColumns=len(vocabulary)
+    start=time.time()
+    grown=appendGames(matrix,laterGames,gameFeaturesDict,vocabulary,featureTypes)
+    print 'added %s games and %s new features in %.3fs' % (len(laterGames),len(vocabulary)-numColumns,time.time()-start)
+    rebuilt=buildGameFeatureMatrix(games+laterGames,gameFeaturesDict,vocabulary)
+    print 'same as rebuilding:', (grown!=rebuilt).nnz==0
+    return denseTime,sparseTime
@@ -4,25 +4,22 @@
 ##########################################
 
 
-# gameFeaturesDict=defaultdict(dict)
-# for i, gameID in enumerate(gameRatingsAlreadyScraped):
-#     print gameID, 'Building features for', i,'out of',len(gameRatingsAlreadyScraped)
-#     gameFeaturesDict[gameID]=getFeaturesFromSavedGamePage(gameID)
-# with open('google_drive/gameFeaturesDict','w') as fout:
-#     pickle.dump(gameFeaturesDict, fout)
-
-
-fin=open('google_drive/gameFeaturesDict','r')
-gameFeaturesDict=pickle.load(fin)
+#Parse the features out of the saved game pages on a process pool into the feature cache (see featureCache.py).
+#Re-runs only reparse the pages that changed
+from featureCache import FeatureCache, extractGameFeatures
+featureCache=FeatureCache()
+gameFeaturesDict,extractionStats=extractGameFeatures(gameRatingsAlreadyScraped,featureCache)
 
 featuresToInclude=['boardgamecategory','boardgamesubdomain','boardgamepublisher','boardgamemechanic','playTime','bestNumPlayers']
 allFeaturesDict=buildDictOfAllGameFeatures(gameRatingsAlreadyScraped,gameFeaturesDict,featuresToInclude)
-featureVector=[]
-for featureType in featuresToInclude:
-    featureVector=featureVector+list(allFeaturesDict[featureType])
+#number the features (see featureMatrix.py) and build the sparse games x features matrix, a row per game
+from featureMatrix import FeatureVocabulary, buildGameFeatureMatrix
+vocabulary=FeatureVocabulary.fromFeatureDict(allFeaturesDict,featuresToInclude)
+featureVector=vocabulary.featureTuples()
 print 'There are',len(featureVector),'features in the categories:\n', allFeaturesDict.keys()
 print allFeaturesDict
-fDf=buildGameFeaturesDf(featureVector,gameRatingsAlreadyScraped,gameFeaturesDict)
+featureMatrix=buildGameFeatureMatrix(gameRatingsAlreadyScraped,gameFeaturesDict,vocabulary)
+gameRows=dict((gameID[0],row) for row,gameID in enumerate(gameRatingsAlreadyScraped))
 
 
 ####Try out a linear regression on the features for games reviewed by a testuser
@@ -33,7 +30,7 @@ testuser='nicodemus055'
 gamesReviewedByUser=smallDf[smallDf.user==testuser]
 xinds=gamesReviewedByUser.gameID.values
 xinds=[str(ind) for ind in xinds]
-x=fDf.loc[xinds]
+x=featureMatrix[[gameRows[ind] for ind in xinds]]
 y=gamesReviewedByUser['rating'].values
 y=[[val] for val in y]
 clf = linear_model.Lasso(alpha = 0.015,fit_intercept=True)
@@ -52,3 +49,23 @@ sortedInds=np.argsort(abs(coefs))[::-1][0:numUsefulFeatures]
 print 'intercept:',intc,'\ncoefs', coefs[sortedInds]
 for ind in sortedInds: 
     print featureVector[ind],coefs[ind]
+
+
+####Fit a content model like the one above for every user with at least 20 rated games that have features,
+#at several alphas, on a process pool (see contentModels.py), and save the coefficients
+# from contentModels import fitUserContentModels, ContentModels
+# contentModels=fitUserContentModels(smallDf,featureMatrix,gameRows,alphas=(0.1,0.05,0.03,0.015),minRatings=20,
+#                                    path='google_drive/contentModels')
+#later runs can open the saved models instead of refitting
+# contentModels=ContentModels.load('google_drive/contentModels')
+# if testuser in contentModels:
+#     print 'content model picks for', testuser, contentModels.topGames(testuser,featureMatrix,gameRatingsAlreadyScraped,n=10,alpha=0.015)
+
+
+####Score new releases from their features and first votes (see coldStart.py).  The similarity blends the
+#content and collaborative sides by common support like shrunk_sim, and with a neighbor index in db the new
+#game is added to it without a rebuild
+# from coldStart import HybridScorer
+# scorer=HybridScorer(smallDf, db, featureMatrix, gameRows, reg=200., k=7)
+# scorer.addGame(newGameName, gameRows[newGameID], smallDf[smallDf.gameName==newGameName])
+# print 'predicted rating of', newGameName, 'for', testuser, scorer.predict(testuser, newGameName)
@@ -8,18 +8,93 @@ import re
 import pickle
 from collections import defaultdict
 import operator
+import threading
+import time
+import urlparse
+import json
+from StringIO import StringIO
+from xml.etree import cElementTree as ElementTree
+from multiprocessing.pool import ThreadPool
+from columnBuilder import ColumnBuilder
+from cachedSession import CachedSession
+from crawlManifest import CrawlManifest
 
 
 
 
 #Requests the pageNum page of reviews for the gameID game, returns the source as an xml
 #uses the BGG XML API2 http://boardgamegeek.com/wiki/page/BGG_XML_API2#
+#All requests go through one pooled session with an on-disk conditional-GET cache (see cachedSession.py),
+#so re-runs only download pages that changed.  session.stats() has the cache hit/miss counters.
+session=CachedSession('google_drive/http_cache/')
+
+#The base URL is kept at module level so it can be pointed at a local stand-in server (see mockGeekServer.py)
+XMLAPI2_URL='http://www.boardgamegeek.com/xmlapi2/thing'
+
 def requestReviewPage(gameID,pageNum):
-    url = 'http://www.boardgamegeek.com/xmlapi2/thing'  
     options = {'type':'boardgame','id':gameID,'ratingcomments':1,'pagesize':100,'page':pageNum }
-    xml = requests.get(url, params=options).text
+    xml = session.get(XMLAPI2_URL, params=options).text
     return xml
 
+#Spaces out the requests made to each host so no more than maxPerSecond of them start per second,
+#no matter how many threads are fetching.  BGG answers aggressive clients with 503s.
+class HostRateLimiter:
+    def __init__(self, maxPerSecond=4.):
+        self.interval=1./maxPerSecond if maxPerSecond else 0.
+        self.lock=threading.Lock()
+        self.nextSlot=defaultdict(float)
+
+    def wait(self, url):
+        host=urlparse.urlparse(url).netloc
+        with self.lock:
+            now=time.time()
+            slot=max(now,self.nextSlot[host])
+            self.nextSlot[host]=slot+self.interval
+        if slot>now:
+            time.sleep(slot-now)
+
+#Same request as requestReviewPage, but waits on the rate limiter first and retries with exponential backoff
+#when BGG is busy (202 means the request was queued, 429/5xx mean slow down) or the connection fails
+RETRY_STATUS_CODES=set([202,429,500,502,503,504])
+def requestReviewPageWithRetry(gameID,pageNum,rateLimiter=None,maxRetries=4,backoff=1.):
+    return getReviewPageResponse(gameID,pageNum,rateLimiter,maxRetries,backoff).text
+
+#the retrying request behind requestReviewPageWithRetry, returning the whole response (for its ETag).
+#Timeouts and other request failures are retried like connection errors; other error statuses raise
+def getReviewPageResponse(gameID,pageNum,rateLimiter=None,maxRetries=4,backoff=1.):
+    options = {'type':'boardgame','id':gameID,'ratingcomments':1,'pagesize':100,'page':pageNum }
+    for attempt in range(maxRetries+1):
+        if rateLimiter:
+            rateLimiter.wait(XMLAPI2_URL)
+        try:
+            response=session.get(XMLAPI2_URL, params=options)
+        except requests.RequestException as e:
+            error=e
+        else:
+            if response.status_code not in RETRY_STATUS_CODES:
+                response.raise_for_status()
+                return response
+            error='status %s' % response.status_code
+        if attempt<maxRetries:
+            time.sleep(backoff*2**attempt)
+    raise IOError('giving up on game %s page %s after %s retries: %s' % (gameID,pageNum,maxRetries,error))
+
+#Fetches the listed review pages for a game on a pool of numWorkers threads.
+#Returns a dictionary keyed by page number containing the page xml, and a dictionary of fetch statistics
+def fetchReviewPages(gameID,pageNums,numWorkers=8,rateLimiter=None,maxRetries=4,backoff=1.):
+    fetchPage=lambda pageNum: requestReviewPageWithRetry(gameID,pageNum,rateLimiter,maxRetries,backoff)
+    start=time.time()
+    pool=ThreadPool(numWorkers)
+    try:
+        xmls=pool.map(fetchPage,pageNums)
+    finally:
+        pool.close()
+        pool.join()
+    elapsed=time.time()-start
+    stats={'pages':len(pageNums),'seconds':elapsed,
+           'pagesPerSec':len(pageNums)/elapsed if elapsed>0 else float('inf')}
+    return dict(zip(pageNums,xmls)), stats
+
 #given a pattern.web object for a review page, returns the name of the game being reviewed
 def getGameNameFromDom(dom):
     gameNames=dom.by_tag("name")
@@ -37,17 +112,16 @@ def getGameNameFromDom(dom):
 #expansions for now, though, so I've written the functions to return none and check for that for now.        
 def getNumberOfReviewPagesForGame(gameID):
     xml=requestReviewPage(gameID,1)
-    dom = web.Element(xml)
     try:
-        numReviewsForGame=int(dom.by_tag('comments')[0].attributes['totalitems'])
+        numReviewsForGame=int(parseReviewPage(xml)[1])
         numReviewPages=int(np.ceil(numReviewsForGame/100.))
         return numReviewPages
     except:
         print "Error- can't get page count."
         return None
 
-#provided with a pattern.web object and the gameID, returns user and rating info for a reviews page
-def getRatingsFromReviewPage(dom,gameID):
+#provided with a pattern.web object and the gameID, returns a dictionary of user and rating info columns for a reviews page
+def getRatingColumnsFromReviewPage(dom,gameID):
     users=[]
     ratings=[]
     gameNames=[]
@@ -59,9 +133,105 @@ def getRatingsFromReviewPage(dom,gameID):
         gameNames.append(gameName)
         gameIDs.append(gameID)
     reviewDict={'user':users,'rating':ratings,'gameName':gameNames,'gameID':gameIDs}
-    df=pd.DataFrame(reviewDict)
+    return reviewDict
+
+#provided with a pattern.web object and the gameID, returns user and rating info for a reviews page
+def getRatingsFromReviewPage(dom,gameID):
+    df=pd.DataFrame(getRatingColumnsFromReviewPage(dom,gameID))
     return df
 
+#Review page parser backends.  Each takes the xml of an XML API2 comments page and returns
+#(gameName, totalItems, users, ratings), where totalItems is None if the page has no comment count.
+#'pattern' builds the full pattern.web DOM like the functions above.  'iterparse' pulls the same values
+#out of the cElementTree event stream without keeping a tree around, which is several times faster.
+#reviewPageParser picks the backend used by the scraping functions.
+def parseReviewPageDom(xml):
+    dom=web.Element(xml)
+    try:
+        totalItems=int(dom.by_tag('comments')[0].attributes['totalitems'])
+    except:
+        totalItems=None
+    users=[]
+    ratings=[]
+    for review in dom.by_tag('comment'):
+        ratings.append(review.attributes['rating'])
+        users.append(review.attributes['username'])
+    return getGameNameFromDom(dom),totalItems,users,ratings
+
+def parseReviewPageIterparse(xml):
+    if isinstance(xml,unicode):
+        xml=xml.encode('utf-8')
+    gameName=None
+    seenName=False
+    totalItems=None
+    users=[]
+    ratings=[]
+    for event,elem in ElementTree.iterparse(StringIO(xml),events=('start','end')):
+        if event=='end':
+            elem.clear()
+        elif elem.tag=='comment':
+            ratings.append(elem.get('rating'))
+            users.append(elem.get('username'))
+        elif elem.tag=='comments':
+            try:
+                totalItems=int(elem.get('totalitems'))
+            except (TypeError,ValueError):
+                totalItems=None
+        #like getGameNameFromDom, only the first name tag counts
+        elif elem.tag=='name' and not seenName:
+            seenName=True
+            if elem.get('type')=='primary':
+                gameName=elem.get('value')
+    return gameName,totalItems,users,ratings
+
+REVIEW_PAGE_PARSERS={'pattern':parseReviewPageDom,'iterparse':parseReviewPageIterparse}
+reviewPageParser='iterparse'
+
+def parseReviewPage(xml,parser=None):
+    return REVIEW_PAGE_PARSERS[parser or reviewPageParser](xml)
+
+#given the xml of a reviews page and the gameID, returns a dictionary of user and rating info columns,
+#the same as getRatingColumnsFromReviewPage does for the page's DOM
+def getRatingColumnsFromReviewXml(xml,gameID,parser=None):
+    gameName,totalItems,users,ratings=parseReviewPage(xml,parser)
+    return {'user':users,'rating':ratings,'gameName':[gameName]*len(users),'gameID':[gameID]*len(users)}
+
+#Times each parser backend over a list of saved review page xmls (see loadSavedReviewPages), checks that
+#they all return the same values, and prints pages/sec and the speedup over the pattern DOM
+def benchmarkReviewParsers(xmls,repeat=3):
+    results={}
+    outputs={}
+    for parser in sorted(REVIEW_PAGE_PARSERS):
+        parse=REVIEW_PAGE_PARSERS[parser]
+        best=None
+        for i in range(repeat):
+            start=time.time()
+            parsed=[parse(xml) for xml in xmls]
+            elapsed=time.time()-start
+            best=elapsed if best is None else min(best,elapsed)
+        outputs[parser]=parsed
+        results[parser]=len(xmls)/best if best>0 else float('inf')
+    identical=all(outputs[parser]==outputs['pattern'] for parser in outputs)
+    for parser in sorted(results):
+        print '%-10s %10.1f pages/sec  %5.2fx' % (parser,results[parser],results[parser]/results['pattern'])
+    print 'identical output:',identical
+    return results,identical
+
+#the XML API2 comment pages saved in the http cache, for benchmarkReviewParsers
+def loadSavedReviewPages(cacheDir='google_drive/http_cache/'):
+    xmls=[]
+    for filen in sorted(os.listdir(cacheDir)):
+        if filen.endswith('.json'):
+            with open(os.path.join(cacheDir,filen),'r') as fin:
+                meta=json.load(fin)
+            if meta['url'].endswith('/xmlapi2/thing'):
+                with open(os.path.join(cacheDir,filen[:-len('.json')]+'.body'),'rb') as fin:
+                    xmls.append(fin.read().decode(meta['encoding'] or 'utf-8'))
+    return xmls
+
+#the columns of a game's review frame, in the order pd.DataFrame puts the review dictionary keys
+REVIEW_COLUMNS=[('gameID',None),('gameName',None),('rating',None),('user',None)]
+
 #Requests the the pageNum page of reviews for the gameID game.
 #Creates a pattern.web object from the reviews page
 #gets all of the ratings and user info out of the dom object
@@ -74,24 +244,85 @@ def buildReviewDictFromPage(gameID, pageNum):
 
 #Assembles a pandas dataframe with columns: gameID, gameName,rating,user.  
 #Includes all reviews for a game
-def buildReviewDfForGame(gameID):
+#With numWorkers>1 the pages are fetched concurrently (see fetchReviewPages) and parsed in page order,
+#so the frame is the same as the serial one
+#Pages are collected in a ColumnBuilder and the frame is built once at the end
+def buildReviewDfForGame(gameID, numWorkers=1, rateLimiter=None):
     numReviewPages=getNumberOfReviewPagesForGame(gameID)  
     #numReviewPages=10
     if numReviewPages:
-        gameDf=buildReviewDictFromPage(gameID, pageNum=1)
-        for i in range(2,numReviewPages):
-            pageDf=buildReviewDictFromPage(gameID,i)
-            gameDf=pd.concat([gameDf,pageDf],ignore_index=True)
-            if i%10==0:
-                print i
-        return gameDf
+        builder=ColumnBuilder(REVIEW_COLUMNS)
+        #every page, the last one included, like crawlGameRatings
+        pageNums=range(1,numReviewPages+1)
+        if numWorkers>1:
+            xmls,stats=fetchReviewPages(gameID,pageNums,numWorkers,rateLimiter)
+            print 'fetched %(pages)s pages in %(seconds).1fs (%(pagesPerSec).1f pages/sec)' % stats
+            for pageNum in pageNums:
+                builder.appendColumns(getRatingColumnsFromReviewXml(xmls[pageNum],gameID))
+        else:
+            for i in pageNums:
+                builder.appendColumns(getRatingColumnsFromReviewXml(requestReviewPage(gameID,i),gameID))
+                if i%10==0:
+                    print i
+        return builder.toFrame()
     else:
         return None
 
+#Downloads all of the ratings for a gameID tuple (IDnumber, name) and saves them to the game's ratings csv,
+#keeping track of progress in a CrawlManifest (see crawlManifest.py).
+#Every fetched page is recorded in the manifest as soon as it is parsed, so if the crawl dies the next run
+#picks up at the first missing page.  Games that are complete and whose comment count hasn't changed on BGG
+#are skipped.  Pages are fetched batchSize at a time, on numWorkers threads if numWorkers>1.
+#If a RatingsStore is passed (see ratingsStore.py) the finished game is appended to it too.
+#Returns the path of the saved csv, or None if the game was skipped or isn't a full game
+def crawlGameRatings(game, manifest, numWorkers=1, rateLimiter=None, outDir='google_drive/gameRatings/', batchSize=20, store=None):
+    gameID,name=game
+    firstPage=getReviewPageResponse(gameID,1,rateLimiter)
+    gameName,totalItems,users,ratings=parseReviewPage(firstPage.text)
+    if not manifest.needsRefresh(gameID,totalItems):
+        return None
+    if totalItems is None:
+        print 'This is not a full game, or some other error has occurred.'
+        manifest.markNotAGame(gameID,name)
+        return None
+
+    numReviewPages=int(np.ceil(totalItems/100.))
+    done=manifest.startGame(gameID,name,gameName,totalItems,numReviewPages)
+    if 1 not in done:
+        manifest.savePage(gameID,1,users,ratings,firstPage.headers.get('ETag'))
+    todo=[pageNum for pageNum in range(2,numReviewPages+1) if pageNum not in done]
+    if done:
+        print 'resuming %s at page %s, %s pages to go' % (name,min(todo) if todo else numReviewPages,len(todo))
+
+    fetchPage=lambda pageNum: getReviewPageResponse(gameID,pageNum,rateLimiter)
+    pool=ThreadPool(numWorkers) if numWorkers>1 else None
+    try:
+        for start in range(0,len(todo),batchSize):
+            batch=todo[start:start+batchSize]
+            responses=pool.map(fetchPage,batch) if pool else map(fetchPage,batch)
+            for pageNum,response in zip(batch,responses):
+                pageName,pageTotal,pageUsers,pageRatings=parseReviewPage(response.text)
+                manifest.savePage(gameID,pageNum,pageUsers,pageRatings,response.headers.get('ETag'))
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    users,ratings=manifest.gameRatings(gameID)
+    builder=ColumnBuilder(REVIEW_COLUMNS)
+    builder.appendColumns({'user':users,'rating':ratings,'gameName':[gameName]*len(users),'gameID':[gameID]*len(users)})
+    filePath=os.path.join(outDir,'gamereviews_id_%s_%s.csv' % (gameID,name))
+    gameDf=builder.toFrame()
+    gameDf.to_csv(filePath,index_label=False, encoding='utf8')
+    if store:
+        store.appendFrame(gameDf)
+    manifest.completeGame(gameID,filePath)
+    return filePath
+
 #get list of top 100 boardgames by rating and their ID numbers
 def getListOfTop100Games():
     url='http://boardgamegeek.com/browse/boardgame'
-    page = requests.get(url).text
+    page = session.get(url).text
     dom=web.Element(page)
     items=dom.by_class('collection_thumbnail')
     names=[]
@@ -127,7 +358,7 @@ def getTop100GameRatings(top100_IDs):
 #page and not yet downloaded
 def getGamesToAddFromPage(pageNum, alreadyDownloadedIds):
     url="http://www.boardgamegeek.com/browse/boardgame/page/%s?sort=numvoters&sortdir=desc" % pageNum
-    page = requests.get(url).text
+    page = session.get(url).text
     dom=web.Element(page)
     items=dom.by_class('collection_thumbnail')
     names=[]
@@ -144,12 +375,15 @@ def getGamesToAddFromPage(pageNum, alreadyDownloadedIds):
     return gamesToAdd
 
 #provided with a gameID tuple (IDnumber, name), scrape the BGG site for the game site and save HTML to file
-def scrapeGamePages(gameID):
+#if a CrawlManifest is passed the saved page is recorded in it
+def scrapeGamePages(gameID, manifest=None):
     url='http://boardgamegeek.com/boardgame/%s/%s' % (gameID[0],gameID[1])
-    page = requests.get(url).text
+    page = session.get(url).text
     filepath='google_drive/game_pages/%s_%s.txt' % (gameID[0],gameID[1])
     with open(filepath, 'w') as fout:
         fout.write(page.encode("utf-8"))
+    if manifest:
+        manifest.markGamePageSaved(gameID[0],gameID[1],filepath)
 
 #provided with a gameID tuple (IDnumber, name), check whether the game site is saved already and return the page DOM 
 def getSavedGameSite(gameID):
@@ -162,7 +396,10 @@ def getSavedGameSite(gameID):
         return None
 
 #Looks in the gameRatings directory and returns a list of gameID tuples (IDnumber,name) for which there are ratings files
-def getListOfGameRatingsAlreadyScraped():
+#if a CrawlManifest is passed the list comes from it instead of the directory listing
+def getListOfGameRatingsAlreadyScraped(manifest=None):
+    if manifest:
+        return manifest.gamesScraped()
     dirname='google_drive/gameRatings/'
     fileList=os.listdir(dirname)
     fileList=[filen.replace('.','_') for filen in fileList]
@@ -170,7 +407,9 @@ def getListOfGameRatingsAlreadyScraped():
     return scrapedGames
 
 #Looks in the gameRatings directory and returns a list of gameID tuples (IDnumber,name) for which there are ratings files
-def getListOfIdsGamePagesAlreadySaved():
+def getListOfIdsGamePagesAlreadySaved(manifest=None):
+    if manifest:
+        return manifest.gamePagesSaved()
     dirname='google_drive/game_pages/'
     fileList=os.listdir(dirname)
     scrapedGames=[filen.split('_')[0] for filen in fileList]
@@ -192,18 +431,43 @@ def buildDictOfAllGameFeatures(alreadyScrapedGames,gameFeaturesDict, featuresInc
 
 
 
+#the feature types getFeaturesFromPageSource pulls out of a game page
+GAME_FEATURE_TYPES=['boardgamemechanic','boardgamepublisher',
+                    'boardgamedesigner','boardgamesubdomain',
+                    'boardgamecategory','bestNumPlayers',#'allowedNumPlayers',
+                    'playTime']
+#the feature types the game feature table is built from (gamePredictions.py uses the same list)
+featuresToInclude=['boardgamecategory','boardgamesubdomain','boardgamepublisher','boardgamemechanic','playTime','bestNumPlayers']
+
 #Takes a GameID, pulls up a downloaded HTML, and strips out features from the text
 #returns a dictionary keyed on feature type containing the feature values
-def getFeaturesFromSavedGamePage(gameID):
-    #opens the saved HTML page and pulls out the infoTable with the data we care about
-    fin=open('google_drive/game_pages/%s_%s.txt'% (gameID[0],gameID[1]), 'r')
-    dom=web.Element(fin.read())
+def getFeaturesFromSavedGamePage(gameID, verbose=True):
+    #opens the saved HTML page
+    with open('google_drive/game_pages/%s_%s.txt'% (gameID[0],gameID[1]), 'r') as fin:
+        return getFeaturesFromPageSource(fin.read(),gameID,verbose)
+
+#Strips the features out of the source of a game page, see getFeaturesFromSavedGamePage.
+#With verbose=False nothing is printed, for running over many pages at once (see featureCache.py)
+def getFeaturesFromPageSource(source, gameID, verbose=True):
+    return parseGamePage(source,gameID,verbose)[0]
+
+#the url of the game's thumbnail image, from the link in the nested mt5 divs of its page (None if it has none)
+def getThumbnailUrlFromDom(dom):
+    for item in dom.by_tag('div.mt5'):
+        for subItem in item('link'):
+            imgLink=subItem.attributes.get('href','')
+            if imgLink:
+                return imgLink
+    return None
+
+#Parses the source of a game page once for both its features and its thumbnail url.
+#Returns (featuresDict, thumbnailUrl)
+def parseGamePage(source, gameID, verbose=True):
+    #pull out the infoTable with the data we care about
+    dom=web.Element(source)
     infoTable=dom.by_tag('.geekitem_infotable')[0]
 
-    featuresDict={'boardgamemechanic':set(),'boardgamepublisher':set(),
-                    'boardgamedesigner':set(),'boardgamesubdomain':set(),
-                    'boardgamecategory':set(),'bestNumPlayers':set(),#'allowedNumPlayers':set(),
-                    'playTime':set()}
+    featuresDict=dict((featureType,set()) for featureType in GAME_FEATURE_TYPES)
     #Several of the features (mechanic, publisher, designer, subdomain, category) are coded in <a> tags with the info in the links
     #Pull all of this data out                
     for link in infoTable('a'):
@@ -233,9 +497,10 @@ def getFeaturesFromSavedGamePage(gameID):
             bestNumPlayers=hit.group(1)
             labelString='bestNumPlayers'+str(bestNumPlayers)
             featuresDict['bestNumPlayers'].add((labelString,bestNumPlayers))
-            print featuresDict['bestNumPlayers']
+            if verbose:
+                print featuresDict['bestNumPlayers']
             break
-    if not bestNumPlayers:
+    if not bestNumPlayers and verbose:
         print gameID, '\nunable to find best number of players'
             
     #get the playing time for the game
@@ -246,16 +511,18 @@ def getFeaturesFromSavedGamePage(gameID):
         time=time.strip()
         labelString='time'+str(time)
         featuresDict['playTime'].add((labelString,time))
-        print featuresDict['playTime']
-    if not time:
+        if verbose:
+            print featuresDict['playTime']
+    if not time and verbose:
         print gameID, '\nunable to find best playingTime'    
         
-    return featuresDict
+    return featuresDict,getThumbnailUrlFromDom(dom)
 
 
 ## Build a dataframe containing 0s and 1s, rows are games, columns are game feature tags
-# such as card game or Steve Jackson
-def buildGameFeaturesDf(featureVector,gameRatingsAlreadyScraped, gameFeaturesDict):
+# such as card game or Steve Jackson, for the feature types in featuresIncluded (featuresToInclude by default)
+# buildGameFeatureMatrix in featureMatrix.py builds the same table as a sparse matrix, much faster
+def buildGameFeaturesDf(featureVector,gameRatingsAlreadyScraped, gameFeaturesDict, featuresIncluded=None):
     getNameFromIDTuple=operator.itemgetter(1)
     getIDFromTuple=operator.itemgetter(0)
     indices=map(getIDFromTuple,gameRatingsAlreadyScraped)
@@ -264,34 +531,28 @@ def buildGameFeaturesDf(featureVector,gameRatingsAlreadyScraped, gameFeaturesDic
 
     for gameID in gameRatingsAlreadyScraped:
         gameFeatures=gameFeaturesDict[gameID]
-        for featureType in featuresToInclude:
+        for featureType in featuresIncluded or featuresToInclude:
             for feature in gameFeatures[featureType]:
                 f=str(getNameFromIDTuple(feature))
 
-                fDf.loc[gameID[0]][f]=1
+                fDf.loc[gameID[0],f]=1
     return fDf
 
 
-#Given a list of games in our dataset, ask if I've already got the thumbnail for it,
-#If not, open the text file with the saved HTML from the game profile page and extract the thumburl
-#then download that thumbnail URL using the pattern.web module
-def downloadThumbnailsForGames(alreadyScrapedGames):
-    downloadedImages=os.listdir('google_drive/game_thumbnails/')
-    for game in alreadyScrapedGames:
-        gameString=game[0]+"_"+game[1]+'.jpg'
-        if gameString not in downloadedImages:
-            print 'downloading thumbnail for',game
-            #open the saved html and pull the imgLink out of the nested divs
-            with open('google_drive/game_pages/%s_%s.txt'% (game[0],game[1]), 'r') as fin:
-                dom=web.Element(fin.read())
-                for item in dom.by_tag('div.mt5'):
-                    for subItem in item('link'):
-                        imgLink=subItem.attributes.get('href','')
-                        #download the file as the variable im, and then specify the output path and save
-                        im=web.URL(imgLink).download(user_agent='Mozilla/5.0')
-                        imageFilePath='google_drive/game_thumbnails/%s_%s.jpg' %(game[0],game[1])
-                        with open(imageFilePath,'w') as fout:
-                            fout.write(im)
+#Downloads the thumbnails of the listed games that haven't been downloaded yet (see thumbnails.py): the image
+#urls come from the feature cache (the pages are only parsed if they changed), the images are fetched on
+#numWorkers threads through the shared session, and progress is recorded in the crawl manifest
+def downloadThumbnailsForGames(alreadyScrapedGames, numWorkers=8, rateLimiter=None):
+    from featureCache import FeatureCache, extractGameFeatures
+    from thumbnails import downloadThumbnails
+    cache=FeatureCache()
+    manifest=CrawlManifest()
+    try:
+        extractGameFeatures(alreadyScrapedGames,cache)
+        return downloadThumbnails(alreadyScrapedGames,cache,manifest,numWorkers=numWorkers,rateLimiter=rateLimiter)
+    finally:
+        cache.close()
+        manifest.close()
 
 
 
@@ -319,26 +580,51 @@ def downloadThumbnailsForGames(alreadyScrapedGames):
 #             print 'Error, not a game?'
 
 
-#Get the list of all of the games I have ratings for, and go to their pages to download the HTML to strip out metadata
-gameRatingsAlreadyScraped=getListOfGameRatingsAlreadyScraped()
-
-#Download the thumbnail images for games in our data set that have not yet been downloaded
-downloadThumbnailsForGames(gameRatingsAlreadyScraped)
-
-#Get game metadata (features tages) from downloaded games
-savedPages=getListOfIdsGamePagesAlreadySaved()
-for game in gameRatingsAlreadyScraped:
-    if game[0] not in savedPages:
-        print 'downloading HTML for: ', game
-        scrapeGamePages(game)
-
-
-
-
-
-
-
-
-
-
-
+#Resumable crawl of the 1000 games with the most ratings, tracked in the crawl manifest.  The first run
+#imports what is already in the output folders
+# manifest=CrawlManifest()
+# manifest.importExistingFiles()
+# for pageNum in range(1,11):
+#     for game in getGamesToAddFromPage(pageNum,[]):
+#         print '\nDownloading data for %s, gameID: %s' % (game[1], game[0])
+#         crawlGameRatings(game, manifest, numWorkers=8, rateLimiter=HostRateLimiter(4.))
+
+#Compare the review page parser backends on the pages saved in the http cache
+# benchmarkReviewParsers(loadSavedReviewPages())
+
+#Fetch the review pages of a game on 8 threads, at most 4 requests/sec to BGG
+# gameDf=buildReviewDfForGame('68448', numWorkers=8, rateLimiter=HostRateLimiter(4.))
+
+#The concurrent path can be checked against the serial one with the local stand-in server
+# from mockGeekServer import MockGeekServer
+# server=MockGeekServer()
+# server.addGame('1234','Test Game',numComments=950)
+# XMLAPI2_URL=server.start()+'/xmlapi2/thing'
+# serialDf=buildReviewDfForGame('1234')
+# server.failEvery=7
+# concurrentDf=buildReviewDfForGame('1234', numWorkers=8)
+# print 'same frame:', (serialDf.values==concurrentDf.values).all()
+# server.failEvery=None
+# session.resetStats()
+# rerunDf=buildReviewDfForGame('1234')
+# print 'cache on re-run:', session.stats()
+# server.stop()
+
+#Compare the thumbnail pool with the old one-at-a-time downloads against the local stand-in server
+# from thumbnails import benchmarkThumbnails
+# benchmarkThumbnails(numGames=100, latency=0.2, numWorkers=8)
+
+#The scraping below only runs when this file is run as a script, so the functions above can be imported
+if __name__ == '__main__':
+    #Get the list of all of the games I have ratings for, and go to their pages to download the HTML to strip out metadata
+    gameRatingsAlreadyScraped=getListOfGameRatingsAlreadyScraped()
+
+    #Download the thumbnail images for games in our data set that have not yet been downloaded
+    downloadThumbnailsForGames(gameRatingsAlreadyScraped)
+
+    #Get game metadata (features tages) from downloaded games
+    savedPages=getListOfIdsGamePagesAlreadySaved()
+    for game in gameRatingsAlreadyScraped:
+        if game[0] not in savedPages:
+            print 'downloading HTML for: ', game
+            scrapeGamePages(game)
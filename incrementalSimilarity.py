@@ -0,0 +1,152 @@
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from collections import defaultdict
+from similarityEngine import pearsonFromSums, populateSimilarityArrays
+
+
+#Keeps game-pair similarities up to date as ratings come in, instead of rebuilding the Database or rerunning
+#computeSimMrjob from scratch.
+#For every pair of games (a, b) it keeps the pearson sufficient statistics over the users who rated both,
+#on user-mean-centered ratings x (the diffs pearson_sim correlates):
+#    n[a,b]   number of common users
+#    sxy[a,b] sum of x_a*x_b
+#    sx[a,b]  sum of x_a            (the sum of x_b is sx[b,a])
+#    sxx[a,b] sum of x_a^2          (the sum of x_b^2 is sxx[b,a])
+#A new rating moves its user's average, which shifts every centered rating of that user, so a batch of
+#ratings is applied by subtracting the affected users' contributions to the statistics, updating their
+#ratings and averages, and adding their contributions back.  Only the pairs of games those users rated are
+#touched, and only their similarities are recomputed.
+#It has gameNames, database_sim, database_sup and get like Database, so knearest and ratingPredictor can use
+#it as the dbase.  The arrays grow (by doubling) as new games arrive; rows past the last game are unused.
+
+class IncrementalSimilarity:
+    def __init__(self, df=None, capacity=64):
+        self.gameNames={}
+        self.userRatings=defaultdict(dict)
+        self.capacity=0
+        self._allocate(capacity)
+        if df is not None:
+            self.applyFrame(df)
+
+    def _allocate(self, capacity):
+        old=self.capacity
+        arrays={}
+        for name,dtype in (('n',np.float64),('sxy',np.float64),('sx',np.float64),('sxx',np.float64),
+                           ('database_sim',np.float64),('database_sup',np.int64)):
+            array=np.zeros((capacity,capacity),dtype=dtype)
+            if old:
+                array[:old,:old]=getattr(self,name)
+            arrays[name]=array
+        counts=np.zeros(capacity,dtype=np.int64)
+        if old:
+            counts[:old]=self.rowCounts
+        self.__dict__.update(arrays)
+        self.rowCounts=counts
+        self.capacity=capacity
+
+    def _addGame(self, gameName):
+        if gameName not in self.gameNames:
+            if len(self.gameNames)==self.capacity:
+                self._allocate(max(1,self.capacity*2))
+            i=len(self.gameNames)
+            self.gameNames[gameName]=i
+            self.database_sim[i,i]=1.
+        return self.gameNames[gameName]
+
+    #the pair statistics contributed by a set of users, as dense arrays over the game indices in games
+    def _contribution(self, users, games):
+        local=dict((g,i) for i,g in enumerate(games))
+        rows=[]
+        cols=[]
+        diffs=[]
+        for row,user in enumerate(users):
+            ratings=self.userRatings[user]
+            if not ratings:
+                continue
+            mean=np.mean(ratings.values())
+            for g,rating in ratings.items():
+                rows.append(row)
+                cols.append(local[g])
+                diffs.append(rating-mean)
+        shape=(len(users),len(games))
+        X=sp.csr_matrix((diffs,(rows,cols)),shape=shape)
+        B=sp.csr_matrix((np.ones(len(diffs)),(rows,cols)),shape=shape)
+        X2=X.multiply(X)
+        XT=X.T.tocsr()
+        return {'n':(B.T*B).toarray(),'sxy':(XT*X).toarray(),'sx':(XT*B).toarray(),'sxx':(X2.T*B).toarray()}
+
+    #Applies a batch of (user, gameName, rating) ratings.  A user's repeat rating of a game is ignored like in
+    #buildDfFromScrapedCsvs, unless replace is True.  Returns the names of the games whose similarities changed
+    def applyRatings(self, ratings, replace=False):
+        byUser=defaultdict(list)
+        for user,gameName,rating in ratings:
+            byUser[user].append((self._addGame(gameName),float(rating)))
+        users=list(byUser)
+        games=set()
+        for user in users:
+            games.update(self.userRatings[user])
+            games.update(g for g,rating in byUser[user])
+        games=np.array(sorted(games),dtype=np.int64)
+        block=np.ix_(games,games)
+
+        old=self._contribution(users,games)
+        for user in users:
+            ratings=self.userRatings[user]
+            for g,rating in byUser[user]:
+                if g not in ratings:
+                    self.rowCounts[g]+=1
+                    ratings[g]=rating
+                elif replace:
+                    ratings[g]=rating
+        new=self._contribution(users,games)
+        for name in ('n','sxy','sx','sxx'):
+            getattr(self,name)[block]+=new[name]-old[name]
+
+        n=np.round(self.n[block])
+        sx=self.sx[block]
+        sxx=self.sxx[block]
+        sim=pearsonFromSums(n,self.sxy[block],sx,sx.T,sxx,sxx.T)
+        sim[np.diag_indices_from(sim)]=1.
+        self.database_sim[block]=sim
+        sup=n.astype(np.int64)
+        sup[np.diag_indices_from(sup)]=self.rowCounts[games]
+        self.database_sup[block]=sup
+        names=self.gameNameList()
+        return [names[g] for g in games]
+
+    #applies the ratings in a frame with user, gameName and rating columns, like a newly scraped game's reviews
+    def applyFrame(self, df, replace=False):
+        return self.applyRatings(zip(df.user.values,df.gameName.values,df.rating.values.astype(np.float64)),replace)
+
+    def gameNameList(self):
+        names=[None]*len(self.gameNames)
+        for name,i in self.gameNames.items():
+            names[i]=name
+        return names
+
+    def get(self, g1, g2):
+        sim=self.database_sim[self.gameNames[g1]][self.gameNames[g2]]
+        nsup=self.database_sup[self.gameNames[g1]][self.gameNames[g2]]
+        return (sim, nsup)
+
+    #the current ratings as a frame with user, gameName, rating and user_avg columns
+    def ratingsFrame(self):
+        names=self.gameNameList()
+        rows=[(user,names[g],rating) for user,ratings in self.userRatings.items() for g,rating in ratings.items()]
+        df=pd.DataFrame(rows,columns=['user','gameName','rating'])
+        df['user_avg']=df.groupby('user')['rating'].transform(np.mean)
+        return df
+
+    #Rebuilds the similarity and support arrays from scratch with the similarity engine and compares them to
+    #the incrementally updated ones.  Returns (largest similarity difference, whether the supports are equal)
+    def checkAgainstRebuild(self):
+        numGames=len(self.gameNames)
+        sim=np.zeros((numGames,numGames))
+        sup=np.zeros((numGames,numGames),dtype=np.int64)
+        populateSimilarityArrays(self.ratingsFrame(),self.gameNames,sim,sup)
+        maxDiff=np.max(np.abs(sim-self.database_sim[:numGames,:numGames])) if numGames else 0.
+        sameSupport=np.array_equal(sup,self.database_sup[:numGames,:numGames])
+        print 'max similarity difference from a full rebuild: %g, supports equal: %s' % (maxDiff,sameSupport)
+        return maxDiff,sameSupport
@@ -0,0 +1,158 @@
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import time
+from ratingsIndex import RatingsIndex
+from syntheticRatings import syntheticRatingsFrame
+
+
+#A latent factor model as an alternative engine to item-kNN (knearest plus ratingPredictor), which needs the
+#O(G^2) similarity build.  Ratings are centered on the same baseline calcBase uses (global mean plus the user's
+#and the game's offsets from it), and the residuals are factorized as P Q' with alternating least squares:
+#holding the game factors Q fixed, every user's factors are the ridge regression solution
+#    p_u = (Q_u'Q_u + reg*n_u*I)^-1 Q_u'r_u
+#over the n_u games the user rated (and the same the other way around for the game factors).  The normal
+#equations of a block of users are built with sparse matrix products and solved as one stacked np.linalg.solve,
+#blockRows users at a time to bound memory.
+#A prediction is the baseline plus p_u.q_g, and scoring every game for a user is one vector-matrix product, so
+#predict and topRecos don't need any similarity data.
+
+class FactorModel:
+    #df is a ratings frame like smallDf (user, gameName and rating columns).  Repeat ratings of a game by a user
+    #keep the first, like buildRatingMatrices
+    def __init__(self, df, numFactors=20, reg=0.1, numIters=10, seed=0, blockRows=5000):
+        self.rindex=RatingsIndex(df)
+        self.numFactors=numFactors
+        self.reg=reg
+        self.blockRows=blockRows
+        rindex=self.rindex
+        #the same codes RatingsIndex numbers users with
+        userCodes=pd.factorize(df.user.values)[0]
+        gameCodes=rindex.rowGameCodes
+        first=~df.duplicated(['user','gameName']).values
+        residuals=rindex.ratings-(rindex.userMeans[userCodes]+rindex.gameMeans[gameCodes]-rindex.globalMean)
+        shape=(len(rindex.users),len(rindex.games))
+        self.R=sp.csr_matrix((residuals[first],(userCodes[first],gameCodes[first])),shape=shape)
+        RT=self.R.T.tocsr()
+        rand=np.random.RandomState(seed)
+        self.P=np.zeros((shape[0],numFactors))
+        self.Q=rand.normal(0.,0.1,(shape[1],numFactors))
+        for iteration in range(numIters):
+            self.P=self._solveFactors(self.R,self.Q)
+            self.Q=self._solveFactors(RT,self.P)
+
+    #the least squares factors of every row of R (csr) given the fixed factors Y of its columns.  The normal
+    #equations' matrices are the rating indicators times every column's flattened y y' outer product, a sparse
+    #times dense product, blockRows rows at a time
+    def _solveFactors(self, R, Y):
+        f=self.numFactors
+        X=np.zeros((R.shape[0],f))
+        counts=np.diff(R.indptr)
+        indicators=sp.csr_matrix((np.ones(len(R.data)),R.indices,R.indptr),shape=R.shape)
+        outer=(Y[:,:,None]*Y[:,None,:]).reshape(len(Y),f*f)
+        identity=np.eye(f)
+        for start in range(0,R.shape[0],self.blockRows):
+            rows=np.arange(start,min(start+self.blockRows,R.shape[0]))
+            rows=rows[counts[rows]>0]
+            if len(rows)==0:
+                continue
+            A=(indicators[rows]*outer).reshape(len(rows),f,f)+self.reg*counts[rows][:,None,None]*identity
+            b=R[rows]*Y
+            X[rows]=np.linalg.solve(A,b[:,:,None])[:,:,0]
+        return X
+
+    #the user's baseline offset and factors, zero for an unknown user
+    def _user(self, user):
+        u=self.rindex.userCodes.get(user)
+        if u is None:
+            return 0.,np.zeros(self.numFactors)
+        return self.rindex.userMeans[u]-self.rindex.globalMean,self.P[u]
+
+    #the predicted rating of every game for the user, in the order of rindex.games: one vector-matrix product
+    def userScores(self, user):
+        offset,p=self._user(user)
+        return self.rindex.gameMeans+offset+self.Q.dot(p)
+
+    #like ratingPredictor(df,dbase,gameName,user)
+    def predict(self, gameName, user):
+        offset,p=self._user(user)
+        g=self.rindex.gameCodes[gameName]
+        return self.rindex.gameMeans[g]+offset+self.Q[g].dot(p)
+
+    #like predictBatch: the predictions for the pairs (users[i], gameNames[i])
+    def predictMany(self, users, gameNames):
+        games=np.array([self.rindex.gameCodes[name] for name in gameNames],dtype=np.int64)
+        offsets=np.empty(len(games))
+        factors=np.empty((len(games),self.numFactors))
+        for i,user in enumerate(users):
+            offsets[i],factors[i]=self._user(user)
+        return self.rindex.gameMeans[games]+offsets+np.einsum('ij,ij->i',self.Q[games],factors)
+
+    #like get_top_recos_for_user: [(gameName, predicted rating), ...] for the n best games the user hasn't rated
+    def topRecos(self, user, n=10):
+        scores=self.userScores(user)
+        scores[np.unique(self.rindex.rowGameCodes[self.rindex.userRows(user)])]=-np.inf
+        top=np.argsort(-scores,kind='mergesort')[:n]
+        return [(self.rindex.games[g],scores[g]) for g in top if np.isfinite(scores[g])]
+
+    def nbytes(self):
+        return self.P.nbytes+self.Q.nbytes
+
+
+#Compares the factor model with the item-kNN engine (dense Database plus RatingsIndex) on a synthetic frame with
+#a holdout of testFraction of the ratings: training time, model memory, rmse and per-query latency of a
+#prediction and of a user's top recommendations
+def benchmarkFactorModel(numUsers=20000, numGames=1000, ratingsPerUser=25, numFactors=20, numIters=10,
+                         testFraction=0.1, numQueries=200):
+    from buildPandasDF import Database, recompute_frame, ratingPredictor, get_top_recos_for_user
+    from batchPredictor import predictBatch
+    import sys, StringIO
+    df=syntheticRatingsFrame(numUsers=numUsers,numGames=numGames,ratingsPerUser=ratingsPerUser)
+    test=np.random.RandomState(0).rand(len(df))<testFraction
+    trainDf=recompute_frame(df[~test])
+    testDf=df[test]
+    start=time.time()
+    db=Database(trainDf)
+    db.populate_by_vectorizing(blockSize=500)
+    rindex=RatingsIndex(trainDf)
+    knnTrain=time.time()-start
+    start=time.time()
+    model=FactorModel(trainDf,numFactors=numFactors,numIters=numIters)
+    mfTrain=time.time()-start
+    known=np.array([user in rindex.userCodes and game in db.gameNames for user,game in zip(testDf.user.values,testDf.gameName.values)])
+    testDf=testDf[known]
+    actual=testDf.rating.values
+    knnRmse=np.sqrt(np.mean((predictBatch(testDf.user.values,testDf.gameName.values,db,rindex)-actual)**2))
+    mfRmse=np.sqrt(np.mean((model.predictMany(testDf.user.values,testDf.gameName.values)-actual)**2))
+    users=testDf.user.values[:numQueries]
+    games=testDf.gameName.values[:numQueries]
+    stdout,sys.stdout=sys.stdout,StringIO.StringIO()
+    try:
+        start=time.time()
+        for user,game in zip(users,games):
+            ratingPredictor(trainDf,db,game,user,rindex=rindex)
+        knnPredict=(time.time()-start)/len(users)
+        start=time.time()
+        for user in users:
+            get_top_recos_for_user(user,trainDf,db,rindex=rindex)
+        knnRecos=(time.time()-start)/len(users)
+    finally:
+        sys.stdout=stdout
+    start=time.time()
+    for user,game in zip(users,games):
+        model.predict(game,user)
+    mfPredict=(time.time()-start)/len(users)
+    start=time.time()
+    for user in users:
+        model.topRecos(user)
+    mfRecos=(time.time()-start)/len(users)
+    knnBytes=db.database_sim.nbytes+db.database_sup.nbytes
+    print '%s users, %s games, %s train ratings, %s test ratings' % (numUsers,numGames,len(trainDf),len(actual))
+    print 'engine  | train   | model MB | test rmse | predict ms | top recos ms'
+    print 'kNN     | %6.1fs | %8.1f | %9.4f | %10.3f | %12.3f' % (knnTrain,knnBytes/1e6,knnRmse,knnPredict*1000,knnRecos*1000)
+    print 'factors | %6.1fs | %8.1f | %9.4f | %10.3f | %12.3f' % (mfTrain,model.nbytes()/1e6,mfRmse,mfPredict*1000,mfRecos*1000)
+    return model
+
+if __name__ == '__main__':
+    benchmarkFactorModel()
@@ -0,0 +1,120 @@
+
+import BaseHTTPServer
+import SocketServer
+import threading
+import hashlib
+import random
+import time
+import urlparse
+from xml.sax.saxutils import quoteattr
+from email.utils import formatdate
+
+
+#A local stand-in for boardgamegeek.com, used to try the scraper out without hitting BGG.
+#It serves canned XML API2 review pages for the games added with addGame, and any other canned
+#response (HTML pages, thumbnails) added with addFile.  Every failEvery-th request gets a 503 so
+#the retry/backoff code gets exercised, and latency adds a delay to every response.
+#Successful responses carry an ETag and Last-Modified header and conditional GETs for unchanged
+#content get a 304, so the cache in cachedSession.py can be tried out too.
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads=True
+
+
+class _MockGeekHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        mock=self.server.mock
+        status,body,contentType=mock.respond(self.path)
+        etag='"%s"' % hashlib.sha1(body).hexdigest()[:16]
+        if status==200 and self.headers.get('If-None-Match')==etag:
+            mock.countNotModified()
+            self.send_response(304)
+            self.send_header('ETag',etag)
+            self.end_headers()
+            return
+        self.send_response(status)
+        self.send_header('Content-Type',contentType)
+        self.send_header('Content-Length',str(len(body)))
+        if status==200:
+            self.send_header('ETag',etag)
+            self.send_header('Last-Modified',mock.lastModified)
+        self.end_headers()
+        self.wfile.write(body)
+
+    #keep the console quiet
+    def log_message(self, format, *args):
+        pass
+
+
+class MockGeekServer:
+    def __init__(self, failEvery=None, latency=0.):
+        self.failEvery=failEvery
+        self.latency=latency
+        self.games={}
+        self.files={}
+        self.requestCount=0
+        self.notModifiedCount=0
+        self.lastModified=formatdate(time.time(),usegmt=True)
+        self.lock=threading.Lock()
+        self.httpd=None
+
+    #registers a game with numComments synthetic ratings, or with the given list of (username, rating) tuples
+    def addGame(self, gameID, gameName, numComments=250, comments=None):
+        if comments is None:
+            rand=random.Random(gameID)
+            comments=[('user%s' % i, str(rand.randint(1,20)/2.)) for i in range(numComments)]
+        self.games[str(gameID)]=(gameName,comments)
+
+    def addFile(self, path, body, contentType='text/html'):
+        self.files[path]=(body,contentType)
+
+    #the XML API2 'thing' page with ratingcomments for one page of a game's comments
+    def reviewPageXml(self, gameID, pageNum, pageSize=100):
+        gameName,comments=self.games[gameID]
+        pageComments=comments[(pageNum-1)*pageSize:pageNum*pageSize]
+        commentTags=''.join(['<comment username=%s rating=%s value="" />' % (quoteattr(user),quoteattr(rating))
+                             for user,rating in pageComments])
+        xml=('<?xml version="1.0" encoding="utf-8"?><items termsofuse="http://boardgamegeek.com/xmlapi/termsofuse">'
+             '<item type="boardgame" id="%s"><name type="primary" sortindex="1" value=%s />'
+             '<comments page="%s" totalitems="%s">%s</comments></item></items>')
+        return xml % (gameID,quoteattr(gameName),pageNum,len(comments),commentTags)
+
+    def countNotModified(self):
+        with self.lock:
+            self.notModifiedCount+=1
+
+    #returns (status, body, content type) for a request path
+    def respond(self, path):
+        with self.lock:
+            self.requestCount+=1
+            count=self.requestCount
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failEvery and count%self.failEvery==0:
+            return 503,'Rate limit exceeded','text/plain'
+        url=urlparse.urlparse(path)
+        if url.path=='/xmlapi2/thing':
+            query=urlparse.parse_qs(url.query)
+            gameID=query.get('id',[''])[0]
+            if gameID not in self.games:
+                return 200,'<?xml version="1.0" encoding="utf-8"?><items></items>','text/xml; charset=utf-8'
+            pageNum=int(query.get('page',['1'])[0])
+            pageSize=int(query.get('pagesize',['100'])[0])
+            return 200,self.reviewPageXml(gameID,pageNum,pageSize).encode('utf-8'),'text/xml; charset=utf-8'
+        if url.path in self.files:
+            body,contentType=self.files[url.path]
+            return 200,body,contentType
+        return 404,'Not found','text/plain'
+
+    #starts serving on a free localhost port in a background thread and returns the base url
+    def start(self):
+        self.httpd=_ThreadingHTTPServer(('127.0.0.1',0),_MockGeekHandler)
+        self.httpd.mock=self
+        thread=threading.Thread(target=self.httpd.serve_forever)
+        thread.daemon=True
+        thread.start()
+        return 'http://127.0.0.1:%s' % self.httpd.server_address[1]
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
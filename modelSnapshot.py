@@ -0,0 +1,170 @@
+
+import numpy as np
+import json
+import os
+import shutil
+import time
+import pickle
+import multiprocessing
+from neighborIndex import NeighborIndex
+from ratingsIndex import RatingsIndex
+from syntheticRatings import syntheticRatingsFrame
+
+
+#An on-disk snapshot of a populated Database that opens in milliseconds, replacing pickling the whole Database
+#(df included) to gameDbPickle.  A snapshot is a directory holding:
+#    header.json      format name and version, the kind of model, reg and K for a neighbor index, the global mean
+#    gameNames.json   the game names in database index order
+#    users.json       the users the user means are for
+#    *.npy            the similarity data (database_sim and database_sup, or the neighbor index arrays), the
+#                     game means (in database index order) and the user means
+#The arrays are opened memory-mapped and read-only, so opening reads nothing but the small json files, and
+#any number of processes opening the same snapshot share one copy of it in the page cache.
+#The snapshot is written to a temporary directory that is renamed into place, so readers never see half of one.
+
+SNAPSHOT_FORMAT='scrapethegeek-model'
+SNAPSHOT_VERSION=1
+INDEX_ARRAYS=('indptr','neighbors','sims','sups','selfSupport')
+
+def _writeJson(path, value):
+    with open(path,'w') as fout:
+        json.dump(value,fout)
+
+def _readJson(path):
+    with open(path,'r') as fin:
+        return json.load(fin)
+
+#The baseline means calcBase uses, read from a snapshot.  It has the RatingsIndex methods ratingPredictor's
+#baseline needs (userMean, gameMean, base), with users.json only read when a user mean is first asked for
+class SnapshotBaseline:
+    def __init__(self, path, gameNames, globalMean):
+        self.path=path
+        self.gameNames=gameNames
+        self.globalMean=globalMean
+        self.gameMeans=np.load(os.path.join(path,'gameMeans.npy'),mmap_mode='r')
+        self.userMeans=np.load(os.path.join(path,'userMeans.npy'),mmap_mode='r')
+        self.userCodes=None
+
+    def userMean(self, user):
+        if self.userCodes is None:
+            self.userCodes=dict((user,i) for i,user in enumerate(_readJson(os.path.join(self.path,'users.json'))))
+        u=self.userCodes.get(user)
+        return np.nan if u is None else self.userMeans[u]
+
+    def gameMean(self, gameName):
+        g=self.gameNames.get(gameName)
+        return np.nan if g is None else self.gameMeans[g]
+
+    def base(self, user, gameName):
+        return self.globalMean+(self.userMean(user)-self.globalMean)+(self.gameMean(gameName)-self.globalMean)
+
+#Writes a snapshot of dbase (a Database with dense arrays or a neighbor index, or an IncrementalSimilarity) to
+#the directory path, replacing any snapshot there.  The baseline means come from rindex, or a RatingsIndex of
+#dbase.df (the current ratings of an IncrementalSimilarity)
+def saveSnapshot(dbase, path, rindex=None):
+    if rindex is None:
+        if getattr(dbase,'df',None) is not None:
+            rindex=RatingsIndex(dbase.df)
+        elif hasattr(dbase,'ratingsFrame'):
+            rindex=RatingsIndex(dbase.ratingsFrame())
+        else:
+            raise TypeError('saveSnapshot needs rindex for a %s without a ratings frame' % dbase.__class__.__name__)
+    names=[None]*len(dbase.gameNames)
+    for name,i in dbase.gameNames.items():
+        names[i]=name
+    index=getattr(dbase,'neighborIndex',None)
+    header={'format':SNAPSHOT_FORMAT,'version':SNAPSHOT_VERSION,'created':time.time(),'numGames':len(names),
+            'kind':'dense' if getattr(dbase,'database_sim',None) is not None else 'neighborIndex',
+            'reg':index.reg if index is not None else None,'K':index.K if index is not None else None,'globalMean':float(rindex.globalMean)}
+    tmpPath=path.rstrip('/')+'.tmp'
+    if os.path.isdir(tmpPath):
+        shutil.rmtree(tmpPath)
+    os.makedirs(tmpPath)
+    if header['kind']=='dense':
+        #an IncrementalSimilarity's arrays have spare rows and columns past its last game
+        numGames=len(names)
+        np.save(os.path.join(tmpPath,'database_sim.npy'),np.asarray(dbase.database_sim[:numGames,:numGames],dtype=np.float64))
+        np.save(os.path.join(tmpPath,'database_sup.npy'),np.asarray(dbase.database_sup[:numGames,:numGames],dtype=np.int64))
+    else:
+        for name,array in zip(INDEX_ARRAYS,index.trimmedArrays()):
+            np.save(os.path.join(tmpPath,name+'.npy'),array)
+    np.save(os.path.join(tmpPath,'gameMeans.npy'),np.array([rindex.gameMean(name) for name in names]))
+    np.save(os.path.join(tmpPath,'userMeans.npy'),np.asarray(rindex.userMeans))
+    _writeJson(os.path.join(tmpPath,'gameNames.json'),names)
+    _writeJson(os.path.join(tmpPath,'users.json'),list(rindex.users))
+    #the header goes last, a directory without one isn't a snapshot
+    _writeJson(os.path.join(tmpPath,'header.json'),header)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.rename(tmpPath,path)
+
+#Opens the snapshot in the directory path.  Returns (dbase, baseline): a Database with no df whose
+#similarity data are read-only memory maps (Database.get and knearest work on it as usual, and so does
+#ratingPredictor given the ratings frame), and a SnapshotBaseline with the baseline means
+def loadSnapshot(path):
+    from buildPandasDF import Database
+    header=_readJson(os.path.join(path,'header.json'))
+    if header.get('format')!=SNAPSHOT_FORMAT:
+        raise ValueError('%s is not a model snapshot' % path)
+    if header['version']>SNAPSHOT_VERSION:
+        raise ValueError('snapshot %s is version %s, this code reads up to version %s' % (path,header['version'],SNAPSHOT_VERSION))
+    names=_readJson(os.path.join(path,'gameNames.json'))
+    dbase=Database(None)
+    dbase.gameNames=dict((name,i) for i,name in enumerate(names))
+    if header['kind']=='dense':
+        dbase.database_sim=np.load(os.path.join(path,'database_sim.npy'),mmap_mode='r')
+        dbase.database_sup=np.load(os.path.join(path,'database_sup.npy'),mmap_mode='r')
+    else:
+        arrays=[np.load(os.path.join(path,name+'.npy'),mmap_mode='r') for name in INDEX_ARRAYS]
+        indptr,neighbors,sims,sups,selfSupport=arrays
+        dbase.neighborIndex=NeighborIndex(names,indptr,neighbors,sims,sups,header['reg'],selfSupport,header.get('K'))
+    return dbase,SnapshotBaseline(path,dbase.gameNames,header['globalMean'])
+
+
+def _snapshotRowSum(args):
+    path,row=args
+    dbase,baseline=loadSnapshot(path)
+    return float(np.sum(dbase.database_sim[row]))
+
+#Compares pickling a dense Database (as the old workflow did) with a snapshot on a synthetic frame: write and
+#open times and sizes, that get answers the same, and that a pool of processes can each open the snapshot
+def benchmarkSnapshot(path='modelSnapshot', numGames=2000, usersPerGame=20, numWorkers=4):
+    from buildPandasDF import Database
+    df=syntheticRatingsFrame(numUsers=numGames*usersPerGame,numGames=numGames,ratingsPerUser=40)
+    db=Database(df)
+    db.populate_by_vectorizing(blockSize=500)
+    start=time.time()
+    with open(path+'.pickle','wb') as fout:
+        pickle.dump(db,fout,pickle.HIGHEST_PROTOCOL)
+    pickleWrite=time.time()-start
+    start=time.time()
+    with open(path+'.pickle','rb') as fin:
+        pickle.load(fin)
+    pickleLoad=time.time()-start
+    start=time.time()
+    saveSnapshot(db,path)
+    snapshotWrite=time.time()-start
+    start=time.time()
+    loaded,baseline=loadSnapshot(path)
+    snapshotOpen=time.time()-start
+    snapshotSize=sum(os.path.getsize(os.path.join(path,filen)) for filen in os.listdir(path))
+    print 'pickle:   write %6.2fs | load %8.4fs | %7.1f MB' % (pickleWrite,pickleLoad,os.path.getsize(path+'.pickle')/1e6)
+    print 'snapshot: write %6.2fs | open %8.4fs | %7.1f MB' % (snapshotWrite,snapshotOpen,snapshotSize/1e6)
+    rand=np.random.RandomState(0)
+    names=db.gameNames.keys()
+    pairs=[(names[i],names[j]) for i,j in rand.randint(0,len(names),(1000,2))]
+    same=all(db.get(g1,g2)==loaded.get(g1,g2) for g1,g2 in pairs)
+    print 'get answers the same for 1000 random pairs: %s' % same
+    pool=multiprocessing.Pool(numWorkers)
+    try:
+        sums=pool.map(_snapshotRowSum,[(path,row) for row in range(numWorkers)])
+    finally:
+        pool.close()
+        pool.join()
+    print '%s worker processes opened the snapshot, rows match: %s' % (numWorkers,
+        np.allclose(sums,[np.sum(db.database_sim[row]) for row in range(numWorkers)]))
+    os.remove(path+'.pickle')
+    return pickleLoad,snapshotOpen
+
+if __name__ == '__main__':
+    benchmarkSnapshot()
@@ -0,0 +1,242 @@
+
+import numpy as np
+from similarityEngine import buildRatingMatrices, SimilarityOperands
+
+
+#Keeps only the top K neighbors of every game instead of the dense G x G similarity and support arrays.
+#The neighbors are stored CSR-style: the neighbors of game i are at indptr[i]:indptr[i+1] in the flat
+#neighbors (game index), sims (raw pearson similarity) and sups (common support) arrays, sorted by shrunk
+#similarity (shrunk_sim with the reg the index was built with).  The index is built from the similarity
+#engine's column blocks, so at most a G x blockSize slice of similarities exists at any time.
+#knearest answers from a game's K stored neighbors, re-shrinking them with the reg it's asked for; games
+#that didn't make a game's top K are treated as not being its neighbors.
+#New games can be added one at a time with addGame (see coldStart.py for computing their similarities).  Once
+#a game has been added, the rows are found through per-row starts and ends instead of indptr, and every row has
+#a capacity: an added game's row gets room for K neighbors, and a row too short to take a new neighbor in place
+#is moved once to a fresh slot of K at the end of the flat arrays (which keep spare room, doubling when full).
+#So adding a game costs time proportional to its number of neighbors, not to the size of the index.
+#trimmedArrays packs the rows back into plain CSR arrays for saving.
+#Adding a game is not quite a rebuild: the pairs already stored keep the similarities they had before the new
+#game's ratings shifted its raters' user means (the new game's own similarities use the updated means), and
+#games with no raters in common with the new game don't get it as a zero-support filler neighbor.
+
+class NeighborIndex:
+    #K is the number of neighbors the index keeps per game (by default its longest row); rows shorter than K
+    #take new neighbors without dropping any
+    def __init__(self, names, indptr, neighbors, sims, sups, reg, selfSupport, K=None):
+        self.names=list(names)
+        self.nameIndex=dict((name,i) for i,name in enumerate(self.names))
+        self.nameArray=np.array(self.names,dtype=object)
+        self.indptr=indptr
+        self.neighbors=neighbors
+        self.sims=sims
+        self.sups=sups
+        self.reg=reg
+        self.selfSupport=selfSupport
+        self.K=K
+        #the per-row starts, ends and capacities, and the end of the used part of the flat arrays, made when
+        #the first game is added
+        self.starts=None
+        self.ends=None
+        self.capacities=None
+        self.used=None
+
+    #Adds a new game whose similarities to the games already in the index are sims with supports sups (arrays
+    #over the index positions in neighbors; games not listed have no common raters), and which has
+    #selfSupport ratings.  Its row gets its K best by shrunk similarity with the index's reg, and it is offered
+    #to every listed game's row: a row with fewer than K neighbors takes it, a full one if it beats the weakest.
+    #An index opened read-only (from a snapshot) is copied into memory first.  Returns the game's index position
+    def addGame(self, gameName, neighbors, sims, sups, selfSupport):
+        if gameName in self.nameIndex:
+            raise ValueError('%s is already in the index' % gameName)
+        neighbors=np.asarray(neighbors,dtype=np.int64)
+        sims=np.asarray(sims,dtype=np.float64)
+        sups=np.asarray(sups,dtype=np.float64)
+        self._unpack()
+        i=len(self.names)
+        K=self.rowCapacity()
+        shrunk=(sups*sims)/(sups+self.reg)
+        order=np.argsort(-shrunk,kind='mergesort')[:K]
+        start=self._allocate(i+1,K)
+        end=start+len(order)
+        self.neighbors[start:end]=neighbors[order]
+        self.sims[start:end]=sims[order]
+        self.sups[start:end]=sups[order]
+        self.starts[i]=start
+        self.ends[i]=end
+        self.capacities[i]=K
+        self.selfSupport[i]=selfSupport
+        self.names.append(gameName)
+        self.nameIndex[gameName]=i
+        self.nameArray[i]=gameName
+        for j,sim,sup,score in zip(neighbors,sims,sups,shrunk):
+            self._offerNeighbor(j,i,sim,sup,score,K)
+        return i
+
+    #the number of neighbors a row can hold: K, or the longest row of an index made without it
+    def rowCapacity(self):
+        if self.K is None:
+            starts,lengths=self.rowBounds(np.arange(len(self.names)))
+            self.K=int(lengths.max()) if len(lengths) else 0
+        return self.K
+
+    #the (starts, lengths) in the flat arrays of the rows at the index positions targets
+    def rowBounds(self, targets):
+        if self.starts is None:
+            starts=self.indptr[targets]
+            return starts,self.indptr[targets+1]-starts
+        starts=self.starts[targets]
+        return starts,self.ends[targets]-starts
+
+    #puts game i into game j's row, keeping it sorted: without dropping anything if the row has fewer than K
+    #neighbors, otherwise in place of the weakest if it beats it
+    def _offerNeighbor(self, j, i, sim, sup, score, K):
+        start,end=self.starts[j],self.ends[j]
+        rowSims=self.sims[start:end]
+        rowSups=self.sups[start:end]
+        rowShrunk=(rowSups*rowSims)/(rowSups+self.reg)
+        if end-start>=K:
+            if end==start or score<=rowShrunk[-1]:
+                return
+        else:
+            if end-start==self.capacities[j]:
+                start,end=self._moveRow(j,K)
+            end+=1
+            self.ends[j]=end
+        #after the stored neighbors it ties with, like the stable sort of a rebuild
+        at=start+np.searchsorted(-rowShrunk,-score,side='right')
+        for array,value in ((self.neighbors,i),(self.sims,sim),(self.sups,sup)):
+            array[at+1:end]=array[at:end-1].copy()
+            array[at]=value
+
+    #moves row j to a new slot with room for capacity neighbors at the end of the flat arrays
+    def _moveRow(self, j, capacity):
+        start,end=self.starts[j],self.ends[j]
+        newStart=self._allocate(len(self.names),capacity)
+        for array in (self.neighbors,self.sims,self.sups):
+            array[newStart:newStart+end-start]=array[start:end]
+        self.starts[j]=newStart
+        self.ends[j]=newStart+end-start
+        self.capacities[j]=capacity
+        return newStart,newStart+end-start
+
+    #switches from indptr to per-row starts, ends and capacities
+    def _unpack(self):
+        if self.starts is None:
+            numGames=len(self.names)
+            self.starts=np.array(self.indptr[:numGames],dtype=np.int64)
+            self.ends=np.array(self.indptr[1:numGames+1],dtype=np.int64)
+            self.capacities=self.ends-self.starts
+            self.used=int(self.indptr[numGames])
+
+    #makes room for numGames games and returns the start of numEntries new entries at the end of the flat
+    #arrays, doubling the arrays that are too small and copying read-only arrays into memory
+    def _allocate(self, numGames, numEntries):
+        def grown(array, size):
+            if len(array)>=size and array.flags.writeable:
+                return array
+            bigger=np.zeros(max(size,2*len(array)),dtype=array.dtype)
+            bigger[:len(array)]=array
+            return bigger
+        self.starts=grown(self.starts,numGames)
+        self.ends=grown(self.ends,numGames)
+        self.capacities=grown(self.capacities,numGames)
+        self.selfSupport=grown(self.selfSupport,numGames)
+        self.nameArray=grown(self.nameArray,numGames)
+        start=self.used
+        self.used+=numEntries
+        self.neighbors=grown(self.neighbors,self.used)
+        self.sims=grown(self.sims,self.used)
+        self.sups=grown(self.sups,self.used)
+        return start
+
+    #the index as packed CSR arrays in INDEX_ARRAYS order (for saving)
+    def trimmedArrays(self):
+        numGames=len(self.names)
+        if self.starts is None:
+            numEntries=self.indptr[numGames]
+            return (self.indptr[:numGames+1],self.neighbors[:numEntries],self.sims[:numEntries],
+                    self.sups[:numEntries],self.selfSupport[:numGames])
+        starts,lengths=self.rowBounds(np.arange(numGames))
+        indptr=np.zeros(numGames+1,dtype=np.int64)
+        indptr[1:]=np.cumsum(lengths)
+        take=np.repeat(starts-indptr[:-1],lengths)+np.arange(indptr[-1])
+        return indptr,self.neighbors[take],self.sims[take],self.sups[take],self.selfSupport[:numGames]
+
+    #the stored (neighbor indices, sims, sups) of a game
+    def row(self, gameName):
+        starts,lengths=self.rowBounds(np.array([self.nameIndex[gameName]]))
+        start,end=starts[0],starts[0]+lengths[0]
+        return self.neighbors[start:end],self.sims[start:end],self.sups[start:end]
+
+    #(sim, support) of a pair like Database.get, or (0., 0) if g2 isn't one of g1's stored neighbors
+    def get(self, g1, g2):
+        if g1==g2:
+            i=self.nameIndex[g1]
+            return 1.,self.selfSupport[i]
+        neighbors,sims,sups=self.row(g1)
+        hit=np.nonzero(neighbors==self.nameIndex[g2])[0]
+        if len(hit):
+            return sims[hit[0]],sups[hit[0]]
+        return 0.,0
+
+    #Same result format as knearest: a list of (gameName, shrunk sim, support) for the k nearest stored
+    #neighbors of gameName that are in set_of_games (all games if None), in decreasing shrunk similarity.
+    #Only the stored neighbors are looked up in set_of_games, so callers asking about many games should pass
+    #a set (a list is turned into one on every call)
+    def knearest(self, gameName, set_of_games=None, k=7, reg=1000.):
+        neighbors,sims,sups=self.row(gameName)
+        names=self.nameArray[neighbors]
+        if set_of_games is not None:
+            if not isinstance(set_of_games,(set,frozenset,dict)):
+                set_of_games=set(set_of_games)
+            keep=np.array([name in set_of_games for name in names],dtype=bool)
+            names,sims,sups=names[keep],sims[keep],sups[keep]
+        shrunk=(sups*sims)/(sups+reg)
+        order=np.argsort(-shrunk,kind='mergesort')[:k]
+        return [(names[i],shrunk[i],sups[i]) for i in order]
+
+    def nbytes(self):
+        return sum(array.nbytes for array in self.trimmedArrays())
+
+    #prints the index size next to what the dense float64 similarity and int64 support arrays would take
+    def reportMemory(self):
+        numGames=len(self.names)
+        dense=numGames*numGames*16
+        starts,lengths=self.rowBounds(np.arange(numGames))
+        print '%s games, %s neighbors each: index %.1f MB, dense arrays %.1f MB (%.0fx smaller)' % (
+            numGames,lengths.sum()/max(1,numGames),self.nbytes()/1e6,dense/1e6,dense/float(max(1,self.nbytes())))
+
+
+#Builds the top-K index for the games in gameNames (a dict gameName -> index, like Database.gameNames) from
+#a ratings frame like smallDf.  Neighbors are ranked by shrunk similarity with reg; a game is never its own
+#neighbor.  Every game gets min(K, G-1) neighbors.
+def buildNeighborIndex(df, gameNames, K=50, reg=1000., blockSize=1000):
+    X,B,rowCounts=buildRatingMatrices(df,gameNames)
+    operands=SimilarityOperands(X,B.tocsc().data)
+    numGames=len(gameNames)
+    requestedK=K
+    K=max(0,min(K,numGames-1))
+    neighbors=np.empty((numGames,K),dtype=np.int32)
+    sims=np.empty((numGames,K),dtype=np.float64)
+    sups=np.empty((numGames,K),dtype=np.int32)
+    for start in range(0,numGames,blockSize):
+        columns=np.arange(start,min(start+blockSize,numGames))
+        sim,sup=operands.block(slice(columns[0],columns[-1]+1))
+        shrunk=(sup*sim)/(sup+reg)
+        shrunk[columns,np.arange(len(columns))]=-np.inf
+        if K==0:
+            continue
+        top=np.argpartition(-shrunk,K-1,axis=0)[:K]
+        cols=np.arange(len(columns))
+        topShrunk=shrunk[top,cols]
+        order=np.argsort(-topShrunk,axis=0,kind='mergesort')
+        top=top[order,cols]
+        neighbors[columns]=top.T
+        sims[columns]=sim[top,cols].T
+        sups[columns]=sup[top,cols].T
+    names=[None]*numGames
+    for name,i in gameNames.items():
+        names[i]=name
+    return NeighborIndex(names,np.arange(numGames+1,dtype=np.int64)*K,neighbors.ravel(),sims.ravel(),sups.ravel(),reg,rowCounts,
+                         requestedK)
@@ -0,0 +1,78 @@
+
+import numpy as np
+import pandas as pd
+
+
+#Per-user and per-game lookups into a ratings frame like smallDf, built once so ratingPredictor, calcBase and
+#the recommendation functions don't have to scan the whole frame with df[df.user==user] on every call.
+#The rows of each user (and of each game) are kept CSR-style: the positions of user u's rows in df are
+#userOrder[userIndptr[u]:userIndptr[u+1]], in the order they appear in df, so a lookup costs time proportional
+#to the user's number of ratings.  The global mean and every user's and game's mean rating are computed once.
+#The frame must not change after the index is built; build a new one for a recomputed frame.
+
+class RatingsIndex:
+    def __init__(self, df):
+        self.df=df
+        self.ratings=df.rating.values.astype(np.float64)
+        self.gameNameValues=df.gameName.values
+        self.globalMean=self.ratings.mean()
+        userCodes,self.users=pd.factorize(df.user.values)
+        gameCodes,self.games=pd.factorize(df.gameName.values)
+        self.rowGameCodes=gameCodes
+        self.userCodes=dict((user,i) for i,user in enumerate(self.users))
+        self.gameCodes=dict((game,i) for i,game in enumerate(self.games))
+        self.userOrder,self.userIndptr,self.userMeans=self._groupRows(userCodes,len(self.users))
+        self.gameOrder,self.gameIndptr,self.gameMeans=self._groupRows(gameCodes,len(self.games))
+
+    def _groupRows(self, codes, numGroups):
+        counts=np.bincount(codes,minlength=numGroups)
+        order=np.argsort(codes,kind='mergesort')
+        indptr=np.concatenate([[0],np.cumsum(counts)])
+        means=np.bincount(codes,weights=self.ratings,minlength=numGroups)/np.maximum(counts,1)
+        means[counts==0]=np.nan
+        return order,indptr,means
+
+    #positions in df of a user's rows, in df order (empty for an unknown user)
+    def userRows(self, user):
+        u=self.userCodes.get(user)
+        if u is None:
+            return np.array([],dtype=np.int64)
+        return self.userOrder[self.userIndptr[u]:self.userIndptr[u+1]]
+
+    def gameRows(self, gameName):
+        g=self.gameCodes.get(gameName)
+        if g is None:
+            return np.array([],dtype=np.int64)
+        return self.gameOrder[self.gameIndptr[g]:self.gameIndptr[g+1]]
+
+    #the user's rows of df, like df[df.user==user]
+    def userFrame(self, user):
+        return self.df.iloc[self.userRows(user)]
+
+    #the distinct games a user rated, in the order of df.gameName.unique() on the user's rows
+    def userGames(self, user):
+        return pd.unique(self.gameNameValues[self.userRows(user)])
+
+    #the user's first rating of a game, or None
+    def userRating(self, user, gameName):
+        rows=self.userRows(user)
+        hits=np.nonzero(self.gameNameValues[rows]==gameName)[0]
+        if len(hits)==0:
+            return None
+        return self.ratings[rows[hits[0]]]
+
+    def userMean(self, user):
+        u=self.userCodes.get(user)
+        return np.nan if u is None else self.userMeans[u]
+
+    def gameMean(self, gameName):
+        g=self.gameCodes.get(gameName)
+        return np.nan if g is None else self.gameMeans[g]
+
+    #every game in df, in the order of df.gameName.unique()
+    def gameNameList(self):
+        return self.games
+
+    #the baseline rating calcBase computes: global mean plus the user's and the game's offsets from it
+    def base(self, user, gameName):
+        return self.globalMean+(self.userMean(user)-self.globalMean)+(self.gameMean(gameName)-self.globalMean)
@@ -0,0 +1,212 @@
+
+import numpy as np
+import pandas as pd
+import codecs
+import csv
+import os
+
+
+#A compact on-disk store for the scraped ratings, replacing the per-game csvs and fullGamesDf.csv.
+#Users and games are integer encoded: users.txt holds one username per line (the line number is the
+#user code) and games.tsv holds gameCode, gameID, gameName and the segment the game's ratings live in.
+#Ratings are kept in segments, each one a set of .npy files (int32 user codes, int32 game codes and
+#float32 ratings), that are loaded memory-mapped so opening the store doesn't read any ratings.
+#Appending a game writes a new segment and a line to each dictionary file, nothing is rewritten.
+#Re-appending a game (after a refresh) points its games.tsv line at the new segment, and its old rows
+#are filtered out on load; compact() merges all segments into one and drops those rows for good.
+
+STORE_COLUMNS=['user','game','rating']
+COLUMN_DTYPES={'user':np.int32,'game':np.int32,'rating':np.float32}
+
+#the csvs are read as utf-8 byte strings in python 2
+def _toUnicode(value):
+    return value.decode('utf-8') if isinstance(value,str) else unicode(value)
+
+class RatingsStore:
+    def __init__(self, path='google_drive/ratingsStore/'):
+        self.path=path
+        if not os.path.isdir(os.path.join(path,'segments')):
+            os.makedirs(os.path.join(path,'segments'))
+        self.users=[]
+        self.userCodes={}
+        if os.path.exists(self._usersPath()):
+            with codecs.open(self._usersPath(),'r','utf-8') as fin:
+                for line in fin:
+                    self._addUser(line.rstrip('\n'))
+        self.gameIDs=[]
+        self.gameNames=[]
+        self.gameSegments=[]
+        self.gameCodes={}
+        if os.path.exists(self._gamesPath()):
+            with codecs.open(self._gamesPath(),'r','utf-8') as fin:
+                for line in fin:
+                    gameCode,gameID,gameName,segment=line.rstrip('\n').split('\t')
+                    self._setGame(int(gameCode),int(gameID),gameName,int(segment))
+        self.segments=sorted(int(filen.split('_')[0]) for filen in os.listdir(os.path.join(path,'segments'))
+                             if filen.endswith('_rating.npy'))
+
+    def _usersPath(self):
+        return os.path.join(self.path,'users.txt')
+
+    def _gamesPath(self):
+        return os.path.join(self.path,'games.tsv')
+
+    def _segmentPath(self, segment, column):
+        return os.path.join(self.path,'segments','%06d_%s.npy' % (segment,column))
+
+    def _addUser(self, user):
+        self.userCodes[user]=len(self.users)
+        self.users.append(user)
+
+    def _setGame(self, gameCode, gameID, gameName, segment):
+        if gameCode==len(self.gameIDs):
+            self.gameIDs.append(gameID)
+            self.gameNames.append(gameName)
+            self.gameSegments.append(segment)
+        else:
+            self.gameNames[gameCode]=gameName
+            self.gameSegments[gameCode]=segment
+        self.gameCodes[gameID]=gameCode
+
+    def numRatings(self):
+        return sum(len(np.load(self._segmentPath(segment,'rating'),mmap_mode='r')) for segment in self.segments)
+
+    #appends a frame with user, gameID, gameName and rating columns (like a gamereviews csv) as a new segment
+    def appendFrame(self, df):
+        if len(df)==0:
+            return None
+        segment=self.segments[-1]+1 if self.segments else 0
+        newUsers=[]
+        userCodes=np.empty(len(df),dtype=np.int32)
+        for i,user in enumerate(df['user'].values):
+            user=_toUnicode(user)
+            if user not in self.userCodes:
+                self._addUser(user)
+                newUsers.append(user)
+            userCodes[i]=self.userCodes[user]
+        gameLines=[]
+        gameCodes=np.empty(len(df),dtype=np.int32)
+        gameIDs=df['gameID'].values.astype(np.int64)
+        for gameID,firstRow in zip(*np.unique(gameIDs,return_index=True)):
+            gameID=int(gameID)
+            gameName=_toUnicode(df['gameName'].values[firstRow]).replace('\t',' ')
+            gameCode=self.gameCodes.get(gameID,len(self.gameIDs))
+            self._setGame(gameCode,gameID,gameName,segment)
+            gameLines.append(u'%s\t%s\t%s\t%s\n' % (gameCode,gameID,gameName,segment))
+            gameCodes[gameIDs==gameID]=gameCode
+        #the segment is written before the dictionary lines that point at it
+        np.save(self._segmentPath(segment,'user'),userCodes)
+        np.save(self._segmentPath(segment,'game'),gameCodes)
+        np.save(self._segmentPath(segment,'rating'),np.asarray(df['rating'].values,dtype=np.float32))
+        with codecs.open(self._usersPath(),'a','utf-8') as fout:
+            fout.writelines(user+u'\n' for user in newUsers)
+        with codecs.open(self._gamesPath(),'a','utf-8') as fout:
+            fout.writelines(gameLines)
+        self.segments.append(segment)
+        return segment
+
+    def appendCsv(self, filePath):
+        df=pd.read_csv(filePath)
+        df.columns = ['gameID','gameName','rating','user']
+        return self.appendFrame(df)
+
+    #Returns a dictionary of the requested code columns ('user', 'game', 'rating').  A store with one segment
+    #and no superseded rows is returned as read-only memory maps without copying.
+    def columns(self, names=STORE_COLUMNS):
+        gameSegments=np.array(self.gameSegments,dtype=np.int64)
+        parts=dict((name,[]) for name in names)
+        for segment in self.segments:
+            games=np.load(self._segmentPath(segment,'game'),mmap_mode='r')
+            #a segment whose games.tsv lines never got written (crash mid-append) has no current rows
+            known=games<len(gameSegments)
+            current=known&(gameSegments[np.where(known,games,0)]==segment)
+            allCurrent=current.all()
+            for name in names:
+                column=np.load(self._segmentPath(segment,name),mmap_mode='r')
+                parts[name].append(column if allCurrent else column[current])
+        result={}
+        for name in names:
+            if len(parts[name])==1:
+                result[name]=parts[name][0]
+            elif parts[name]:
+                result[name]=np.concatenate(parts[name])
+            else:
+                result[name]=np.array([],dtype=COLUMN_DTYPES[name])
+        return result
+
+    #Returns a frame with the requested columns out of user, gameID, gameName and rating, decoded from the codes.
+    #Only the segment columns that are needed get read.
+    def loadFrame(self, columns=('gameID','gameName','rating','user')):
+        needed=[]
+        if 'user' in columns:
+            needed.append('user')
+        if 'gameID' in columns or 'gameName' in columns:
+            needed.append('game')
+        if 'rating' in columns:
+            needed.append('rating')
+        codes=self.columns(needed)
+        data={}
+        if 'user' in columns:
+            data['user']=np.array(self.users,dtype=object)[codes['user']]
+        if 'gameID' in columns:
+            data['gameID']=np.array(self.gameIDs,dtype=np.int64)[codes['game']]
+        if 'gameName' in columns:
+            data['gameName']=np.array(self.gameNames,dtype=object)[codes['game']]
+        if 'rating' in columns:
+            data['rating']=np.array(codes['rating'])
+        return pd.DataFrame(data,columns=list(columns))
+
+    #the number of current ratings of every game, by game code
+    def gameRatingCounts(self):
+        return np.bincount(self.columns(['game'])['game'],minlength=len(self.gameIDs))
+
+    #merges all segments into one, dropping superseded rows, and rewrites games.tsv to point at it
+    def compact(self):
+        if not self.segments:
+            return
+        codes=self.columns()
+        segment=self.segments[-1]+1
+        for name in STORE_COLUMNS:
+            np.save(self._segmentPath(segment,name),np.asarray(codes[name]))
+        with codecs.open(self._gamesPath()+'.tmp','w','utf-8') as fout:
+            for gameCode,(gameID,gameName) in enumerate(zip(self.gameIDs,self.gameNames)):
+                fout.write(u'%s\t%s\t%s\t%s\n' % (gameCode,gameID,gameName,segment))
+        os.rename(self._gamesPath()+'.tmp',self._gamesPath())
+        oldSegments=self.segments
+        self.segments=[segment]
+        self.gameSegments=[segment]*len(self.gameIDs)
+        for old in oldSegments:
+            for name in STORE_COLUMNS:
+                os.remove(self._segmentPath(old,name))
+
+
+#the number of data rows in a csv
+def _csvRowCount(filePath):
+    with open(filePath,'rb') as fin:
+        return max(sum(1 for row in csv.reader(fin))-1,0)
+
+#Appends the gamereviews csvs in dataDir whose games aren't in the store yet, and re-appends the ones whose
+#csv has a different number of ratings than the store holds (the game was re-scraped), which replaces the
+#game's rows.  Prints and returns the gameIDs imported, refreshed and left as they were
+def importScrapedCsvs(store, dataDir='google_drive/gameRatings/'):
+    prefix='gamereviews_id_'
+    counts=store.gameRatingCounts()
+    imported=[]
+    refreshed=[]
+    unchanged=[]
+    for filen in sorted(os.listdir(dataDir)):
+        if filen.startswith(prefix) and filen.endswith('.csv'):
+            gameID=int(filen[len(prefix):].split('_',1)[0])
+            filePath=os.path.join(dataDir,filen)
+            if gameID not in store.gameCodes:
+                store.appendCsv(filePath)
+                imported.append(gameID)
+            elif _csvRowCount(filePath)!=counts[store.gameCodes[gameID]]:
+                store.appendCsv(filePath)
+                refreshed.append(gameID)
+            else:
+                unchanged.append(gameID)
+    print '%s games imported, %s refreshed, %s unchanged' % (len(imported),len(refreshed),len(unchanged))
+    if refreshed:
+        print 'refreshed:', refreshed
+    return imported,refreshed,unchanged
@@ -0,0 +1,404 @@
+import BaseHTTPServer
+import SocketServer
+import threading
+import json
+import time
+import urlparse
+import urllib
+import requests
+import numpy as np
+from collections import OrderedDict, deque
+from multiprocessing.pool import ThreadPool
+from ratingsIndex import RatingsIndex
+from batchPredictor import predictBatch, denseNeighborPositions
+from bulkRecommendations import gameNeighborLists, userRecommendations
+from syntheticRatings import syntheticRatingsFrame
+
+
+#A local HTTP service answering recommendation queries from a model kept warm in memory, instead of rebuilding
+#or unpickling the Database for every run.  The ratings frame, the similarity database (dense arrays or neighbor
+#index) and a RatingsIndex are loaded once at startup, and every request is answered from them:
+#    GET  /recos?user=U&n=5&k=8&reg=200        get_top_recos_for_user
+#    GET  /predict?user=U&game=G&k=7&reg=200   ratingPredictor (through predictBatch, same result)
+#    GET  /knearest?game=G&k=7&reg=200         knearest amongst all games
+#    POST /batch                               a JSON list of {"endpoint": ..., params...}; the predictions in
+#                                              it are computed together with one predictBatch call, and an
+#                                              entry that fails gets {"error": ...} in place of its result
+#    GET  /metrics                             request counts, p50/p99 latency per endpoint, cache hits
+#Single /predict requests that arrive together are batched on the server too: the first one waits
+#coalesceWindow seconds for others with the same k and reg, and all of them are answered by one predictBatch
+#call (see PredictCoalescer).  Query parameters are utf-8, so user and game names can be any BGG name.
+#A missing parameter is a 400 and an unknown game a 404; predictions for unknown games are turned away before
+#they are batched, so they never fail the valid requests batched with them.
+#Results are kept in an LRU cache keyed by endpoint and parameters.  Recommendations are made from every game's
+#k nearest games, computed the first time a (k, reg) is asked for and kept (see bulkRecommendations.py), so they
+#come out like the bulk job's: ties in average rating are broken by game code.
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads=True
+
+
+class _RecoHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        url=urlparse.urlparse(self.path)
+        params=dict((key.decode('utf-8'),values[0].decode('utf-8')) for key,values in urlparse.parse_qs(url.query).items())
+        self._answer(url.path.strip('/'),params)
+
+    def do_POST(self):
+        body=self.rfile.read(int(self.headers.get('Content-Length',0)))
+        try:
+            params=json.loads(body) if body else []
+        except ValueError:
+            params=None
+        self._answer(urlparse.urlparse(self.path).path.strip('/'),params)
+
+    def _answer(self, endpoint, params):
+        status,result=self.server.service.handle(endpoint,params)
+        body=json.dumps(result)
+        self.send_response(status)
+        self.send_header('Content-Type','application/json')
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    #keep the console quiet
+    def log_message(self, format, *args):
+        pass
+
+
+#A thread-safe least recently used cache
+class LRUCache:
+    def __init__(self, capacity=10000):
+        self.capacity=capacity
+        self.entries=OrderedDict()
+        self.hits=0
+        self.misses=0
+        self.lock=threading.Lock()
+
+    #returns (found, value)
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                value=self.entries.pop(key)
+                self.entries[key]=value
+                self.hits+=1
+                return True,value
+            self.misses+=1
+            return False,None
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries.pop(key,None)
+            self.entries[key]=value
+            while len(self.entries)>self.capacity:
+                self.entries.popitem(last=False)
+
+
+#Collects the single predictions asked for at about the same time into one predictBatch call.  The first
+#request for a (k, reg) opens a batch and waits window seconds (or until maxBatch requests have joined) while
+#the requests on other threads add their pairs to it, then predicts them all and wakes the others up.  If the
+#batch call fails, the pairs are predicted one at a time so only the failing ones get the error
+class PredictCoalescer:
+    def __init__(self, predictMany, window=0.002, maxBatch=256):
+        self.predictMany=predictMany
+        self.window=window
+        self.maxBatch=maxBatch
+        self.open={}
+        self.batches=0
+        self.predictions=0
+        self.lock=threading.Lock()
+
+    def predict(self, user, game, k, reg):
+        with self.lock:
+            batch=self.open.get((k,reg))
+            leader=batch is None
+            if leader:
+                batch={'pairs':[],'results':None,'errors':None,'done':threading.Event(),'full':threading.Event()}
+                self.open[(k,reg)]=batch
+            i=len(batch['pairs'])
+            batch['pairs'].append((user,game))
+            if len(batch['pairs'])>=self.maxBatch:
+                del self.open[(k,reg)]
+                batch['full'].set()
+        if leader:
+            batch['full'].wait(self.window)
+            with self.lock:
+                if self.open.get((k,reg)) is batch:
+                    del self.open[(k,reg)]
+                self.batches+=1
+                self.predictions+=len(batch['pairs'])
+            try:
+                batch['results'],batch['errors']=_predictPairs(self.predictMany,batch['pairs'],k,reg)
+            finally:
+                batch['done'].set()
+        else:
+            batch['done'].wait()
+        if batch['errors'] is None:
+            raise RuntimeError('the batched prediction was not made')
+        if batch['errors'][i] is not None:
+            raise batch['errors'][i]
+        return batch['results'][i]
+
+
+#predicts the (user, game) pairs with one predictMany call and returns (results, errors), errors[i] the
+#exception pair i raised or None; if the call fails the pairs are predicted one at a time
+def _predictPairs(predictMany, pairs, k, reg):
+    try:
+        return predictMany(pairs,k,reg),[None]*len(pairs)
+    except Exception:
+        results=[None]*len(pairs)
+        errors=[None]*len(pairs)
+        for i,pair in enumerate(pairs):
+            try:
+                results[i]=predictMany([pair],k,reg)[0]
+            except Exception as e:
+                errors[i]=e
+        return results,errors
+
+
+#json can't hold nan (the prediction for an unknown user)
+def _number(value):
+    value=float(value)
+    return None if np.isnan(value) else value
+
+#the values of the named request parameters; a missing one is a bad request
+def _required(params, *names):
+    missing=[name for name in names if name not in params]
+    if missing:
+        raise ValueError('missing parameter: %s' % ', '.join(missing))
+    return [params[name] for name in names]
+
+#(http status, json-able result) for the exception a request raised
+def _errorResult(e):
+    if isinstance(e,KeyError):
+        return 404,{'error':u'not found: %s' % (e.args[0] if e.args else '')}
+    if isinstance(e,ValueError):
+        return 400,{'error':str(e)}
+    return 500,{'error':repr(e)}
+
+
+class RecoService:
+    #df is a ratings frame like smallDf and dbase a populated Database (or IncrementalSimilarity) for it.
+    #coalesceWindow=0 answers every /predict request on its own
+    def __init__(self, df, dbase, cacheSize=10000, latencyWindow=10000, coalesceWindow=0.002):
+        from buildPandasDF import knearest
+        self.knearest=knearest
+        self.df=df
+        self.dbase=dbase
+        self.rindex=RatingsIndex(df)
+        self.allGames=self.rindex.gameNameList()
+        self.allGameSet=set(self.allGames)
+        self.toDbase=np.array([dbase.gameNames[name] for name in self.allGames],dtype=np.int64)
+        self.neighborLists={}
+        self.neighborLock=threading.Lock()
+        self.cache=LRUCache(cacheSize)
+        self.coalescer=PredictCoalescer(self.predictMany,coalesceWindow) if coalesceWindow>0 else None
+        self.latencies={}
+        self.latencyWindow=latencyWindow
+        self.lock=threading.Lock()
+        self.httpd=None
+
+    #every game's k nearest games for reg, computed once
+    def gameNeighbors(self, k, reg):
+        with self.neighborLock:
+            if (k,reg) not in self.neighborLists:
+                self.neighborLists[(k,reg)]=gameNeighborLists(self.dbase,self.rindex,k,reg)
+            return self.neighborLists[(k,reg)]
+
+    #the same recommendations as get_top_recos_for_user
+    def recos(self, user, n=5, k=8, reg=200.):
+        u=self.rindex.userCodes.get(user)
+        if u is None:
+            return []
+        games,ratings=userRecommendations(self.rindex,self.gameNeighbors(k,reg),u,n)
+        return [{'game':self.allGames[game],'rating':_number(rating)} for game,rating in zip(games,ratings)]
+
+    def predictMany(self, pairs, k=7, reg=200.):
+        users=[user for user,game in pairs]
+        games=[game for user,game in pairs]
+        return [_number(rating) for rating in predictBatch(users,games,self.dbase,self.rindex,k,reg)]
+
+    #knearest amongst all games; with dense arrays the game's row is sorted in one go like knearest does
+    def nearest(self, game, k=7, reg=200.):
+        if getattr(self.dbase,'neighborIndex',None) is not None:
+            nearest=self.knearest(game,self.allGameSet,self.dbase,k,reg)
+        else:
+            target=self.dbase.gameNames[game]
+            picked=denseNeighborPositions(self.dbase,np.array([target]),self.toDbase,k,reg)[0]
+            picked=picked[picked>=0]
+            sim=self.dbase.database_sim[target,self.toDbase[picked]]
+            sup=self.dbase.database_sup[target,self.toDbase[picked]]
+            nearest=zip(self.allGames[picked],(sup*sim)/(sup+reg),sup)
+        return [{'game':name,'similarity':_number(sim),'support':int(sup)} for name,sim,sup in nearest]
+
+    #the cache key and the function computing the result of one request
+    def _call(self, endpoint, params):
+        k=int(params.get('k',8 if endpoint=='recos' else 7))
+        reg=float(params.get('reg',200.))
+        if endpoint=='recos':
+            user,=_required(params,'user')
+            n=int(params.get('n',5))
+            return ('recos',user,n,k,reg),lambda: self.recos(user,n,k,reg)
+        if endpoint=='predict':
+            user,game=_required(params,'user','game')
+            #checked here so an unknown game never joins a batch
+            if game not in self.dbase.gameNames:
+                raise KeyError(game)
+            if self.coalescer:
+                return ('predict',user,game,k,reg),lambda: self.coalescer.predict(user,game,k,reg)
+            return ('predict',user,game,k,reg),lambda: self.predictMany([(user,game)],k,reg)[0]
+        if endpoint=='knearest':
+            game,=_required(params,'game')
+            return ('knearest',game,k,reg),lambda: self.nearest(game,k,reg)
+        raise KeyError('unknown endpoint %s' % endpoint)
+
+    def _cached(self, endpoint, params):
+        key,compute=self._call(endpoint,params)
+        found,result=self.cache.get(key)
+        if not found:
+            result=compute()
+            self.cache.put(key,result)
+        return result
+
+    #Answers a list of requests; the uncached predictions are computed in one predictBatch call per (k, reg).
+    #A request that fails gets {'error': ...} in its place, like the error body of a single request
+    def batch(self, calls):
+        if not isinstance(calls,list) or not all(isinstance(call,dict) for call in calls):
+            raise ValueError('the batch body must be a JSON list of objects')
+        results=[None]*len(calls)
+        pending={}
+        for i,call in enumerate(calls):
+            endpoint=call.get('endpoint')
+            try:
+                if endpoint=='predict':
+                    key,compute=self._call(endpoint,call)
+                    found,result=self.cache.get(key)
+                    if found:
+                        results[i]=result
+                    else:
+                        pending.setdefault(key[3:],[]).append((i,key))
+                else:
+                    results[i]=self._cached(endpoint,call)
+            except Exception as e:
+                results[i]=_errorResult(e)[1]
+        for (k,reg),waiting in pending.items():
+            ratings,errors=_predictPairs(self.predictMany,[(key[1],key[2]) for i,key in waiting],k,reg)
+            for (i,key),rating,error in zip(waiting,ratings,errors):
+                if error is None:
+                    self.cache.put(key,rating)
+                    results[i]=rating
+                else:
+                    results[i]=_errorResult(error)[1]
+        return results
+
+    #returns (http status, json-able result) for a request
+    def handle(self, endpoint, params):
+        start=time.time()
+        try:
+            if endpoint=='metrics':
+                return 200,self.metrics()
+            if params is None:
+                return 400,{'error':'bad request body'}
+            if endpoint=='batch':
+                result=self.batch(params)
+            else:
+                result=self._cached(endpoint,params)
+            status=200
+        except Exception as e:
+            status,result=_errorResult(e)
+        self.recordLatency(endpoint,time.time()-start)
+        return status,result
+
+    def recordLatency(self, endpoint, seconds):
+        with self.lock:
+            if endpoint not in self.latencies:
+                self.latencies[endpoint]=[0,deque(maxlen=self.latencyWindow)]
+            self.latencies[endpoint][0]+=1
+            self.latencies[endpoint][1].append(seconds)
+
+    #request counts and p50/p99 latency in milliseconds (over the last latencyWindow requests) per endpoint
+    def metrics(self):
+        with self.lock:
+            latencies=dict((endpoint,(count,list(window))) for endpoint,(count,window) in self.latencies.items())
+        metrics={'cache':{'hits':self.cache.hits,'misses':self.cache.misses,'size':len(self.cache.entries)}}
+        if self.coalescer:
+            metrics['coalesced']={'batches':self.coalescer.batches,'predictions':self.coalescer.predictions}
+        for endpoint,(count,window) in latencies.items():
+            metrics[endpoint]={'requests':count,'p50_ms':np.percentile(window,50)*1000.,'p99_ms':np.percentile(window,99)*1000.}
+        return metrics
+
+    #starts serving in a background thread (port 0 picks a free port) and returns the base url
+    def start(self, host='127.0.0.1', port=0):
+        self.httpd=_ThreadingHTTPServer((host,port),_RecoHandler)
+        self.httpd.service=self
+        thread=threading.Thread(target=self.httpd.serve_forever)
+        thread.daemon=True
+        thread.start()
+        return 'http://%s:%s' % (host,self.httpd.server_address[1])
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+#query string with the values utf-8 encoded
+def _encodeQuery(params):
+    return urllib.urlencode(dict((key,unicode(value).encode('utf-8')) for key,value in params.items()))
+
+
+#Sends numRequests requests (a mix of recos, predict and knearest for random users and games) from concurrency
+#threads to a running service and prints the throughput, the client side p50/p99 latency and the service metrics
+def loadTest(baseUrl, users, games, numRequests=2000, concurrency=8, seed=0):
+    rand=np.random.RandomState(seed)
+    kinds=rand.choice(['recos','predict','knearest'],numRequests,p=[0.3,0.5,0.2])
+    paths=[]
+    for kind in kinds:
+        user=users[rand.randint(len(users))]
+        game=games[rand.randint(len(games))]
+        if kind=='recos':
+            paths.append('/recos?'+_encodeQuery({'user':user}))
+        elif kind=='predict':
+            paths.append('/predict?'+_encodeQuery({'user':user,'game':game}))
+        else:
+            paths.append('/knearest?'+_encodeQuery({'game':game}))
+    local=threading.local()
+    def fetch(path):
+        if not hasattr(local,'session'):
+            local.session=requests.Session()
+        start=time.time()
+        status=local.session.get(baseUrl+path).status_code
+        return status,time.time()-start
+    pool=ThreadPool(concurrency)
+    start=time.time()
+    try:
+        results=pool.map(fetch,paths)
+    finally:
+        pool.close()
+        pool.join()
+    elapsed=time.time()-start
+    latencies=np.array([seconds for status,seconds in results])*1000.
+    errors=sum(1 for status,seconds in results if status!=200)
+    print '%s requests from %s threads in %.1fs: %.0f requests/sec, %s errors' % (numRequests,concurrency,elapsed,numRequests/elapsed,errors)
+    print 'client latency p50 %.1fms p99 %.1fms' % (np.percentile(latencies,50),np.percentile(latencies,99))
+    #names outside ascii (common on BGG) have to survive the query string
+    nonAscii=[user for user in users if any(ord(c)>127 for c in user)][:20]
+    answered=sum(1 for user in nonAscii if requests.get(baseUrl+'/recos?'+_encodeQuery({'user':user})).json())
+    print 'non-ASCII users with recommendations: %s/%s' % (answered,len(nonAscii))
+    metrics=requests.get(baseUrl+'/metrics').json()
+    print 'service metrics:', json.dumps(metrics,indent=1,sort_keys=True)
+    return metrics
+
+if __name__ == '__main__':
+    from buildPandasDF import Database
+    df=syntheticRatingsFrame(numUsers=5000,numGames=300)
+    #every tenth user and game gets a non-ASCII name
+    df['user']=df.user.map(lambda user: user+u'_M\xfcller' if user.endswith('0') else user)
+    df['gameName']=df.gameName.map(lambda game: game+u': \xc9dition' if game.endswith('0') else game)
+    db=Database(df)
+    db.populate_by_vectorizing()
+    service=RecoService(df,db)
+    baseUrl=service.start()
+    try:
+        loadTest(baseUrl,df.user.unique(),df.gameName.unique())
+    finally:
+        service.stop()
@@ -0,0 +1,218 @@
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import time
+import multiprocessing
+import multiprocessing.sharedctypes
+from syntheticRatings import syntheticRatingsFrame
+
+
+#Vectorized all-pairs item similarity, the engine behind Database.populate_by_vectorizing.
+#calculate_similarity re-filters the whole frame for every pair of games, which is O(G^2 * N).
+#Here the ratings are put into a sparse user x game matrix of user-mean-centered ratings X (the diffs
+#pearson_sim correlates) and a matching 0/1 matrix B of who rated what, once.  For every pair of games
+#(a, b) the sums pearsonr needs over the users who rated both come out of sparse matrix products:
+#    n    = B'B        common support
+#    sxy  = X'X        sum of x_a*x_b
+#    sx   = X'B        sum of x_a over the users who also rated b
+#    sy   = B'X        sum of x_b over the users who also rated a
+#    sxx  = (X.X)'B    sum of x_a^2 over the users who also rated b
+#    syy  = B'(X.X)    sum of x_b^2 over the users who also rated a
+#and rho = (n*sxy - sx*sy) / sqrt((n*sxx - sx^2) * (n*syy - sy^2)), which is pearsonr's correlation of the
+#two diff vectors.  Undefined correlations (fewer than two common users, or constant diffs) come out as 0
+#like in calculate_similarity.  The products are done blockSize columns at a time so only a G x blockSize
+#slice of each is in memory.
+
+
+#Returns (X, B, rowCounts): the csc matrices of user-mean-centered ratings and of rating indicators, with
+#one column per game numbered like gameNames (a dict gameName -> column, like Database.gameNames), and the
+#number of rows each game has in df.  Repeat ratings of a game by a user keep the first, like get_game_reviews.
+def buildRatingMatrices(df, gameNames):
+    numGames=len(gameNames)
+    gameCols=df.gameName.map(gameNames).values.astype(np.int64)
+    rowCounts=np.bincount(gameCols,minlength=numGames)
+    first=~df.duplicated(['user','gameName']).values
+    users,userRows=np.unique(df.user.values[first],return_inverse=True)
+    diffs=(df.rating.values-df.user_avg.values)[first].astype(np.float64)
+    shape=(len(users),numGames)
+    X=sp.csc_matrix((diffs,(userRows,gameCols[first])),shape=shape)
+    B=sp.csc_matrix((np.ones(len(diffs)),(userRows,gameCols[first])),shape=shape)
+    return X,B,rowCounts
+
+#turns the pair sums into correlations, with undefined ones set to 0
+def pearsonFromSums(n, sxy, sx, sy, sxx, syy):
+    varx=n*sxx-sx*sx
+    vary=n*syy-sy*sy
+    #differences of nearly equal sums are rounding noise, not variance
+    varx[varx<=1e-9*np.abs(n*sxx)]=0.
+    vary[vary<=1e-9*np.abs(n*syy)]=0.
+    den=np.sqrt(varx*vary)
+    rho=np.zeros(n.shape)
+    defined=(n>1)&(den>0)
+    rho[defined]=(n*sxy-sx*sy)[defined]/den[defined]
+    return np.clip(rho,-1.,1.)
+
+#The operands of the products: X, B and X with its entries squared (csc, for slicing game columns) and
+#their transposes (csr).  All of them share X's index arrays, and the transposes are the same arrays read
+#as csr, so nothing is copied.  B and X2 can be given as data arrays to share them too.
+class SimilarityOperands:
+    def __init__(self, X, Bdata=None, X2data=None):
+        X=X.tocsc()
+        if Bdata is None:
+            Bdata=np.ones(len(X.data))
+        if X2data is None:
+            X2data=X.data*X.data
+        shape=X.shape
+        self.X=X
+        self.B=sp.csc_matrix((Bdata,X.indices,X.indptr),shape=shape)
+        self.X2=sp.csc_matrix((X2data,X.indices,X.indptr),shape=shape)
+        self.XT=sp.csr_matrix((X.data,X.indices,X.indptr),shape=shape[::-1])
+        self.BT=sp.csr_matrix((Bdata,X.indices,X.indptr),shape=shape[::-1])
+        self.X2T=sp.csr_matrix((X2data,X.indices,X.indptr),shape=shape[::-1])
+
+    #the similarity and support of the games in rows against the games in columns (slices or index arrays),
+    #as dense len(rows) x len(columns) arrays.  Each entry's sums run over the users in the same order
+    #whatever rows and columns are asked for, so tiles and blocks give bit-for-bit the same values
+    def block(self, columns, rows=slice(None)):
+        XJ=self.X[:,columns]
+        BJ=self.B[:,columns]
+        BT=self.BT[rows]
+        XT=self.XT[rows]
+        n=(BT*BJ).toarray()
+        sxy=(XT*XJ).toarray()
+        sx=(XT*BJ).toarray()
+        sy=(BT*XJ).toarray()
+        sxx=(self.X2T[rows]*BJ).toarray()
+        syy=(BT*self.X2[:,columns]).toarray()
+        return pearsonFromSums(n,sxy,sx,sy,sxx,syy),n.astype(np.int64)
+
+#yields (columns, sim, sup) for consecutive column blocks covering every game
+def iterSimilarityBlocks(X, B, blockSize=None):
+    operands=SimilarityOperands(X,B.tocsc().data)
+    numGames=X.shape[1]
+    blockSize=blockSize or numGames
+    for start in range(0,numGames,blockSize):
+        columns=slice(start,min(start+blockSize,numGames))
+        sim,sup=operands.block(columns)
+        yield columns,sim,sup
+
+#Fills the dense similarity and support arrays the way populate_by_calculating does: off-diagonal pairs get
+#the pearson correlation and common support, the diagonal gets 1 and the game's number of ratings
+def populateSimilarityArrays(df, gameNames, database_sim, database_sup, blockSize=None):
+    X,B,rowCounts=buildRatingMatrices(df,gameNames)
+    for columns,sim,sup in iterSimilarityBlocks(X,B,blockSize):
+        database_sim[:,columns]=sim
+        database_sup[:,columns]=sup
+    np.fill_diagonal(database_sim,1.)
+    database_sup[np.diag_indices_from(database_sup)]=rowCounts
+
+
+#Multi-core version.  The G x G arrays are split into tileSize x tileSize tiles above the diagonal, computed
+#by a pool of numWorkers processes and mirrored below it.  The rating matrix arrays and the output arrays live
+#in shared memory that the forked workers inherit, so nothing is pickled to them except tile coordinates and
+#every worker writes its tiles straight into the output.  Because every entry is computed from the same sums
+#in the same order (see SimilarityOperands.block), the result is bit-for-bit the same as populateSimilarityArrays.
+
+#a numpy array backed by shared memory that forked processes write into in place
+def sharedArray(shape, dtype):
+    dtype=np.dtype(dtype)
+    raw=multiprocessing.sharedctypes.RawArray('b',max(1,int(np.prod(shape))*dtype.itemsize))
+    return np.frombuffer(raw,dtype=dtype,count=int(np.prod(shape))).reshape(shape)
+
+#set in the parent right before the pool forks, and inherited by the workers
+_tileState={}
+
+def _computeTile(tile):
+    rows,columns=tile
+    operands=_tileState['operands']
+    sim,sup=operands.block(columns,rows)
+    _tileState['sim'][rows,columns]=sim
+    _tileState['sup'][rows,columns]=sup
+    _tileState['sim'][columns,rows]=sim.T
+    _tileState['sup'][columns,rows]=sup.T
+
+def tileSlices(numGames, tileSize):
+    starts=range(0,numGames,tileSize)
+    edges=[slice(start,min(start+tileSize,numGames)) for start in starts]
+    return [(edges[i],edges[j]) for i in range(len(edges)) for j in range(i,len(edges))]
+
+#Returns shared-memory (database_sim, database_sup) arrays for the games in gameNames
+def parallelSimilarityArrays(df, gameNames, numWorkers=None, tileSize=500):
+    X,B,rowCounts=buildRatingMatrices(df,gameNames)
+    X=X.tocsc()
+    numGames=X.shape[1]
+    shared=[]
+    for array in (X.data,X.indices,X.indptr,np.ones(len(X.data)),X.data*X.data):
+        copy=sharedArray(array.shape,array.dtype)
+        copy[:]=array
+        shared.append(copy)
+    data,indices,indptr,Bdata,X2data=shared
+    sharedX=sp.csc_matrix((data,indices,indptr),shape=X.shape)
+    database_sim=sharedArray((numGames,numGames),np.float64)
+    database_sup=sharedArray((numGames,numGames),np.int64)
+    _tileState.update(operands=SimilarityOperands(sharedX,Bdata,X2data),sim=database_sim,sup=database_sup)
+    tiles=tileSlices(numGames,tileSize)
+    try:
+        if numWorkers==1:
+            for tile in tiles:
+                _computeTile(tile)
+        else:
+            pool=multiprocessing.Pool(numWorkers)
+            try:
+                pool.map(_computeTile,tiles,chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        _tileState.clear()
+    np.fill_diagonal(database_sim,1.)
+    database_sup[np.diag_indices_from(database_sup)]=rowCounts
+    return database_sim,database_sup
+
+
+##########################################
+############## Benchmark ##############
+##########################################
+
+#Times the matrix build and the all-pairs computation on synthetic ratings frames (see syntheticRatings.py)
+#with 100, 1k and 10k games.  Blocks are computed and dropped, so the 10k run doesn't need the dense 10k x 10k
+#arrays in memory.
+def benchmarkSimilarityEngine(gameCounts=(100,1000,10000), usersPerGame=20, ratingsPerUser=40, blockSize=1000):
+    results=[]
+    for numGames in gameCounts:
+        df=syntheticRatingsFrame(numUsers=numGames*usersPerGame,numGames=numGames,ratingsPerUser=ratingsPerUser)
+        gameNames=dict((v,k) for (k,v) in enumerate(df.gameName.unique()))
+        start=time.time()
+        X,B,rowCounts=buildRatingMatrices(df,gameNames)
+        built=time.time()
+        numPairs=0
+        for columns,sim,sup in iterSimilarityBlocks(X,B,blockSize):
+            numPairs+=sim.size
+        done=time.time()
+        print '%6s games | %8s ratings | build %6.2fs | all pairs %7.2fs | %10.0f pairs/sec' % (
+            numGames,len(df),built-start,done-built,numPairs/(done-built))
+        results.append((numGames,len(df),built-start,done-built))
+    return results
+
+#Times parallelSimilarityArrays on one synthetic frame for each worker count, and checks every run is
+#bit-for-bit the same as the first one
+def benchmarkParallelSimilarity(numGames=3000, workerCounts=(1,2,4,8), usersPerGame=20, ratingsPerUser=40, tileSize=500):
+    df=syntheticRatingsFrame(numUsers=numGames*usersPerGame,numGames=numGames,ratingsPerUser=ratingsPerUser)
+    gameNames=dict((v,k) for (k,v) in enumerate(df.gameName.unique()))
+    reference=None
+    results=[]
+    for numWorkers in workerCounts:
+        start=time.time()
+        sim,sup=parallelSimilarityArrays(df,gameNames,numWorkers,tileSize)
+        elapsed=time.time()-start
+        if reference is None:
+            reference=(sim,sup,elapsed)
+        identical=np.array_equal(sim,reference[0]) and np.array_equal(sup,reference[1])
+        print '%3s workers | %7.2fs | speedup %5.2fx | identical: %s' % (numWorkers,elapsed,reference[2]/elapsed,identical)
+        results.append((numWorkers,elapsed,identical))
+    return results
+
+if __name__ == '__main__':
+    benchmarkSimilarityEngine()
+    benchmarkParallelSimilarity()
@@ -0,0 +1,48 @@
+
+import numpy as np
+import pandas as pd
+
+
+#the (users x numTastes, games x numTastes) latent taste factors syntheticRatingsFrame uses with numTastes
+def syntheticTastes(numUsers, numGames, numTastes, seed=0):
+    tasteRand=np.random.RandomState(seed+1)
+    userTastes=tasteRand.normal(0.,1.,(numUsers,numTastes))
+    gameTastes=tasteRand.normal(0.,1.,(numGames,numTastes))
+    return userTastes,gameTastes
+
+#Builds a ratings frame shaped like smallDf (user, gameID, gameName, rating plus the averages and counts
+#recompute_frame adds) for benchmarks.  Game popularity is skewed like BGG's (a few games have most of the
+#ratings), each user rates about ratingsPerUser distinct games, and ratings are a game quality plus a user
+#bias plus noise, rounded to halves and clipped to 1-10.  With numTastes, users and games also get that many
+#latent taste factors whose (tasteScale weighted) dot product is added to the ratings, so that games have real
+#neighbors; without them item similarities are just noise.
+def syntheticRatingsFrame(numUsers=2000, numGames=100, ratingsPerUser=25, seed=0, numTastes=0, tasteScale=0.6):
+    rand=np.random.RandomState(seed)
+    popularity=1./np.arange(1,numGames+1)**0.8
+    popularity/=popularity.sum()
+    counts=np.clip(rand.poisson(ratingsPerUser,numUsers),1,numGames)
+    userCodes=np.repeat(np.arange(numUsers),counts)
+    gameCodes=np.empty(len(userCodes),dtype=np.int64)
+    start=0
+    for count in counts:
+        gameCodes[start:start+count]=rand.choice(numGames,count,replace=False,p=popularity)
+        start+=count
+    quality=rand.normal(7.,0.8,numGames)
+    bias=rand.normal(0.,0.7,numUsers)
+    ratings=quality[gameCodes]+bias[userCodes]+rand.normal(0.,1.,len(userCodes))
+    if numTastes:
+        userTastes,gameTastes=syntheticTastes(numUsers,numGames,numTastes,seed)
+        ratings+=tasteScale*(userTastes[userCodes]*gameTastes[gameCodes]).sum(axis=1)
+    ratings=np.clip(np.round(ratings*2)/2.,1.,10.)
+    gameIDs=np.arange(1,numGames+1)*7+100
+    df=pd.DataFrame({'user':np.array(['user%s' % i for i in range(numUsers)],dtype=object)[userCodes],
+                     'gameID':gameIDs[gameCodes],
+                     'gameName':np.array(['Game %s' % i for i in range(numGames)],dtype=object)[gameCodes],
+                     'rating':ratings},columns=['user','gameID','gameName','rating'])
+    userGroups=df.groupby('user')['rating']
+    gameGroups=df.groupby('gameName')['rating']
+    df['game_avg']=gameGroups.transform(np.mean)
+    df['game_review_count']=gameGroups.transform(len)
+    df['user_avg']=userGroups.transform(np.mean)
+    df['user_review_count']=userGroups.transform(len)
+    return df
@@ -0,0 +1,197 @@
+
+import os
+import time
+import hashlib
+import random
+import shutil
+import requests
+from multiprocessing.pool import ThreadPool
+import geekscraper
+from cachedSession import CachedSession
+from crawlManifest import CrawlManifest
+from featureCache import FeatureCache
+from mockGeekServer import MockGeekServer
+
+
+#Downloads the game thumbnails, replacing the serial loop that reparsed every saved page for its image link.
+#The image urls come from the feature cache (extractGameFeatures keeps the thumbnail url of every page it
+#parses), and the images are fetched on a bounded pool of threads through the shared session, with the
+#review pages' rate limiter and retries.  Games that share an image url are fetched once, and an image whose
+#bytes (sha1) are already saved for another game is hard linked to that file instead of being written again
+#(BGG uses one placeholder image for games without a picture).
+#What has been saved is recorded in the crawl manifest (see crawlManifest.py) and the files on disk are
+#listed once into a set, so a re-run skips every game whose thumbnail url hasn't changed without a request.
+#Images are written in binary mode to a temporary file that is renamed into place, so an interrupted run
+#never leaves half an image behind.
+
+def thumbnailPath(thumbDir, gameID):
+    return os.path.join(thumbDir,'%s_%s.jpg' % (gameID[0],gameID[1]))
+
+#fetches one image in a pool thread, retrying with exponential backoff when the server is busy or the request
+#fails (connection errors, timeouts) like getReviewPageResponse.  Returns (url, image bytes, None), or
+#(url, None, error message) if it couldn't be fetched
+def _fetchImage(url, session, rateLimiter, maxRetries, backoff):
+    for attempt in range(maxRetries+1):
+        if rateLimiter:
+            rateLimiter.wait(url)
+        try:
+            response=session.get(url,headers={'User-Agent':'Mozilla/5.0'})
+            if response.status_code not in geekscraper.RETRY_STATUS_CODES:
+                if response.status_code>=400:
+                    return url,None,'status %s' % response.status_code
+                return url,response.content,None
+            error='status %s' % response.status_code
+        except requests.RequestException as e:
+            error=e
+        if attempt<maxRetries:
+            time.sleep(backoff*2**attempt)
+    return url,None,'giving up after %s retries: %s' % (maxRetries,error)
+
+def _writeImage(path, body):
+    tmpPath=path+'.tmp'
+    with open(tmpPath,'wb') as fout:
+        fout.write(body)
+    os.rename(tmpPath,path)
+
+#points path at the file already holding the same image, copying it where hard links aren't supported
+def _linkImage(existingPath, path):
+    if os.path.exists(path):
+        os.remove(path)
+    try:
+        os.link(existingPath,path)
+    except (OSError,AttributeError):
+        shutil.copyfile(existingPath,path)
+
+#Downloads the thumbnails of the listed gameID tuples (IDnumber, name) to thumbDir, using the urls in the
+#FeatureCache cache and recording them in the CrawlManifest manifest.  Images are fetched on numWorkers
+#threads (numWorkers=1 fetches in this thread) through session, by default the scraper's shared one.
+#Thumbnails saved before the manifest tracked them are kept and recorded.  Returns a dictionary of statistics
+def downloadThumbnails(games, cache, manifest, thumbDir='google_drive/game_thumbnails/', numWorkers=8,
+                       rateLimiter=None, session=None, maxRetries=4, backoff=1.):
+    session=session or geekscraper.session
+    start=time.time()
+    if not os.path.isdir(thumbDir):
+        os.makedirs(thumbDir)
+    onDisk=set(os.listdir(thumbDir))
+    saved=manifest.thumbnailsSaved()
+    urls=cache.thumbnailUrls(games)
+    #the games to fetch, keyed by image url
+    todo={}
+    noUrl=[]
+    unchanged=0
+    for gameID in games:
+        url=urls.get(gameID)
+        if url is None:
+            noUrl.append(gameID)
+            continue
+        path=thumbnailPath(thumbDir,gameID)
+        if os.path.basename(path) in onDisk:
+            if saved.get(gameID[0])==url:
+                unchanged+=1
+                continue
+            if gameID[0] not in saved:
+                with open(path,'rb') as fin:
+                    manifest.markThumbnailSaved(gameID[0],url,hashlib.sha1(fin.read()).hexdigest(),path)
+                unchanged+=1
+                continue
+        todo.setdefault(url,[]).append(gameID)
+    fetchStart=time.time()
+    written=linked=numBytes=0
+    failed=[]
+    fetch=lambda url: _fetchImage(url,session,rateLimiter,maxRetries,backoff)
+    pool=ThreadPool(numWorkers) if numWorkers!=1 and len(todo)>1 else None
+    try:
+        results=pool.imap_unordered(fetch,todo) if pool else (fetch(url) for url in todo)
+        for url,body,error in results:
+            if body is None:
+                failed.extend((gameID,error) for gameID in todo[url])
+                continue
+            sha1=hashlib.sha1(body).hexdigest()
+            for gameID in todo[url]:
+                path=thumbnailPath(thumbDir,gameID)
+                existingPath=manifest.thumbnailPathForHash(sha1)
+                if existingPath and existingPath!=path and os.path.exists(existingPath):
+                    _linkImage(existingPath,path)
+                    linked+=1
+                else:
+                    _writeImage(path,body)
+                    written+=1
+                    numBytes+=len(body)
+                manifest.markThumbnailSaved(gameID[0],url,sha1,path)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    end=time.time()
+    stats={'games':len(games),'unchanged':unchanged,'noUrl':len(noUrl),'fetched':len(todo),'written':written,
+           'linked':linked,'failed':len(failed),'bytes':numBytes,'seconds':end-start,'fetchSeconds':end-fetchStart}
+    stats['imagesPerSec']=len(todo)/stats['fetchSeconds'] if stats['fetchSeconds']>0 else float('inf')
+    for gameID in noUrl:
+        print 'no thumbnail url for', gameID
+    for gameID,error in failed:
+        print 'unable to download the thumbnail for', gameID, error
+    print ('%(games)s games in %(seconds).1fs: %(fetched)s images fetched (%(imagesPerSec).1f images/sec), '
+           '%(written)s written, %(linked)s linked to identical images, %(unchanged)s unchanged, %(failed)s failed' % stats)
+    return stats
+
+
+#Serves numGames synthetic thumbnails from a MockGeekServer with latency seconds per request: a quarter of the
+#games share the placeholder image url, and the rest have their own url with one of numImages images.
+#Times the old one-at-a-time loop (fetch, write) against downloadThumbnails, checks both saved the same
+#images, and compares the bytes on disk.  A re-run shows how many requests the manifest saves
+def benchmarkThumbnails(numGames=100, numImages=30, latency=0.2, numWorkers=8, workDir='thumbnailBenchmark'):
+    rand=random.Random(0)
+    images=[''.join(chr(rand.randint(0,255)) for i in range(rand.randint(3000,8000))) for j in range(numImages+1)]
+    server=MockGeekServer(latency=latency)
+    baseUrl=server.start()
+    if os.path.isdir(workDir):
+        shutil.rmtree(workDir)
+    os.makedirs(workDir)
+    cache=FeatureCache(os.path.join(workDir,'features.sqlite'))
+    manifest=CrawlManifest(os.path.join(workDir,'manifest.sqlite'))
+    try:
+        server.addFile('/images/placeholder.jpg',images[numImages],'image/jpeg')
+        games=[(str(1000+i),'game-%s' % i) for i in range(numGames)]
+        for i,gameID in enumerate(games):
+            path='/images/placeholder.jpg' if i%4==0 else '/images/pic%s.jpg' % i
+            if path not in server.files:
+                server.addFile(path,images[i%numImages],'image/jpeg')
+            cache.storeFeatures('page%s' % i,{},baseUrl+path)
+            cache.setPage(gameID,'page%s' % i)
+        session=CachedSession(None,poolSize=numWorkers)
+        urls=cache.thumbnailUrls(games)
+        serialDir=os.path.join(workDir,'serial')
+        os.makedirs(serialDir)
+        start=time.time()
+        for gameID in games:
+            im=session.get(urls[gameID],headers={'User-Agent':'Mozilla/5.0'}).content
+            with open(thumbnailPath(serialDir,gameID),'wb') as fout:
+                fout.write(im)
+        serialTime=time.time()-start
+        poolDir=os.path.join(workDir,'pool')
+        requestCount=server.requestCount
+        stats=downloadThumbnails(games,cache,manifest,poolDir,numWorkers,session=session)
+        poolRequests=server.requestCount-requestCount
+        requestCount=server.requestCount
+        rerun=downloadThumbnails(games,cache,manifest,poolDir,numWorkers,session=session)
+        rerunRequests=server.requestCount-requestCount
+        same=True
+        for gameID in games:
+            with open(thumbnailPath(serialDir,gameID),'rb') as fin:
+                serialImage=fin.read()
+            with open(thumbnailPath(poolDir,gameID),'rb') as fin:
+                same=same and fin.read()==serialImage
+        #hard links to one image count once
+        uniqueBytes=lambda directory: sum(os.stat(os.path.join(directory,filen)).st_size for filen in
+                                          dict((os.stat(os.path.join(directory,filen)).st_ino,filen)
+                                               for filen in os.listdir(directory)).values())
+        print 'serial loop:     %6.2fs | %4s requests | %7.1f KB on disk' % (serialTime,numGames,uniqueBytes(serialDir)/1e3)
+        print 'thumbnail pool:  %6.2fs | %4s requests | %7.1f KB on disk' % (stats['seconds'],poolRequests,uniqueBytes(poolDir)/1e3)
+        print 're-run:          %6.2fs | %4s requests' % (rerun['seconds'],rerunRequests)
+        print 'same images:', same
+    finally:
+        cache.close()
+        manifest.close()
+        server.stop()
+        shutil.rmtree(workDir)
+    return serialTime,stats,rerun